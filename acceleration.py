@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# acceleration.py - 학습 가속 옵션 (bf16 autocast, torch.compile, torch.backends 빠른 경로)
+# 모두 opt-in이고, 지원하지 않는 환경이면 경고만 찍고 fp32 eager로 돌아간다.
+#
+#   precision 'bf16' : torch.autocast(bfloat16) - matmul/attention은 bf16, 손실/정규화는 autocast가 fp32로 유지
+#                      (bf16은 지수 범위가 fp32와 같아서 GradScaler 필요 없음)
+#   compile          : torch.compile(model) - 워밍업 forward/backward에서 실패하면 eager 모델 그대로 사용
+#   enable_fastpaths : MHA/TransformerEncoderLayer 네이티브 빠른 경로, cuDNN autotune
+#                      (인코더 빠른 경로는 eval + no_grad에서만 동작: test_transformer_model, predict_enhanced)
+
+import contextlib
+import sys
+
+import torch
+
+PRECISIONS = ('fp32', 'bf16')
+
+
+def enable_fastpaths(device):
+    """torch.backends 빠른 경로 켜기 (기본값이 꺼져 있는 버전/설정 대비)"""
+    mha = getattr(torch.backends, 'mha', None)
+    if mha is not None and hasattr(mha, 'set_fastpath_enabled'):
+        # key padding 마스크가 있으면 인코더가 nested tensor로 패딩 위치 계산을 건너뜀
+        mha.set_fastpath_enabled(True)
+    if torch.backends.mkldnn.is_available():
+        torch.backends.mkldnn.enabled = True
+    if device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+        torch.backends.cuda.matmul.allow_tf32 = True
+
+
+def bf16_supported(device):
+    """이 디바이스에서 bf16 autocast matmul이 실제로 도는지"""
+    if device.type == 'cuda':
+        return torch.cuda.is_bf16_supported()
+    try:
+        with torch.autocast(device.type, dtype=torch.bfloat16):
+            result = torch.ones(2, 2, device=device) @ torch.ones(2, 2, device=device)
+        return result.dtype == torch.bfloat16
+    except (RuntimeError, TypeError):
+        return False
+
+
+def resolve_precision(precision, device):
+    """요청한 precision -> 실제로 쓸 precision (bf16을 못 쓰면 fp32)"""
+    if precision not in PRECISIONS:
+        raise ValueError(f"알 수 없는 precision: {precision} (가능: {', '.join(PRECISIONS)})")
+    if precision == 'bf16' and not bf16_supported(device):
+        print(f"bf16 autocast 미지원 ({device.type}), fp32로 학습", file=sys.stderr)
+        return 'fp32'
+    return precision
+
+
+def autocast(device, precision):
+    """forward/손실 계산을 감쌀 컨텍스트 (fp32면 아무것도 안 함)"""
+    if precision == 'bf16':
+        return torch.autocast(device.type, dtype=torch.bfloat16)
+    return contextlib.nullcontext()
+
+
+def compile_model(model, example_args, example_kwargs=None, precision='fp32', device=None):
+    """
+    torch.compile로 감싼 모델 반환, 실패하면 원래 모델
+    example_args/example_kwargs: 워밍업 호출 인자 (forward + backward 한 번으로 그래프를 미리 만들어 실패를 여기서 잡음)
+    반환된 모델은 원래 모델과 파라미터를 공유하므로 state_dict 저장은 원래 모델로 한다
+    """
+    if not hasattr(torch, 'compile'):
+        print("torch.compile 없음 (torch 2.0 미만), eager로 학습", file=sys.stderr)
+        return model
+    compiled = torch.compile(model)
+    device = device or next(model.parameters()).device
+    try:
+        with autocast(device, precision):
+            output = compiled(*example_args, **(example_kwargs or {}))
+        output.float().sum().backward()
+    except Exception as e:  # 백엔드 컴파일러가 없거나 지원하지 않는 연산
+        print(f"torch.compile 실패, eager로 학습: {type(e).__name__}: {e}", file=sys.stderr)
+        torch._dynamo.reset()
+        return model
+    finally:
+        model.zero_grad(set_to_none=True)
+    return compiled
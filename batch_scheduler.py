@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# batch_scheduler.py - 동시 추론 요청 마이크로 배치 스케줄러
+# 워커 스레드들이 submit()으로 메시지를 넣으면 스케줄러 스레드 하나가
+# 첫 요청부터 max_wait_ms 동안(또는 max_batch_size개가 찰 때까지) 모아서 run_batch 한 번으로 처리하고,
+# 결과를 요청한 쪽에 돌려준다. 모델 forward는 한 번에 하나의 배치만 돈다.
+#
+# max_queue를 주면 대기열이 그 수를 넘을 때 submit이 바로 QueueFull을 던진다 (백프레셔, 재시도 가능 오류).
+# 워커(prediction_worker)는 요청을 받을 때 --max-queue로 이미 막으므로 상한 없이(None) 만든다.
+#
+# 사용 예 (predict_enhanced.py 워커):
+#   batcher = MicroBatcher(lambda messages: predict_batch_with_new_model(messages, ...), max_batch_size=8)
+#   response = batcher.submit(message)
+
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future
+
+
+class QueueFull(Exception):
+    """대기 중인 요청이 max_queue개라 받을 수 없음 (잠시 후 재시도)"""
+
+    retryable = True
+
+
+class MicroBatcher:
+    """
+    run_batch: 항목 목록 -> 같은 순서의 결과 목록 (예외가 나면 그 배치의 모든 요청에 전달)
+    max_batch_size: 한 배치의 최대 항목 수 (1이면 배치 없이 한 건씩)
+    max_wait_ms: 첫 요청이 들어온 뒤 더 모으려고 기다리는 최대 시간
+    max_queue: 배치를 기다리는 요청 수 상한 (넘으면 QueueFull, None이면 상한 없음)
+    """
+
+    def __init__(self, run_batch, max_batch_size=8, max_wait_ms=5.0, max_queue=None):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue or 0)
+        self._lock = threading.Lock()
+        self._stats = {'batches': 0, 'requests': 0, 'rejected': 0, 'max_batch_seen': 0}
+        self._closed = False
+        self._thread = threading.Thread(target=self._loop, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit_async(self, item):
+        """요청을 넣고 Future 반환 (대기열이 가득 차면 QueueFull)"""
+        if self._closed:
+            raise RuntimeError("닫힌 스케줄러입니다")
+        future = Future()
+        try:
+            self._queue.put_nowait((item, future))
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise QueueFull(f"요청 대기열이 가득 참 ({self.max_queue}개)")
+        return future
+
+    def submit(self, item, timeout=None):
+        """요청을 넣고 결과가 나올 때까지 기다림"""
+        return self.submit_async(item).result(timeout)
+
+    def _collect(self):
+        """첫 요청을 기다린 뒤 max_wait 안에 들어온 요청을 max_batch_size개까지 모음"""
+        batch = [self._queue.get()]
+        if batch[0] is None:
+            return None
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                entry = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if entry is None:
+                self._queue.put(None)  # 남은 배치를 처리한 뒤 종료
+                break
+            batch.append(entry)
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            items = [item for item, _ in batch]
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"run_batch 결과 수가 다름: {len(results)} != {len(items)}")
+            except Exception as e:
+                print(f"배치 처리 에러 ({len(items)}개): {e}", file=sys.stderr)
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+            with self._lock:
+                self._stats['batches'] += 1
+                self._stats['requests'] += len(items)
+                self._stats['max_batch_seen'] = max(self._stats['max_batch_seen'], len(items))
+
+    def stats(self):
+        """배치 수, 처리한 요청 수, 평균 배치 크기, 거절 수, 현재 대기열 길이"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['mean_batch_size'] = round(stats['requests'] / stats['batches'], 2) if stats['batches'] else 0
+        stats['queue_depth'] = self._queue.qsize()
+        stats.update({'max_batch_size': self.max_batch_size, 'max_wait_ms': self.max_wait * 1000,
+                      'max_queue': self.max_queue})
+        return stats
+
+    def close(self):
+        """대기 중인 요청을 처리한 뒤 스케줄러 스레드 종료"""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+# batch_scorer.py - 하이브리드 매처용 NumPy 배치 점수 엔진
+# 데이터셋 특징(길이, 단어 id, 문자 개수, 특별 패턴 플래그)을 배열로 들고 있다가
+# 여러 메시지를 한 번의 행렬 연산으로 점수 매긴다.
+#
+# 키워드/길이/특별 패턴 점수와 유사도 상한(문자 다중집합 교집합)은 (메시지 x 데이터셋)
+# 행렬로 한 번에 계산하고, SequenceMatcher는 상한이 k번째 점수 이상인 항목에만 돌린다.
+# 그래서 결과 순서는 MatchIndex.top_k / 전체 스캔과 같다.
+
+import heapq
+
+try:
+    import numpy as np
+except ImportError:  # numpy가 없으면 MatchIndex로 한 건씩 처리
+    np = None
+
+from match_index import MatchQuery, get_match_index
+from similarity import get_similarity
+
+# 한 번에 만들 (메시지 x 데이터셋) 행렬 크기 상한 (float64 기준 약 32MB)
+MAX_BATCH_CELLS = 4_000_000
+
+
+def _postings(rows_by_key, num_keys):
+    """{key_id: [(row, value), ...]} -> CSC 형태 (indptr, rows, values)"""
+    indptr = np.zeros(num_keys + 1, dtype=np.int64)
+    for key_id, pairs in rows_by_key.items():
+        indptr[key_id + 1] = len(pairs)
+    np.cumsum(indptr, out=indptr)
+
+    rows = np.empty(indptr[-1], dtype=np.int32)
+    values = np.empty(indptr[-1], dtype=np.int32)
+    for key_id, pairs in rows_by_key.items():
+        start = indptr[key_id]
+        rows[start:start + len(pairs)] = [row for row, _ in pairs]
+        values[start:start + len(pairs)] = [value for _, value in pairs]
+    return indptr, rows, values
+
+
+class BatchScorer:
+    def __init__(self, dataset, similarity=None):
+        if np is None:
+            raise ImportError("BatchScorer에는 numpy가 필요합니다")
+
+        self.index = get_match_index(dataset, similarity)
+        self.dataset = dataset
+        entries = self.index.entries
+
+        # 길이 / 특별 패턴 플래그 (N,), (N, 3)
+        self.raw_lengths = np.array([entry.raw_len for entry in entries], dtype=np.float64)
+        self.lower_lengths = np.array([len(entry.lower) for entry in entries], dtype=np.float64)
+        self.flags = np.array([entry.flags for entry in entries], dtype=bool).reshape(len(entries), 3)
+
+        # 단어 id 희소 행렬 (단어 -> 항목, CSC)
+        self.token_ids = {}
+        token_rows = {}
+        for row, entry in enumerate(entries):
+            for word in entry.words:
+                token_id = self.token_ids.setdefault(word, len(self.token_ids))
+                token_rows.setdefault(token_id, []).append((row, 1))
+        self.token_indptr, self.token_rows, _ = _postings(token_rows, len(self.token_ids))
+
+        # 문자 개수 희소 행렬 (문자 -> (항목, 개수), CSC) - 유사도 상한용
+        self.char_ids = {}
+        char_rows = {}
+        for row, entry in enumerate(entries):
+            for char, count in entry.char_counts.items():
+                char_id = self.char_ids.setdefault(char, len(self.char_ids))
+                char_rows.setdefault(char_id, []).append((row, count))
+        self.char_indptr, self.char_rows, self.char_counts = _postings(char_rows, len(self.char_ids))
+
+    def __len__(self):
+        return len(self.index)
+
+    def _gather(self, queries, key_ids_of, indptr, rows, values=None):
+        """
+        메시지별 key id 목록에 해당하는 포스팅을 모아 (B, N) 누적 행렬로 만든다
+        values가 있으면 각 값을 메시지 쪽 개수로 잘라서 더한다 (min(count_q, count_e))
+        """
+        num_items = len(self)
+        flat_index = []
+        weights = []
+        for b, query in enumerate(queries):
+            for key_id, query_count in key_ids_of(query):
+                start, end = indptr[key_id], indptr[key_id + 1]
+                flat_index.append(b * num_items + rows[start:end])
+                if values is None:
+                    weights.append(np.ones(end - start))
+                else:
+                    weights.append(np.minimum(values[start:end], query_count))
+
+        total = len(queries) * num_items
+        if not flat_index:
+            return np.zeros((len(queries), num_items))
+        counts = np.bincount(np.concatenate(flat_index), weights=np.concatenate(weights), minlength=total)
+        return counts.reshape(len(queries), num_items)
+
+    def score_matrix(self, queries):
+        """
+        (B, N) 점수 행렬들 계산
+        반환: (상한 점수, 키워드 점수)
+        """
+        query_raw = np.array([q.raw_len for q in queries], dtype=np.float64)[:, None]
+        query_lower = np.array([len(q.lower) for q in queries], dtype=np.float64)[:, None]
+        query_words = np.array([len(q.words) for q in queries], dtype=np.float64)[:, None]
+        query_flags = np.array([q.flags for q in queries], dtype=bool).reshape(len(queries), 3)
+
+        # 2. 키워드 매칭: 공통 단어 수 / 메시지 단어 수
+        common = self._gather(
+            queries,
+            lambda q: [(self.token_ids[w], 1) for w in q.words if w in self.token_ids],
+            self.token_indptr, self.token_rows
+        )
+        keyword = common / np.maximum(query_words, 1)
+
+        # 3. 길이 유사성
+        length = np.maximum(0, 1 - np.abs(query_raw - self.raw_lengths[None, :]) / 20)
+
+        # 4. 특별 패턴 매칭 (안녕/hi/hello, 뭐/뭔, ?)
+        both = query_flags[:, None, :] & self.flags[None, :, :]
+        special = both[:, :, 0] * 0.3 + both[:, :, 1] * 0.3 + both[:, :, 2] * 0.2
+
+        # 1. 유사도 상한: 2 * 문자 다중집합 교집합 / 길이 합 (quick_ratio)
+        #    quick_ratio로 묶이지 않는 백엔드(ngram)는 상한 1.0
+        if self.index.similarity.quick_ratio_bounded:
+            matches = self._gather(
+                queries,
+                lambda q: [(self.char_ids[c], n) for c, n in q.char_counts.items() if c in self.char_ids],
+                self.char_indptr, self.char_rows, self.char_counts
+            )
+            lengths = query_lower + self.lower_lengths[None, :]
+            similarity_bound = np.where(lengths > 0, 2.0 * matches / np.maximum(lengths, 1), 1.0)
+        else:
+            similarity_bound = np.ones((len(queries), len(self)))
+
+        # 5. 종합 점수 상한
+        upper = similarity_bound * 0.4 + keyword * 0.3 + length * 0.1 + special * 0.2
+        return upper, keyword
+
+    def _top_k_from_bounds(self, query, upper, k, mask):
+        """상한이 높은 순서로 정확한 점수를 계산하다가 k번째 점수보다 낮아지면 중단"""
+        order = np.argsort(-upper, kind='stable')
+        scored = {}
+        best_scores = []
+
+        for idx in order:
+            idx = int(idx)
+            if mask is not None and not mask[idx]:
+                continue
+            if len(best_scores) >= k and upper[idx] < best_scores[0]:
+                break
+            scored[idx] = self.index.score(query, idx)
+            heapq.heappush(best_scores, scored[idx][0])
+            if len(best_scores) > k:
+                heapq.heappop(best_scores)
+
+        ranked = sorted(scored.items(), key=lambda x: (-x[1][0], x[0]))[:k]
+        return [self.index._candidate(idx, s) for idx, s in ranked]
+
+    def top_k_batch(self, messages, k=5, masks=None):
+        """
+        여러 메시지의 상위 k개 후보를 한 번에 계산
+        masks: 메시지별 (N,) bool 배열 또는 None (허용할 항목만 True)
+        """
+        results = []
+        chunk = max(1, MAX_BATCH_CELLS // max(len(self), 1))
+
+        for start in range(0, len(messages), chunk):
+            queries = [MatchQuery(m, self.index.similarity) for m in messages[start:start + chunk]]
+            upper, _ = self.score_matrix(queries)
+            for b, query in enumerate(queries):
+                mask = masks[start + b] if masks is not None else None
+                results.append(self._top_k_from_bounds(query, upper[b], k, mask))
+
+        return results
+
+
+_cached_scorer = None
+
+
+def get_batch_scorer(dataset, similarity=None):
+    """같은 데이터셋 객체/유사도 백엔드에 대해서는 배열을 한 번만 만든다 (numpy가 없으면 None)"""
+    global _cached_scorer
+    if np is None:
+        return None
+    similarity = get_similarity(similarity)
+    if (_cached_scorer is None or _cached_scorer.dataset is not dataset
+            or _cached_scorer.index.similarity is not similarity):
+        _cached_scorer = BatchScorer(dataset, similarity)
+    return _cached_scorer
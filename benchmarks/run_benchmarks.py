@@ -0,0 +1,665 @@
+#!/usr/bin/env python3
+# benchmarks/run_benchmarks.py - 검색/생성/RAG/학습 성능 측정
+# 채팅 메시지 코퍼스(messages.json)를 재생하면서 함수 하나씩 시간을 잰다.
+#
+#   match           : predict_hybrid_smart.find_best_match_response (top_k=5)
+#   generate        : predict_enhanced.predict_with_new_model (체크포인트가 없으면 무작위 초기화 모델)
+#   generate_beam   : generate와 같지만 빔 탐색 (REZE_BEAM_WIDTH, repo 크기만)
+#                     generate/generate_beam은 고른 응답의 품질(모델 로그 확률, distinct-2, 3-gram 반복률)도 잰다
+#   generate_speculative: generate와 같지만 템플릿 나머지를 초안으로 쓰는 추측 디코딩 (repo 크기만)
+#                     generate* 세 가지 모두 메시지당 디코더 forward 수와 초안 채택률을 재고, 데이터셋 입력을 그대로 쓴
+#                     near_* 지표도 따로 잰다 (추측 디코딩은 데이터셋에 가까운 메시지에서 효과가 남)
+#   generate_stream : predict_enhanced.stream_with_new_model (/chat/stream, repo 크기만) - 모델이 디코딩한 첫 토큰까지(ttft),
+#                     템플릿 prefix 조각까지(ttft_prefix), 토큰 사이 간격(itl)
+#   generate_batched: 동시 클라이언트 CONCURRENCY명이 batch_scheduler.MicroBatcher로 generate를 호출
+#                     (max_batch_size BATCH_SIZES별 처리량과 p50/p95, 표의 값은 32명/배치 8)
+#   cascade         : predict_cascade.predict_cascade (검색 → 확신이 낮으면 생성, 계층별 비율/지연과 임계값별 추정 포함)
+#   rag_search      : rag_reze.SimpleRezeRAG.search
+#   rag_enhance     : rag_reze.SimpleRezeRAG.enhance_prompt
+#   train_simple    : train_model.train_transformer_model 1 epoch
+#   train_optimized : train_optimized_model.train_optimized_model 1 epoch
+#
+# 벤치마크마다 별도 프로세스에서 돌려 최대 RSS가 서로 섞이지 않게 한다.
+# 지연 시간은 첫 호출(색인 생성 등)을 빼고 p50/p95/p99, 할당은 tracemalloc으로 파이썬 힙만 잰다
+# (torch 텐서 같은 네이티브 메모리는 peak_rss_kb 쪽에 잡힘).
+# match/generate는 데이터셋 크기별로 잰다: repo(dataset.json) + 합성 1k/10k/100k (generate_training_data.py).
+# 결과는 benchmarks/results/<시각>-<커밋>.json, --compare로 두 결과의 차이(회귀)를 본다.
+#
+# 사용법: python3 benchmarks/run_benchmarks.py [--only match,rag_search] [--sizes repo,1000,10000,100000]
+#                                             [--train-sizes repo] [--repeat N] [--rag-mode keyword|bm25|vector]
+#         python3 benchmarks/run_benchmarks.py --compare 이전.json 이후.json [--threshold 0.1]
+
+import contextlib
+import io
+import json
+import os
+import platform
+import queue
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+DATA_DIR = os.path.join(BENCH_DIR, 'data')
+MESSAGES_PATH = os.path.join(BENCH_DIR, 'messages.json')
+REPO_DATASET = os.path.join(REPO_DIR, 'dataset.json')
+
+BENCHMARKS = ('match', 'generate', 'generate_beam', 'generate_speculative', 'generate_stream', 'generate_batched', 'cascade', 'rag_search', 'rag_enhance', 'train_simple', 'train_optimized')
+SCALED = ('match', 'generate')
+TRAINING = ('train_simple', 'train_optimized')
+DEFAULT_SIZES = ('repo', '1000', '10000', '100000')
+ALLOC_CALLS = 20  # tracemalloc은 느리므로 메시지 일부로만
+CONCURRENCY = (1, 4, 16, 32)  # generate_batched 동시 클라이언트 수
+BATCH_SIZES = (1, 8, 16)      # generate_batched max_batch_size (1 = 배치 없이 한 건씩)
+BATCH_WAIT_MS = 5.0
+
+sys.path.insert(0, REPO_DIR)
+
+
+# ---------- 측정 ----------
+
+def _max_rss_kb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def percentile(sorted_values, p):
+    """nearest-rank 백분위수 (정렬된 목록)"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def latency_stats(seconds):
+    """호출별 시간(초) -> p50/p95/p99(ms), 처리량"""
+    values = sorted(seconds)
+    total = sum(values)
+    return {
+        'calls': len(values),
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'mean_ms': round(total / len(values) * 1000, 3),
+        'throughput_per_sec': round(len(values) / total, 1) if total else None,
+    }
+
+
+def allocation_stats(fn, messages):
+    """메시지마다 fn을 호출하며 파이썬 힙 최대 증가량과 남은 양 (tracemalloc)"""
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    peaks = []
+    for message in messages[:ALLOC_CALLS]:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        fn(message)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'py_peak_kb_per_call': round(sum(peaks) / len(peaks) / 1024, 1),
+        'py_peak_kb_max': round(max(peaks) / 1024, 1),
+        'py_retained_kb': round((current - start) / 1024, 1),
+    }
+
+
+def timed(fn, messages):
+    """메시지마다 fn 호출 시간(초)"""
+    for message in messages:
+        start = time.perf_counter()
+        fn(message)
+        yield time.perf_counter() - start
+
+
+def replay(fn, messages, repeat):
+    """첫 호출(색인/캐시 준비)은 따로 재고, 나머지 메시지 x repeat 재생"""
+    start = time.perf_counter()
+    fn(messages[0])
+    first = time.perf_counter() - start
+
+    seconds = []
+    for _ in range(repeat):
+        for message in messages:
+            start = time.perf_counter()
+            fn(message)
+            seconds.append(time.perf_counter() - start)
+    result = latency_stats(seconds)
+    result['first_call_ms'] = round(first * 1000, 3)
+    result.update(allocation_stats(fn, messages))
+    return result
+
+
+# ---------- 데이터셋 ----------
+
+def dataset_path(size):
+    """'repo'면 dataset.json, 숫자면 합성 데이터셋 (dataset.json 대화를 변형, 없으면 생성)"""
+    if size == 'repo':
+        return REPO_DATASET
+    from generate_training_data import generate_synthetic_dataset
+
+    path = os.path.join(DATA_DIR, f"synthetic_{size}.json")
+    if not os.path.exists(path):
+        os.makedirs(DATA_DIR, exist_ok=True)
+        with open(REPO_DATASET, 'r', encoding='utf-8') as f:
+            base = [(item['input'], item['label']) for item in json.load(f)]
+        generate_synthetic_dataset(int(size), path, base_pairs=base)
+    return path
+
+
+@contextlib.contextmanager
+def training_dir(size):
+    """학습 스크립트는 ./dataset.json을 읽으므로 합성 데이터셋이면 임시 디렉터리에 놓고 그 안에서 실행"""
+    if size == 'repo':
+        cwd = os.getcwd()
+        os.chdir(REPO_DIR)
+        try:
+            yield REPO_DATASET
+        finally:
+            os.chdir(cwd)
+        return
+    source = dataset_path(size)
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory(prefix='reze-bench-') as tmp:
+        os.symlink(source, os.path.join(tmp, 'dataset.json'))
+        os.chdir(tmp)
+        try:
+            yield os.path.join(tmp, 'dataset.json')
+        finally:
+            os.chdir(cwd)
+
+
+# ---------- 벤치마크 ----------
+
+def bench_match(messages, size, repeat, **_):
+    from compiled_dataset import load_dataset_fast
+    from predict_hybrid_smart import find_best_match_response
+
+    dataset = load_dataset_fast(dataset_path(size))
+    result = replay(lambda message: find_best_match_response(message, dataset, top_k=5), messages, repeat)
+    result['dataset_size'] = len(dataset)
+    return result
+
+
+def _generation_model():
+    """학습된 모델(내보낸 파일 우선)이 있으면 그것, 없으면 dataset.json 어휘로 무작위 초기화한 인과 모델"""
+    from predict_enhanced import default_model_path, load_enhanced_model
+
+    path = os.path.join(REPO_DIR, default_model_path())
+    if os.path.exists(path):
+        return load_enhanced_model(path), os.path.basename(path)
+
+    import torch
+
+    from compiled_dataset import load_dataset_fast
+    from reze_model import TransformerModel
+    from reze_vocab import create_proper_vocab
+
+    torch.manual_seed(0)
+    char_to_idx, idx_to_char, vocab_size = create_proper_vocab(load_dataset_fast(REPO_DATASET))
+    model = TransformerModel(vocab_size, 128, 8, 4, 50)
+    model.eval()
+    model.causal = True
+    model.padding_mask = True
+    return (model, char_to_idx, idx_to_char, 50), 'random-init'
+
+
+def response_quality(model, char_to_idx, max_seq_len, pairs):
+    """
+    (메시지, 응답) 목록의 품질 지표
+    mean_logprob: 모델이 본 응답 토큰당 평균 로그 확률 (teacher forcing, 인과 TransformerModel만)
+    distinct2: 전체 응답의 서로 다른 2-gram 비율, repeat3_rate: 3-gram이 반복되는 응답 비율
+    """
+    import torch
+    import torch.nn.functional as F
+
+    from predict_enhanced import message_indices, template_tokens
+    from reze_model import TransformerModel, causal_mask
+
+    bigrams, repeats, logprobs = [], 0, []
+    for message, response in pairs:
+        bigrams += [response[i:i + 2] for i in range(len(response) - 1)]
+        trigrams = [response[i:i + 3] for i in range(len(response) - 2)]
+        repeats += len(trigrams) != len(set(trigrams))
+        if isinstance(model, TransformerModel) and model.causal:
+            target = template_tokens(response, char_to_idx)[:max_seq_len - 1]
+            if len(target) < 2:
+                continue
+            src = torch.tensor([message_indices(message, model, char_to_idx, max_seq_len)])
+            tgt = torch.tensor([target])
+            with torch.no_grad():
+                logits = model.decode(tgt[:, :-1], model.encode(src), tgt_mask=causal_mask(len(target) - 1))
+            logprobs.append(F.log_softmax(logits, dim=-1).gather(-1, tgt[:, 1:, None]).mean().item())
+    return {
+        'mean_logprob': round(sum(logprobs) / len(logprobs), 4) if logprobs else None,
+        'distinct2': round(len(set(bigrams)) / len(bigrams), 3) if bigrams else None,
+        'repeat3_rate': round(repeats / len(pairs), 3) if pairs else None,
+        'mean_chars': round(sum(len(response) for _, response in pairs) / len(pairs), 1) if pairs else None,
+    }
+
+
+def near_dataset_messages(dataset, count):
+    """데이터셋 입력을 고르게 count개 (검색 템플릿과 거의 같은 응답이 나와야 하는 메시지)"""
+    step = max(1, len(dataset) // count)
+    return [dataset[i]['input'] for i in range(0, len(dataset), step)][:count]
+
+
+def forward_stats(model, generate, messages, prefix=''):
+    """
+    메시지마다 generate를 한 번 돌리며 디코더 forward(decode_step) 수와 추측 디코딩 초안 채택 수를 셈
+    (모델 인스턴스의 메서드를 잠시 감싸서 셈, 끝나면 되돌림)
+    """
+    counts = {'forwards': 0, 'drafted': 0, 'accepted': 0}
+    decode_step, speculate_batch = model.decode_step, model.speculate_batch
+
+    def counted_decode_step(*args, **kwargs):
+        counts['forwards'] += 1
+        return decode_step(*args, **kwargs)
+
+    def counted_speculate_batch(cache, prefixes, drafts, *args, **kwargs):
+        generated, accepted = speculate_batch(cache, prefixes, drafts, *args, **kwargs)
+        counts['drafted'] += sum(len(draft) for draft in drafts)
+        counts['accepted'] += sum(accepted)
+        return generated, accepted
+
+    model.decode_step, model.speculate_batch = counted_decode_step, counted_speculate_batch
+    try:
+        for message in messages:
+            generate(message)
+    finally:
+        del model.decode_step, model.speculate_batch
+    return {
+        f'{prefix}forwards_per_message': round(counts['forwards'] / len(messages), 2),
+        f'{prefix}draft_acceptance': round(counts['accepted'] / counts['drafted'], 3) if counts['drafted'] else None,
+    }
+
+
+def bench_generate(messages, size, repeat, speculative=False, decoding='sample', **_):
+    import torch
+
+    from compiled_dataset import load_dataset_fast
+    from predict_enhanced import BEAM_WIDTH, predict_with_new_model
+
+    dataset = load_dataset_fast(dataset_path(size))
+    (model, char_to_idx, idx_to_char, max_seq_len), weights = _generation_model()
+    torch.manual_seed(0)
+
+    def generate(message):
+        with contextlib.redirect_stderr(io.StringIO()):
+            return predict_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len, dataset,
+                                          speculative=speculative, decoding=decoding)
+
+    result = replay(generate, messages, repeat)
+    result.update(response_quality(model, char_to_idx, max_seq_len,
+                                   [(message, generate(message)) for message in messages]))
+    near = near_dataset_messages(dataset, len(messages))
+    near_latency = latency_stats([seconds for seconds in timed(generate, near)])
+    result.update({'near_p50_ms': near_latency['p50_ms'], 'near_p95_ms': near_latency['p95_ms']})
+    if hasattr(model, 'speculate_batch'):
+        result.update(forward_stats(model, generate, messages))
+        result.update(forward_stats(model, generate, near, 'near_'))
+    result.update({'dataset_size': len(dataset), 'weights': weights, 'torch_threads': torch.get_num_threads(),
+                   'decoding': decoding, 'speculative': speculative})
+    if decoding == 'beam':
+        result['beam_width'] = BEAM_WIDTH
+    return result
+
+
+def bench_generate_beam(messages, size, repeat, **_):
+    return bench_generate(messages, size, repeat, decoding='beam')
+
+
+def bench_generate_speculative(messages, size, repeat, **_):
+    return bench_generate(messages, size, repeat, speculative=True)
+
+
+def bench_generate_stream(messages, size, repeat, **_):
+    import torch
+
+    from compiled_dataset import load_dataset_fast
+    from predict_enhanced import stream_events, stream_with_new_model
+
+    dataset = load_dataset_fast(dataset_path(size))
+    (model, char_to_idx, idx_to_char, max_seq_len), weights = _generation_model()
+    torch.manual_seed(0)
+
+    def stream(message):
+        with contextlib.redirect_stderr(io.StringIO()):
+            for event in stream_events(stream_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len,
+                                                             dataset)):
+                if event['type'] == 'done':
+                    return event
+
+    result = replay(lambda message: stream(message)['response'], messages, repeat)
+    timings = [stream(message)['timing'] for _ in range(repeat) for message in messages]
+
+    def summary(key, p):
+        values = sorted(timing[key] for timing in timings if timing[key] is not None)
+        return round(percentile(values, p), 3) if values else None
+
+    result.update({
+        'ttft_p50_ms': summary('ttft_ms', 50), 'ttft_p95_ms': summary('ttft_ms', 95),
+        'ttft_prefix_p50_ms': summary('ttft_prefix_ms', 50),
+        'itl_mean_p50_ms': summary('itl_ms_mean', 50), 'itl_p95_p95_ms': summary('itl_ms_p95', 95),
+        'mean_tokens': round(sum(timing['tokens'] for timing in timings) / len(timings), 1),
+        'dataset_size': len(dataset), 'weights': weights, 'torch_threads': torch.get_num_threads(),
+    })
+    return result
+
+
+def concurrent_replay(submit, messages, repeat, concurrency):
+    """클라이언트 스레드 concurrency개가 메시지 x repeat를 나눠 동시에 호출 -> 지연 시간/전체 처리량"""
+    work = queue.Queue()
+    for _ in range(repeat):
+        for message in messages:
+            work.put(message)
+    seconds = []
+    lock = threading.Lock()
+
+    def client():
+        while True:
+            try:
+                message = work.get_nowait()
+            except queue.Empty:
+                return
+            start = time.perf_counter()
+            submit(message)
+            with lock:
+                seconds.append(time.perf_counter() - start)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    result = latency_stats(seconds)
+    # 동시 호출에서는 호출 시간 합이 아니라 벽시계 기준 처리량
+    result['throughput_per_sec'] = round(len(seconds) / wall, 1)
+    return result
+
+
+def bench_generate_batched(messages, size, repeat, **_):
+    import torch
+
+    from batch_scheduler import MicroBatcher
+    from compiled_dataset import load_dataset_fast
+    from predict_enhanced import predict_batch_with_new_model
+
+    dataset = load_dataset_fast(dataset_path(size))
+    (model, char_to_idx, idx_to_char, max_seq_len), weights = _generation_model()
+    torch.manual_seed(0)
+
+    def run_batch(batch):
+        with contextlib.redirect_stderr(io.StringIO()):
+            return predict_batch_with_new_model(batch, model, char_to_idx, idx_to_char, max_seq_len, dataset)
+
+    run_batch(messages[:1])  # 첫 호출 준비
+    levels = []
+    for max_batch in BATCH_SIZES:
+        batcher = MicroBatcher(run_batch, max_batch, BATCH_WAIT_MS, max_queue=max(CONCURRENCY))
+        for concurrency in CONCURRENCY:
+            before = batcher.stats()
+            level = concurrent_replay(batcher.submit, messages, repeat, concurrency)
+            after = batcher.stats()
+            batches = after['batches'] - before['batches']
+            level.update({'concurrency': concurrency, 'max_batch_size': max_batch,
+                          'mean_batch_size': round((after['requests'] - before['requests']) / batches, 2)})
+            levels.append(level)
+        batcher.close()
+
+    headline = next(level for level in levels
+                    if level['concurrency'] == max(CONCURRENCY) and level['max_batch_size'] == 8)
+    result = {key: headline[key] for key in ('calls', 'p50_ms', 'p95_ms', 'p99_ms', 'mean_ms', 'throughput_per_sec')}
+    result.update({'levels': levels, 'max_wait_ms': BATCH_WAIT_MS, 'dataset_size': len(dataset), 'weights': weights,
+                   'torch_threads': torch.get_num_threads()})
+    return result
+
+
+def bench_cascade(messages, size, repeat, **_):
+    from compiled_dataset import load_dataset_fast
+    from predict_cascade import CascadeStats, generate_batch, predict_cascade
+
+    dataset = load_dataset_fast(dataset_path(size))
+    loaded_model, weights = _generation_model()
+    stats = CascadeStats()
+
+    def cascade(message):
+        with contextlib.redirect_stderr(io.StringIO()):
+            return predict_cascade(message, dataset=dataset, loaded_model=loaded_model, stats=stats,
+                                   generate=lambda m, templates: generate_batch([m], [templates], dataset,
+                                                                                loaded_model)[0])
+
+    result = replay(cascade, messages, repeat)
+    snapshot = stats.snapshot()
+    result.update({'tiers': snapshot['tiers'], 'threshold': snapshot['threshold'],
+                   'generator_rate_at': snapshot['generator_rate_at'],
+                   'estimated_mean_ms_at': snapshot['estimated_mean_ms_at'],
+                   'dataset_size': len(dataset), 'weights': weights})
+    return result
+
+
+def _rag(rag_mode):
+    from rag_reze import SimpleRezeRAG
+
+    with contextlib.redirect_stderr(io.StringIO()):
+        return SimpleRezeRAG(os.path.join(REPO_DIR, 'reze_knowledge.txt'), mode=rag_mode)
+
+
+def bench_rag_search(messages, size, repeat, rag_mode='keyword', **_):
+    start = time.perf_counter()
+    rag = _rag(rag_mode)
+    setup = time.perf_counter() - start
+    result = replay(rag.search, messages, repeat)
+    result.update({'rag_mode': rag_mode, 'setup_ms': round(setup * 1000, 1)})
+    return result
+
+
+def bench_rag_enhance(messages, size, repeat, rag_mode='keyword', **_):
+    rag = _rag(rag_mode)
+    result = replay(rag.enhance_prompt, messages, repeat)
+    result['rag_mode'] = rag_mode
+    return result
+
+
+def bench_train_simple(messages, size, repeat, **_):
+    """train_model.py 학습 루프 1 epoch (체크포인트는 임시 디렉터리, 동기 저장)"""
+    import torch
+    import torch.nn as nn
+
+    from checkpoint_manager import CheckpointManager
+    from token_cache import make_dataloader
+    from train_model import SimpleDataset, train_transformer_model
+    from reze_model import TransformerModel
+
+    with training_dir(size) as path, tempfile.TemporaryDirectory(prefix='reze-bench-ckpt-') as ckpt_dir:
+        dataset = SimpleDataset(path)
+        dataloader = make_dataloader(dataset, 32, shuffle=True)
+        torch.manual_seed(0)
+        model = TransformerModel(dataset.vocab_size, 128, 8, 4, 50)
+        optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
+        vocab = {'char_to_idx': dataset.char_to_idx, 'idx_to_char': dataset.idx_to_char}
+        checkpoints = CheckpointManager(os.path.join(ckpt_dir, 'bench'), async_save=False)
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            train_transformer_model(model, dataloader, nn.CrossEntropyLoss(ignore_index=dataset.pad_idx), optimizer,
+                                    1, dataset.vocab_size, torch.device('cpu'), 'bench', vocab=vocab,
+                                    checkpoints=checkpoints)
+        elapsed = time.perf_counter() - start
+    return {
+        'dataset_size': len(dataset),
+        'epoch_seconds': round(elapsed, 2),
+        'samples_per_sec': round(len(dataset) / elapsed, 1),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def bench_train_optimized(messages, size, repeat, **_):
+    """train_optimized_model.py 1 epoch (단일 프로세스, 동적 패딩, 체크포인트 저장 없음)"""
+    import torch
+
+    from train_optimized_model import train_optimized_model
+
+    results = queue.Queue()
+    with training_dir(size):
+        with contextlib.redirect_stdout(io.StringIO()):
+            train_optimized_model(1, epochs=1, save=False, results=results)
+    measured = results.get()
+    return {
+        'dataset_size': measured['samples'],
+        'epoch_seconds': round(measured['seconds'], 2),
+        'samples_per_sec': round(measured['samples'] / measured['seconds'], 1),
+        'tokens_per_sec': round(measured['tokens'] / measured['seconds'], 1),
+        'torch_threads': torch.get_num_threads(),
+    }
+
+
+def run_one(name, size, repeat, rag_mode):
+    """벤치마크 하나 실행 (이 프로세스에서) -> 결과 dict"""
+    with open(MESSAGES_PATH, 'r', encoding='utf-8') as f:
+        messages = json.load(f)
+    rss_before = _max_rss_kb()
+    result = globals()[f"bench_{name}"](messages, size, repeat, rag_mode=rag_mode)
+    result.update({'rss_before_kb': rss_before, 'peak_rss_kb': _max_rss_kb()})
+    return result
+
+
+# ---------- 실행/저장/비교 ----------
+
+def _git(*args):
+    try:
+        return subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment():
+    try:
+        import torch
+        torch_version = torch.__version__
+    except ImportError:
+        torch_version = None
+    return {
+        'commit': _git('rev-parse', 'HEAD'),
+        'dirty': bool(_git('status', '--porcelain', '--untracked-files=no')),
+        'python': platform.python_version(),
+        'torch': torch_version,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'similarity': os.environ.get('REZE_SIMILARITY'),
+    }
+
+
+def run_all(names=BENCHMARKS, sizes=DEFAULT_SIZES, train_sizes=('repo',), repeat=3, rag_mode='keyword'):
+    """벤치마크마다 자식 프로세스로 실행, 실패(의존성 없음 등)는 error로 기록하고 계속"""
+    runs = []
+    for name in names:
+        for size in sizes if name in SCALED else train_sizes if name in TRAINING else ('repo',):
+            print(f"[bench] {name} ({size})...", file=sys.stderr, flush=True)
+            proc = subprocess.run([sys.executable, __file__, '--one', name, size, str(repeat), rag_mode],
+                                  capture_output=True, text=True)
+            entry = {'name': name, 'size': size}
+            if proc.returncode == 0:
+                entry.update(json.loads(proc.stdout.strip().splitlines()[-1]))
+            else:
+                entry['error'] = (proc.stderr.strip().splitlines() or ['unknown error'])[-1]
+            runs.append(entry)
+    return {'environment': environment(), 'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'repeat': repeat,
+            'runs': runs}
+
+
+def save_results(report):
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    commit = (report['environment']['commit'] or 'nogit')[:8]
+    path = os.path.join(RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{commit}.json")
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+# 비교할 지표와 방향 (True: 클수록 나쁨)
+METRICS = {
+    'p50_ms': True, 'p95_ms': True, 'p99_ms': True, 'throughput_per_sec': False,
+    'epoch_seconds': True, 'samples_per_sec': False, 'peak_rss_kb': True, 'py_peak_kb_per_call': True,
+    'mean_logprob': False, 'distinct2': False, 'repeat3_rate': True,
+    'near_p50_ms': True, 'forwards_per_message': True, 'near_forwards_per_message': True,
+    'near_draft_acceptance': False,
+    'ttft_p50_ms': True, 'ttft_p95_ms': True, 'itl_mean_p50_ms': True,
+}
+
+
+def compare(before, after, threshold=0.1):
+    """두 결과 파일의 같은 (벤치마크, 크기) 지표 비교 -> (행 목록, 회귀 수)"""
+    previous = {(run['name'], run['size']): run for run in before['runs']}
+    rows, regressions = [], 0
+    for run in after['runs']:
+        old = previous.get((run['name'], run['size']))
+        if old is None:
+            continue
+        for metric, higher_is_worse in METRICS.items():
+            if old.get(metric) is None or run.get(metric) is None or not old[metric]:
+                continue
+            change = (run[metric] - old[metric]) / abs(old[metric])  # 로그 확률처럼 음수인 지표도 방향 유지
+            regressed = change > threshold if higher_is_worse else change < -threshold
+            regressions += regressed
+            rows.append((run['name'], run['size'], metric, old[metric], run[metric], change, regressed))
+    return rows, regressions
+
+
+def print_report(report):
+    print(f"{'benchmark':>16} {'size':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'per sec':>9} {'rss MB':>7} {'py KB':>7}")
+    for run in report['runs']:
+        if 'error' in run:
+            print(f"{run['name']:>16} {run['size']:>7}  실패: {run['error']}")
+            continue
+        per_sec = run.get('throughput_per_sec') or run.get('samples_per_sec')
+        p50, p95, p99 = (run.get(key, '-') for key in ('p50_ms', 'p95_ms', 'p99_ms'))
+        if 'epoch_seconds' in run:
+            p50 = p95 = p99 = '-'
+        print(f"{run['name']:>16} {run['size']:>7} {p50:>9} {p95:>9} {p99:>9} {per_sec:>9} "
+              f"{run['peak_rss_kb'] / 1024:>7.1f} {run.get('py_peak_kb_per_call', '-'):>7}")
+        for level in run.get('levels', ()):
+            print(f"{'':>16} {'c=' + str(level['concurrency']) + ' b=' + str(level['max_batch_size']):>7} "
+                  f"{level['p50_ms']:>9} {level['p95_ms']:>9} {level['p99_ms']:>9} {level['throughput_per_sec']:>9}"
+                  f"  평균 배치 {level['mean_batch_size']}")
+
+
+def _option(name, default):
+    return sys.argv[sys.argv.index(name) + 1] if name in sys.argv else default
+
+
+if __name__ == "__main__":
+    if '--one' in sys.argv:
+        name, size, repeat, rag_mode = sys.argv[sys.argv.index('--one') + 1:][:4]
+        print(json.dumps(run_one(name, size, int(repeat), rag_mode), ensure_ascii=False))
+    elif '--compare' in sys.argv:
+        before_path, after_path = sys.argv[sys.argv.index('--compare') + 1:][:2]
+        with open(before_path, 'r', encoding='utf-8') as f:
+            before = json.load(f)
+        with open(after_path, 'r', encoding='utf-8') as f:
+            after = json.load(f)
+        rows, regressions = compare(before, after, float(_option('--threshold', 0.1)))
+        print(f"{'benchmark':>16} {'size':>7} {'metric':>19} {'before':>11} {'after':>11} {'change':>8}")
+        for name, size, metric, old, new, change, regressed in rows:
+            print(f"{name:>16} {size:>7} {metric:>19} {old:>11} {new:>11} {change:>+8.1%}{'  <- 회귀' if regressed else ''}")
+        print(f"회귀 {regressions}개 ({before['environment']['commit']} -> {after['environment']['commit']})")
+        sys.exit(1 if regressions else 0)
+    else:
+        names = _option('--only', ','.join(BENCHMARKS)).split(',')
+        unknown = set(names) - set(BENCHMARKS)
+        if unknown:
+            raise ValueError(f"알 수 없는 벤치마크: {', '.join(sorted(unknown))} (가능: {', '.join(BENCHMARKS)})")
+        report = run_all(names, _option('--sizes', ','.join(DEFAULT_SIZES)).split(','),
+                         _option('--train-sizes', 'repo').split(','), int(_option('--repeat', 3)),
+                         _option('--rag-mode', 'keyword'))
+        print_report(report)
+        print(f"결과 저장: {save_results(report)}", file=sys.stderr)
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+# checkpoint_manager.py - 학습 체크포인트 저장/보관/재개
+# 두 종류의 파일을 나눠서 쓴다.
+#   학습 상태  {prefix}_epoch_N.pth : 가중치 + 옵티마이저 상태 + epoch/손실 (재개용, 최근 keep_last개만 보관)
+#   추론 스냅샷 {prefix}_best.pth 등 : 가중치 + 모델 설정/어휘 (옵티마이저 없음, predict_enhanced가 읽는 형식)
+#
+# 저장할 때는 텐서를 바로 CPU 복사본으로 떠 두고 (모델을 CPU로 옮겼다가 되돌리지 않음),
+# 파일 쓰기는 백그라운드 스레드가 한다. 쓰기는 임시 파일 -> os.replace라서 중간에 죽어도 깨진 파일이 남지 않는다.
+
+import glob
+import os
+import queue
+import re
+import sys
+import threading
+
+import torch
+
+
+def cpu_snapshot(value):
+    """state_dict/옵티마이저 상태 안의 텐서를 CPU 복사본으로 (학습이 계속 가중치를 바꿔도 안전)"""
+    if torch.is_tensor(value):
+        return value.detach().to('cpu', copy=True)
+    if isinstance(value, dict):
+        return {key: cpu_snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(cpu_snapshot(item) for item in value)
+    return value
+
+
+def unwrap(model):
+    """DistributedDataParallel/torch.compile로 감싼 모델이면 원래 모델"""
+    while hasattr(model, 'module') or hasattr(model, '_orig_mod'):
+        model = getattr(model, 'module', None) or model._orig_mod
+    return model
+
+
+class CheckpointManager:
+    """
+    prefix: 파일 이름 앞부분 (예: 'reze_optimized' -> reze_optimized_epoch_3.pth, reze_optimized_best.pth)
+    keep_last: 보관할 학습 상태 파일 수 (0이면 전부 보관)
+    keep_best: 손실이 가장 낮은 epoch의 추론 스냅샷을 {prefix}_best.pth로 유지
+    async_save: 백그라운드 스레드에서 파일 쓰기 (wait()/close()로 끝날 때까지 기다림)
+    """
+
+    def __init__(self, prefix, keep_last=3, keep_best=True, async_save=True):
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+        self.best_loss = None
+        self._queue = None
+        self._error = None
+        if async_save:
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._writer, name='checkpoint-writer', daemon=True)
+            self._thread.start()
+
+    # ---------- 경로 ----------
+
+    def epoch_path(self, epoch):
+        return f"{self.prefix}_epoch_{epoch}.pth"
+
+    @property
+    def best_path(self):
+        return f"{self.prefix}_best.pth"
+
+    def epoch_files(self):
+        """[(epoch, 경로), ...] epoch 순"""
+        pattern = re.compile(re.escape(os.path.basename(self.prefix)) + r'_epoch_(\d+)\.pth$')
+        found = []
+        for path in glob.glob(glob.escape(self.prefix) + '_epoch_*.pth'):
+            match = pattern.search(os.path.basename(path))
+            if match:
+                found.append((int(match.group(1)), path))
+        return sorted(found)
+
+    def latest(self):
+        """가장 최근 학습 상태 파일 경로 (없으면 None)"""
+        files = self.epoch_files()
+        return files[-1][1] if files else None
+
+    # ---------- 저장 ----------
+
+    def save(self, epoch, loss, model, optimizer, meta=None):
+        """
+        epoch이 끝날 때 호출: 학습 상태 저장 + 오래된 상태 정리 + (손실이 최저면) 추론 스냅샷 갱신
+        meta: 추론 스냅샷에 같이 넣을 설정/어휘 (vocab_size, embed_dim, char_to_idx 등)
+        """
+        model_state = cpu_snapshot(unwrap(model).state_dict())
+        is_best = self.keep_best and (self.best_loss is None or loss < self.best_loss)
+        if is_best:
+            self.best_loss = loss
+        state = {
+            'epoch': epoch,
+            'loss': loss,
+            'best_loss': self.best_loss,
+            'model_state_dict': model_state,
+            'optimizer_state_dict': cpu_snapshot(optimizer.state_dict()),
+        }
+        self._submit(self._write_epoch, epoch, state)
+        if is_best:
+            self._submit(self._write, self.best_path, self._inference(model_state, epoch, loss, meta))
+
+    def save_inference(self, path, model, meta=None, epoch=None, loss=None):
+        """가중치 + 설정만 담은 추론 스냅샷 (옵티마이저 상태 없음)"""
+        self._submit(self._write, path, self._inference(cpu_snapshot(unwrap(model).state_dict()), epoch, loss, meta))
+
+    @staticmethod
+    def _inference(model_state, epoch, loss, meta):
+        snapshot = dict(meta or {})
+        snapshot.update({'model_state_dict': model_state, 'epoch': epoch, 'loss': loss})
+        return snapshot
+
+    def _submit(self, fn, *args):
+        if self._queue is None:
+            fn(*args)
+        else:
+            self._raise_pending()
+            self._queue.put((fn, args))
+
+    def _writer(self):
+        while True:
+            fn, args = self._queue.get()
+            try:
+                if fn is None:
+                    return
+                fn(*args)
+            except Exception as e:  # 다음 save/wait에서 호출한 쪽으로 올림
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, path, payload):
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        torch.save(payload, tmp_path)
+        os.replace(tmp_path, path)
+        print(f"체크포인트 저장: {path}", file=sys.stderr)
+
+    def _write_epoch(self, epoch, state):
+        self._write(self.epoch_path(epoch), state)
+        if self.keep_last:
+            for _, old_path in self.epoch_files()[:-self.keep_last]:
+                os.remove(old_path)
+
+    def _raise_pending(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def wait(self):
+        """대기 중인 쓰기가 모두 끝날 때까지 기다림 (쓰기 오류가 있었으면 여기서 발생)"""
+        if self._queue is not None:
+            self._queue.join()
+        self._raise_pending()
+
+    def close(self):
+        self.wait()
+        if self._queue is not None:
+            self._queue.put((None, ()))
+            self._thread.join()
+            self._queue = None
+
+    # ---------- 재개 ----------
+
+    def resume(self, model, optimizer, path=None):
+        """
+        학습 상태 파일(없으면 최신)에서 가중치/옵티마이저 복원
+        반환: 다음에 시작할 epoch 번호 (0부터, 재개할 파일이 없으면 0)
+        """
+        path = path or self.latest()
+        if path is None:
+            return 0
+        state = torch.load(path, map_location='cpu')
+        if 'optimizer_state_dict' not in state:
+            raise ValueError(f"재개할 수 없는 체크포인트 (옵티마이저 상태 없음): {path}")
+        unwrap(model).load_state_dict(state['model_state_dict'])
+        optimizer.load_state_dict(state['optimizer_state_dict'])
+        self.best_loss = state.get('best_loss', state.get('loss'))
+        print(f"학습 재개: {path} (epoch {state['epoch']}, Loss: {state['loss']:.4f})", file=sys.stderr)
+        return state['epoch']
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# compiled_dataset.py - dataset.json -> 바이너리 컴파일 + mmap 로더
+# JSON이 원본이고, 바이너리는 JSON이 바뀌면 자동으로 다시 만든다.
+# 여러 워커 프로세스가 같은 파일을 mmap하므로 페이지를 공유하고, 시작 시 json 파싱이 없다.
+#
+# 파일 구성 (모든 섹션은 8바이트 정렬):
+#   헤더      : 매직, 버전, 항목 수, 원본 JSON mtime/크기/sha1, 섹션 테이블
+#   arena     : UTF-8 문자열 (항목마다 input, label, input.lower().strip() 순서)
+#   offsets   : arena 안 문자열 경계 (uint64, 3N+1개)
+#   lengths   : 문자 단위 길이 (uint32, 항목마다 input, 소문자 input, label)
+#   ids       : 문자 어휘(reze_vocab.build_vocab, char 토크나이저) 토큰 id (uint16/uint32)
+#   id_offsets: ids 안 경계 (uint64, 항목마다 input, label -> 2N+1개)
+#   vocab     : 어휘 문자 목록 (JSON)
+#
+# 사용법: python3 compiled_dataset.py [dataset.json]
+
+import hashlib
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+
+from reze_vocab import build_vocab
+
+MAGIC = b'REZEDS01'
+VERSION = 1
+SECTIONS = ('arena', 'offsets', 'lengths', 'ids', 'id_offsets', 'vocab')
+# 매직, 버전, 항목 수, 어휘 크기, id 타입코드, 원본 mtime_ns, 원본 크기, 원본 sha1
+HEADER = struct.Struct('<8sIII1s3xqq20s4x')
+SECTION_ENTRY = struct.Struct('<QQ')
+HEADER_SIZE = HEADER.size + SECTION_ENTRY.size * len(SECTIONS)
+
+
+def compiled_path_for(json_path):
+    """dataset.json -> dataset.bin"""
+    base, _ = os.path.splitext(json_path)
+    return base + '.bin'
+
+
+def _source_signature(json_path):
+    st = os.stat(json_path)
+    return st.st_mtime_ns, st.st_size
+
+
+def _align(n, to=8):
+    return (n + to - 1) // to * to
+
+
+def compile_dataset(json_path='./dataset.json', out_path=None):
+    """dataset.json을 읽어 바이너리로 저장 (임시 파일에 쓰고 교체하므로 읽는 쪽과 충돌 없음)"""
+    out_path = out_path or compiled_path_for(json_path)
+
+    with open(json_path, 'rb') as f:
+        raw = f.read()
+    dataset = json.loads(raw.decode('utf-8'))
+    mtime_ns, size = _source_signature(json_path)
+
+    vocab = build_vocab(dataset)
+    char_to_idx = {char: idx for idx, char in enumerate(vocab)}
+    id_type = 'H' if len(vocab) < 65536 else 'I'
+    pad_idx = char_to_idx['<PAD>']
+
+    arena = bytearray()
+    offsets = array('Q', [0])
+    lengths = array('I')
+    ids = array(id_type)
+    id_offsets = array('Q', [0])
+
+    for item in dataset:
+        lower = item['input'].lower().strip()
+        for text in (item['input'], item['label'], lower):
+            arena += text.encode('utf-8')
+            offsets.append(len(arena))
+        lengths.extend((len(item['input']), len(lower), len(item['label'])))
+        for text in (item['input'], item['label']):
+            ids.extend(char_to_idx.get(char, pad_idx) for char in text)
+            id_offsets.append(len(ids))
+
+    payloads = {
+        'arena': bytes(arena),
+        'offsets': offsets.tobytes(),
+        'lengths': lengths.tobytes(),
+        'ids': ids.tobytes(),
+        'id_offsets': id_offsets.tobytes(),
+        'vocab': json.dumps(vocab, ensure_ascii=False).encode('utf-8'),
+    }
+
+    table = []
+    position = _align(HEADER_SIZE)
+    for name in SECTIONS:
+        table.append((position, len(payloads[name])))
+        position = _align(position + len(payloads[name]))
+
+    header = HEADER.pack(MAGIC, VERSION, len(dataset), len(vocab), id_type.encode(),
+                         mtime_ns, size, hashlib.sha1(raw).digest())
+    header += b''.join(SECTION_ENTRY.pack(*entry) for entry in table)
+
+    tmp_path = f"{out_path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(header)
+        for name, (offset, _) in zip(SECTIONS, table):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(payloads[name])
+    os.replace(tmp_path, out_path)
+
+    print(f"데이터셋 컴파일: {json_path} -> {out_path} ({len(dataset)}개, {os.path.getsize(out_path)} bytes)", file=sys.stderr)
+    return out_path
+
+
+class CompiledDataset:
+    """
+    mmap된 컴파일 데이터셋
+    리스트처럼 쓸 수 있고 (len, 인덱싱, 반복 -> {'input', 'label'} dict),
+    미리 계산한 소문자 형태/길이/토큰 id는 별도 메서드로 꺼낸다.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._mmap)
+
+        (magic, version, self.count, self.vocab_size, id_type,
+         self.source_mtime_ns, self.source_size, self.source_sha1) = HEADER.unpack_from(view, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"컴파일된 데이터셋 형식이 아님: {path}")
+
+        sections = {}
+        for i, name in enumerate(SECTIONS):
+            offset, size = SECTION_ENTRY.unpack_from(view, HEADER.size + i * SECTION_ENTRY.size)
+            sections[name] = view[offset:offset + size]
+
+        self._arena = sections['arena']
+        self._offsets = sections['offsets'].cast('Q')
+        self._lengths = sections['lengths'].cast('I')
+        self._ids = sections['ids'].cast(id_type.decode())
+        self._id_offsets = sections['id_offsets'].cast('Q')
+        self._vocab = json.loads(bytes(sections['vocab']).decode('utf-8'))
+
+    def _string(self, slot):
+        return str(self._arena[self._offsets[slot]:self._offsets[slot + 1]], 'utf-8')
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(self.count))]
+        if idx < 0:
+            idx += self.count
+        if not 0 <= idx < self.count:
+            raise IndexError(idx)
+        return {'input': self._string(3 * idx), 'label': self._string(3 * idx + 1)}
+
+    def __iter__(self):
+        for idx in range(self.count):
+            yield self[idx]
+
+    def input_lower(self, idx):
+        """input.lower().strip() (미리 계산됨)"""
+        return self._string(3 * idx + 2)
+
+    def input_length(self, idx):
+        return self._lengths[3 * idx]
+
+    def label_length(self, idx):
+        return self._lengths[3 * idx + 2]
+
+    def input_ids(self, idx):
+        """input 토큰 id (memoryview, 복사 없음)"""
+        return self._ids[self._id_offsets[2 * idx]:self._id_offsets[2 * idx + 1]]
+
+    def label_ids(self, idx):
+        """label 토큰 id (memoryview, 복사 없음)"""
+        return self._ids[self._id_offsets[2 * idx + 1]:self._id_offsets[2 * idx + 2]]
+
+    def vocab(self):
+        """(char_to_idx, idx_to_char, vocab_size) - reze_vocab.create_proper_vocab와 같은 결과"""
+        char_to_idx = {char: idx for idx, char in enumerate(self._vocab)}
+        idx_to_char = {idx: char for idx, char in enumerate(self._vocab)}
+        return char_to_idx, idx_to_char, len(self._vocab)
+
+    def close(self):
+        self._arena = self._offsets = self._lengths = self._ids = self._id_offsets = None
+        self._mmap.close()
+        self._file.close()
+
+
+def _is_fresh(compiled_path, json_path):
+    """컴파일본이 현재 JSON(mtime/크기)에서 만들어졌는지 확인"""
+    try:
+        with open(compiled_path, 'rb') as f:
+            header = f.read(HEADER.size)
+        magic, version, _, _, _, mtime_ns, size, _ = HEADER.unpack(header)
+    except (OSError, struct.error):
+        return False
+    return magic == MAGIC and version == VERSION and (mtime_ns, size) == _source_signature(json_path)
+
+
+def load_compiled_dataset(json_path='./dataset.json'):
+    """컴파일본을 mmap으로 로드 (없거나 JSON이 바뀌었으면 다시 컴파일)"""
+    compiled_path = compiled_path_for(json_path)
+    if not _is_fresh(compiled_path, json_path):
+        compile_dataset(json_path, compiled_path)
+    return CompiledDataset(compiled_path)
+
+
+def load_dataset_fast(json_path='./dataset.json'):
+    """컴파일본 로드, 실패하면(쓰기 권한 없음 등) JSON으로 대체"""
+    try:
+        return load_compiled_dataset(json_path)
+    except (OSError, ValueError) as e:
+        print(f"컴파일 데이터셋 사용 불가, JSON으로 로드: {e}", file=sys.stderr)
+        with open(json_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else './dataset.json'
+    out = compile_dataset(path)
+    compiled = CompiledDataset(out)
+    print(json.dumps({
+        "status": "success",
+        "path": out,
+        "count": len(compiled),
+        "vocab_size": compiled.vocab_size,
+        "bytes": os.path.getsize(out),
+    }, ensure_ascii=False))
@@ -0,0 +1,380 @@
+#!/usr/bin/env python3
+# export_model.py - 추론용 모델 내보내기 (INT8 동적 양자화 + TorchScript)
+# 학습 체크포인트(reze_optimized_final.pth)는 옵티마이저 상태까지 들고 있고 fp32 eager로 돈다.
+# 여기서는 가중치만 남기고 Linear 층을 INT8 동적 양자화(quantize_dynamic)한 뒤
+# encode/decode와 KV 캐시 증분 디코딩 한 스텝(step)을 TorchScript로 trace해서 파일 하나(reze_optimized_int8.pt)로 저장한다.
+# 어휘와 설정은 같은 파일 안의 config.json(_extra_files)에 들어간다.
+#
+# 인과 마스크로 학습된 체크포인트는 step으로 eager 모델과 같은 생성 경로(prefill/generate_batch/추측 디코딩/빔)를 쓴다.
+# 내보낼 때 데이터셋 앞쪽 PARITY_SAMPLES개로 eager 모델과 비교해 (teacher forcing argmax 일치율, greedy 생성 일치율)
+# config의 'parity'에 남기고, predict_enhanced.default_model_path()는 통과한 파일만 체크포인트보다 먼저 고른다.
+#
+# 사용법: python3 export_model.py [체크포인트.pth] [출력.pt] [--no-quantize]
+#         python3 export_model.py --report [체크포인트.pth] [출력.pt]  (지연 시간/메모리/품질 비교)
+
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+import zipfile
+
+import torch
+import torch.nn as nn
+
+from reze_model import DecoderCache, TransformerModel, causal_mask, decoder_positions, step_attention_mask
+
+DEFAULT_CHECKPOINT = 'reze_optimized_final.pth'
+DEFAULT_EXPORT = 'reze_optimized_int8.pt'
+CONFIG_FILE = 'config.json'
+PARITY_SAMPLES = 100
+PARITY_MIN_AGREEMENT = 0.95  # teacher forcing argmax가 eager 모델과 이 비율 이상 같아야 통과
+
+
+class InferenceModule(nn.Module):
+    """trace할 추론 인터페이스 (마스크는 항상 텐서로 받음, 층별 key/value는 층 축으로 쌓은 텐서)"""
+
+    def __init__(self, model):
+        super(InferenceModule, self).__init__()
+        self.model = model
+
+    def encode(self, src, src_mask):
+        return self.model.encode(src, src_key_padding_mask=src_mask)
+
+    def decode(self, tgt, memory, tgt_mask, memory_mask):
+        return self.model.decode(tgt, memory, tgt_mask=tgt_mask, memory_key_padding_mask=memory_mask)
+
+    def memory_kv(self, memory):
+        """cross-attention key/value (layers, B, heads, S, head_dim) 두 개"""
+        keys, values = zip(*self.model._memory_kv(memory))
+        return torch.stack(keys), torch.stack(values)
+
+    def step(self, tokens, positions, past_keys, past_values, memory_k, memory_v, allowed, memory_mask):
+        """TransformerModel.decode_step 한 번 (위치와 마스크는 밖에서 계산) -> 로짓, 앞 + 새 위치 key, value"""
+        x = self.model.embedding(tokens) + self.model.positional_encoding[0, positions]
+        memory_kv = list(zip(memory_k.unbind(0), memory_v.unbind(0)))
+        logits, keys, values = self.model._step_layers(x, past_keys.unbind(0), past_values.unbind(0), memory_kv,
+                                                       allowed, memory_mask)
+        return logits, torch.stack(keys), torch.stack(values)
+
+    def forward(self, src, tgt, tgt_mask):
+        src_mask = torch.zeros(src.shape)
+        return self.decode(tgt, self.encode(src, src_mask), tgt_mask, src_mask)
+
+
+class ExportedModel:
+    """
+    TorchScript로 내보낸 모델을 TransformerModel과 같은 추론 인터페이스로 감쌈
+    인과 모델은 decode_step이 내보낸 step을 부르므로 prefill/generate_batch/speculate_batch/beam_search를 그대로 씀
+    """
+
+    device = torch.device('cpu')
+
+    # TransformerModel의 생성 함수들은 decode_step, _left_pad, device, max_seq_len만 씀
+    prefill = TransformerModel.prefill
+    _left_pad = TransformerModel._left_pad
+    generate_batch = TransformerModel.generate_batch
+    speculate_batch = TransformerModel.speculate_batch
+    beam_search = TransformerModel.beam_search
+    stream = TransformerModel.stream
+    generate = TransformerModel.generate
+
+    def __init__(self, module, config):
+        self.module = module
+        self.config = config
+        self.causal = config['causal']
+        self.padding_mask = config['padding_mask']
+        self.max_seq_len = config['max_seq_len']
+
+    def eval(self):
+        return self
+
+    def encode(self, src, src_key_padding_mask=None):
+        if src_key_padding_mask is None:
+            src_key_padding_mask = torch.zeros(src.shape)
+        return self.module.encode(src, src_key_padding_mask)
+
+    def decode(self, tgt, memory, tgt_mask=None, memory_key_padding_mask=None):
+        if tgt_mask is None:
+            size = tgt.size(1)
+            tgt_mask = causal_mask(size) if self.causal else torch.zeros(size, size)
+        if memory_key_padding_mask is None:
+            memory_key_padding_mask = torch.zeros(memory.shape[:2])
+        return self.module.decode(tgt, memory, tgt_mask, memory_key_padding_mask)
+
+    def init_cache(self, memory, memory_key_padding_mask=None):
+        keys, values = self.module.memory_kv(memory)
+        memory_mask = memory_key_padding_mask[:, None, None, :] if memory_key_padding_mask is not None else None
+        return DecoderCache(list(zip(keys.unbind(0), values.unbind(0))), memory_mask=memory_mask)
+
+    def decode_step(self, tokens, cache):
+        """TransformerModel.decode_step과 같음 (cache의 층별 key/value를 쌓아 step 한 번)"""
+        batch, length = tokens.shape
+        start = cache.length
+        memory_k = torch.stack([k for k, _ in cache.memory_kv])
+        memory_v = torch.stack([v for _, v in cache.memory_kv])
+        if start:
+            past_keys, past_values = torch.stack(cache.keys), torch.stack(cache.values)
+        else:
+            past_keys = past_values = memory_k[:, :, :, :0]
+        positions = decoder_positions(start, length, self.max_seq_len - 1, cache.pad).expand(batch, -1)
+        allowed = step_attention_mask(start, length, cache.pad)
+        if allowed.dim() == 2:
+            allowed = allowed.expand(batch, 1, -1, -1)
+        memory_mask = cache.memory_mask
+        if memory_mask is None:
+            memory_mask = torch.zeros(batch, 1, 1, memory_k.size(3))
+        logits, keys, values = self.module.step(tokens, positions, past_keys, past_values, memory_k, memory_v,
+                                                allowed, memory_mask)
+        cache.keys[:], cache.values[:] = keys.unbind(0), values.unbind(0)
+        cache.length = start + length
+        return logits
+
+
+def _trace(model, max_seq_len, pad_idx):
+    """encode/decode/memory_kv/step trace (배치 2로 trace해서 배치 1로 특수화되지 않게, 길이는 size()로 따라감)"""
+    src = torch.full((2, max_seq_len), pad_idx, dtype=torch.long)
+    src_mask = torch.zeros(src.shape)
+    tgt = torch.full((2, max_seq_len - 1), pad_idx, dtype=torch.long)
+    tgt_mask = causal_mask(tgt.size(1)) if model.causal else torch.zeros(tgt.size(1), tgt.size(1))
+    # 앞 위치 3개가 캐시에 있고 왼쪽 패딩이 다른 두 행에 새 토큰 2개씩
+    start, length, pad = 3, 2, torch.tensor([0, 1])
+    tokens = torch.full((2, length), pad_idx, dtype=torch.long)
+    positions = decoder_positions(start, length, max_seq_len - 1, pad)
+    allowed = step_attention_mask(start, length, pad)
+
+    # 인코더 fast path는 Linear.weight를 직접 읽는데 양자화된 Linear의 weight는 메서드라 실패한다.
+    # trace 결과는 fast path 여부와 무관하게 같은 연산이므로 trace하는 동안만 끔
+    fastpath = torch.backends.mha.get_fastpath_enabled()
+    torch.backends.mha.set_fastpath_enabled(False)
+    try:
+        with torch.no_grad():
+            module = InferenceModule(model)
+            memory = module.encode(src, src_mask)
+            memory_k, memory_v = module.memory_kv(memory)
+            past = memory_k[:, :, :, :start].clone()
+            return torch.jit.trace_module(module, {
+                'encode': (src, src_mask),
+                'decode': (tgt, memory, tgt_mask, src_mask),
+                'memory_kv': (memory,),
+                'step': (tokens, positions, past, past, memory_k, memory_v, allowed, src_mask[:, None, None, :]),
+            })
+    finally:
+        torch.backends.mha.set_fastpath_enabled(fastpath)
+
+
+def export_model(checkpoint_path=DEFAULT_CHECKPOINT, out_path=DEFAULT_EXPORT, quantize=True, dataset=None):
+    """
+    체크포인트 -> (양자화된) TorchScript 추론 파일, 설정 dict 반환
+    dataset: eager 모델과 비교할 데이터 (없으면 dataset.json), 결과는 설정의 'parity'
+    """
+    from predict_enhanced import load_dataset, load_enhanced_model
+
+    reference, char_to_idx, idx_to_char, max_seq_len = load_enhanced_model(checkpoint_path)
+    reference.eval()
+    model = reference
+    if quantize:
+        # Linear(fc_out, feed-forward, attention out_proj 제외)의 가중치를 INT8로, 활성값은 실행 중에 양자화
+        # (복사본을 양자화해서 reference는 fp32 그대로 비교에 씀)
+        model = torch.ao.quantization.quantize_dynamic(reference, {nn.Linear}, dtype=torch.qint8)
+
+    config = {
+        'vocab_size': len(char_to_idx),
+        'max_seq_len': max_seq_len,
+        'char_to_idx': char_to_idx,
+        'idx_to_char': [idx_to_char[idx] for idx in range(len(idx_to_char))],
+        'causal': model.causal,
+        'padding_mask': model.padding_mask,
+        'quantized': quantize,
+        'step_decode': True,
+        'source': os.path.basename(checkpoint_path),
+    }
+
+    traced = _trace(model, max_seq_len, char_to_idx['<PAD>'])
+    if dataset is None:
+        dataset = load_dataset()
+    config['parity'] = check_parity(reference, ExportedModel(traced, config), dataset, char_to_idx, max_seq_len)
+
+    traced.save(out_path, _extra_files={CONFIG_FILE: json.dumps(config, ensure_ascii=False)})
+    print(f"추론 모델 내보내기: {checkpoint_path} -> {out_path} ({os.path.getsize(out_path)} bytes, "
+          f"{'INT8' if quantize else 'fp32'}, 동등성 {config['parity']})", file=sys.stderr)
+    return config
+
+
+def load_exported(path=DEFAULT_EXPORT):
+    """내보낸 파일 -> (ExportedModel, 설정 dict)"""
+    extra_files = {CONFIG_FILE: ''}
+    module = torch.jit.load(path, map_location='cpu', _extra_files=extra_files)
+    module.eval()
+    config = json.loads(extra_files[CONFIG_FILE])
+    if config['causal'] and not config.get('step_decode'):
+        # 예전 파일은 전체 디코드만 있어 인과 모델을 prefix 뒤 <PAD> 자리에서 한 번에 뽑으므로 쓸 수 없음
+        raise ValueError(f"{path}: 증분 디코딩(step) 없이 내보낸 인과 모델입니다. export_model.py로 다시 내보내세요")
+    return ExportedModel(module, config), config
+
+
+def read_export_config(path=DEFAULT_EXPORT):
+    """내보낸 파일의 설정 dict (모듈을 로드하지 않고 zip 안의 config.json만 읽음)"""
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            if name.endswith('/extra/' + CONFIG_FILE):
+                return json.loads(archive.read(name))
+    raise KeyError(f"{path}에 {CONFIG_FILE}이 없습니다")
+
+
+def passed_parity(path=DEFAULT_EXPORT):
+    """내보낼 때 eager 모델과의 동등성 검사를 통과한 파일인지 (검사 기록이 없거나 읽을 수 없으면 False)"""
+    try:
+        return bool(read_export_config(path).get('parity', {}).get('passed'))
+    except (OSError, KeyError, ValueError, zipfile.BadZipFile):
+        return False
+
+
+def _rss_kb():
+    """현재 RSS (KB, /proc이 없으면 최대 RSS)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _measure_load(path):
+    """
+    별도 프로세스에서 모델을 로드하고 응답 하나를 생성했을 때 RSS 증가량 (KB)
+    체크포인트는 mmap으로 읽어 로드만 하면 가중치가 메모리에 올라오지 않으므로 생성까지 돌림
+    """
+    from predict_enhanced import load_enhanced_model
+
+    before = _rss_kb()
+    model, char_to_idx, _, max_seq_len = load_enhanced_model(path)
+    item = {'input': '안녕', 'label': '안녕'}
+    if model.causal:
+        _greedy(model, item, char_to_idx, max_seq_len)
+    else:
+        _teacher_forced(model, [item], char_to_idx, max_seq_len)
+    return _rss_kb() - before
+
+
+def _teacher_forced(model, dataset, char_to_idx, max_seq_len):
+    """정답 label을 넣었을 때 각 위치 argmax 예측 목록과 토큰 정확도 (<PAD> 제외)"""
+    pad_idx, eos_idx = char_to_idx['<PAD>'], char_to_idx['<EOS>']
+
+    def encode(text, pad):
+        ids = [char_to_idx.get(char, pad_idx) for char in text][:max_seq_len - 1] + [eos_idx]
+        return ids + [pad_idx] * (max_seq_len - len(ids)) if pad else ids
+
+    predictions, correct, total = [], 0, 0
+    with torch.no_grad():
+        for item in dataset:
+            src = torch.tensor([encode(item['input'], not model.padding_mask)], dtype=torch.long)
+            target = encode(item['label'], True)
+            tgt = torch.tensor([target[:-1]], dtype=torch.long)
+            size = tgt.size(1)
+            mask = causal_mask(size) if model.causal else None
+            predicted = model.decode(tgt, model.encode(src), tgt_mask=mask)[0].argmax(dim=-1).tolist()
+            predictions.append(predicted)
+            for guess, answer in zip(predicted, target[1:]):
+                if answer != pad_idx:
+                    total += 1
+                    correct += guess == answer
+    return predictions, correct / max(total, 1)
+
+
+def _argmax_agreement(predictions, other):
+    agree = total = 0
+    for a, b in zip(predictions, other):
+        agree += sum(x == y for x, y in zip(a, b))
+        total += len(a)
+    return agree / max(total, 1)
+
+
+def _greedy(model, item, char_to_idx, max_seq_len):
+    """label 첫 글자를 prefix로 greedy 생성한 토큰 목록"""
+    pad_idx, eos_idx = char_to_idx['<PAD>'], char_to_idx['<EOS>']
+    src = [char_to_idx.get(char, pad_idx) for char in item['input']][:max_seq_len - 1] + [eos_idx]
+    if not model.padding_mask:
+        src += [pad_idx] * (max_seq_len - len(src))
+    prefix = [char_to_idx.get(item['label'][:1], pad_idx)]
+    with torch.no_grad():
+        memory = model.encode(torch.tensor([src], dtype=torch.long))
+        return model.generate(model.init_cache(memory), prefix, eos_idx)
+
+
+def _sample(dataset, samples):
+    return [dataset[i] for i in range(0, len(dataset), max(1, len(dataset) // samples))][:samples]
+
+
+def check_parity(reference, exported, dataset, char_to_idx, max_seq_len, samples=PARITY_SAMPLES):
+    """
+    내보낸 모델이 eager 모델(reference)과 같은 답을 내는지 데이터셋 samples개로 비교
+    argmax_agreement: teacher forcing 위치별 argmax 일치율 (PARITY_MIN_AGREEMENT 이상이면 통과)
+    greedy_match: 인과 모델이면 greedy 생성 결과가 통째로 같은 메시지 비율
+    """
+    subset = _sample(dataset, samples)
+    expected, _ = _teacher_forced(reference, subset, char_to_idx, max_seq_len)
+    actual, _ = _teacher_forced(exported, subset, char_to_idx, max_seq_len)
+    agreement = _argmax_agreement(expected, actual)
+    result = {'samples': len(subset), 'argmax_agreement': round(agreement, 4)}
+    if reference.causal:
+        same = sum(_greedy(reference, item, char_to_idx, max_seq_len) == _greedy(exported, item, char_to_idx, max_seq_len)
+                   for item in subset)
+        result['greedy_match'] = round(same / max(len(subset), 1), 4)
+    result['passed'] = agreement >= PARITY_MIN_AGREEMENT
+    return result
+
+
+def export_report(checkpoint_path=DEFAULT_CHECKPOINT, export_path=DEFAULT_EXPORT, samples=100):
+    """
+    현재 경로(fp32 eager .pth)와 내보낸 경로(INT8 TorchScript .pt) 비교
+    latency_ms: predict_with_new_model 메시지당 평균 (같은 시드), load_rss_kb: 로드 + 응답 하나 생성 뒤 메모리
+    quality: teacher forcing 토큰 정확도와 두 모델 argmax 예측 일치율
+    """
+    import contextlib
+    import io
+
+    from predict_enhanced import load_dataset, load_enhanced_model, predict_with_new_model
+
+    if not os.path.exists(export_path):
+        export_model(checkpoint_path, export_path)
+    dataset = load_dataset()
+    subset = _sample(dataset, samples)
+
+    report = {}
+    predictions = {}
+    for name, path in (('fp32_eager', checkpoint_path), ('int8_script', export_path)):
+        model, char_to_idx, idx_to_char, max_seq_len = load_enhanced_model(path)
+        torch.manual_seed(0)
+        start = time.perf_counter()
+        with contextlib.redirect_stderr(io.StringIO()):
+            for item in subset:
+                predict_with_new_model(item['input'], model, char_to_idx, idx_to_char, max_seq_len, dataset)
+        latency = (time.perf_counter() - start) / len(subset) * 1000
+
+        predictions[name], accuracy = _teacher_forced(model, subset, char_to_idx, max_seq_len)
+        rss = subprocess.run([sys.executable, __file__, '--measure-load', path],
+                             capture_output=True, text=True, check=True).stdout.strip()
+        report[name] = {
+            'file_bytes': os.path.getsize(path),
+            'load_rss_kb': int(rss),
+            'latency_ms': round(latency, 1),
+            'token_accuracy': round(accuracy, 4),
+        }
+
+    report['argmax_agreement'] = round(_argmax_agreement(predictions['fp32_eager'], predictions['int8_script']), 4)
+    report['parity'] = read_export_config(export_path).get('parity')
+    return report
+
+
+if __name__ == "__main__":
+    if '--measure-load' in sys.argv:
+        print(_measure_load(sys.argv[sys.argv.index('--measure-load') + 1]))
+    elif '--report' in sys.argv:
+        rest = [a for a in sys.argv[1:] if a != '--report']
+        print(json.dumps(export_report(*rest), ensure_ascii=False, indent=2))
+    else:
+        rest = [a for a in sys.argv[1:] if not a.startswith('--')]
+        config = export_model(*rest, quantize='--no-quantize' not in sys.argv)
+        print(json.dumps({"status": "success", "path": rest[1] if len(rest) > 1 else DEFAULT_EXPORT,
+                          "quantized": config['quantized'], "vocab_size": config['vocab_size']}, ensure_ascii=False))
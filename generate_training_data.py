@@ -6,6 +6,7 @@ Reze Training Data Generator
 """
 
 import json
+import random
 import sys
 
 # 레제 대사 템플릿 (원작 기반)
@@ -155,7 +156,51 @@ def generate_json_format(output_file="training_data.json"):
     
     print(f"✅ JSON backup saved to: {output_file}")
 
+# 합성 데이터셋 (벤치마크 스케일링용): 템플릿 대화에 말머리/말끝/상황을 붙여 변형
+SYNTHETIC_PREFIXES = ["", "", "레제야, ", "있잖아 ", "음... ", "저기 ", "근데 ", "혹시 "]
+SYNTHETIC_SUFFIXES = ["", "", "?", "!", "...", " ㅋㅋ", " 진짜로", " 오늘"]
+SYNTHETIC_LABEL_SUFFIXES = ["", "", " ...왜?", " 됐어.", " 흠.", " 그냥."]
+
+def generate_synthetic_pairs(count, seed=0, base_pairs=None):
+    """
+    dataset.json 형식 [{'input', 'label'}, ...] count개 생성 (seed가 같으면 같은 결과)
+    base_pairs: 변형할 (입력, 응답) 목록 (없으면 REZE_DIALOGUES + SCENARIOS)
+    4개 중 1개는 두 입력을 이어 붙여 긴 메시지를 만듦
+    """
+    rng = random.Random(seed)
+    base = list(base_pairs or REZE_DIALOGUES + [pair for dialogues in SCENARIOS.values() for pair in dialogues])
+    scenarios = list(SCENARIOS)
+    
+    pairs = []
+    for i in range(count):
+        user, assistant = base[i % len(base)] if i < len(base) else rng.choice(base)
+        if i >= len(base):
+            if rng.random() < 0.25:
+                other, _ = rng.choice(base)
+                user = f"{user} {other}"
+            user = rng.choice(SYNTHETIC_PREFIXES) + user + rng.choice(SYNTHETIC_SUFFIXES)
+            if rng.random() < 0.2:
+                user = f"({rng.choice(scenarios)}) {user}"
+            assistant = assistant + rng.choice(SYNTHETIC_LABEL_SUFFIXES)
+        pairs.append({"input": user, "label": assistant})
+    return pairs
+
+def generate_synthetic_dataset(count, output_file=None, seed=0, base_pairs=None):
+    """합성 데이터셋을 JSON으로 저장하고 경로 반환 (기본 경로: synthetic_{count}.json)"""
+    output_file = output_file or f"synthetic_{count}.json"
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(generate_synthetic_pairs(count, seed, base_pairs), f, ensure_ascii=False)
+    print(f"✅ Synthetic dataset: {count} pairs -> {output_file}", file=sys.stderr)
+    return output_file
+
 if __name__ == "__main__":
+    # 사용법: python3 generate_training_data.py
+    #         python3 generate_training_data.py --synthetic 개수 [출력.json]
+    if '--synthetic' in sys.argv:
+        rest = sys.argv[sys.argv.index('--synthetic') + 1:]
+        generate_synthetic_dataset(int(rest[0]), rest[1] if len(rest) > 1 else None)
+        sys.exit(0)
+    
     print("🤖 Reze Training Data Generator")
     print("=" * 50)
     
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+# instrumentation.py - 예측 요청 단계별 지연 시간 측정 (기본값: 꺼짐)
+# 요청마다 stderr에 디버그 줄을 찍는 대신, 샘플링한 요청에서만 단계(span) 시간을 재서
+# 카운터/히스토그램에 모으고 Prometheus 텍스트나 요청당 JSON 한 줄로 내보낸다.
+#
+# 단계 이름 (STAGES)
+#   load          : 데이터셋/모델 로드 (워커는 시작/재로드 때만)
+#   index_lookup  : 후보 검색 (역색인 top-k, 응답 캐시, 템플릿 검색)
+#   scoring       : 후보 응답 점수 계산
+#   model_forward : 인코더/디코더 forward (prefill + 토큰 생성 전체, sampling 포함)
+#   sampling      : 다음 토큰/응답 선택 (model_forward 안의 시간도 따로 모음)
+#   postprocess   : 토큰 -> 문자열, 공백/반복 정리
+#
+# 환경변수
+#   REZE_TRACE_SAMPLE : 측정할 요청 비율 0~1 (기본 0 = 꺼짐, span은 아무 일도 안 함)
+#   REZE_TRACE_LOG    : 샘플링된 요청마다 JSON 한 줄을 덧붙일 파일 ('-'면 stderr)
+#   REZE_DEBUG        : 1이면 예전처럼 요청마다 디버그 줄을 stderr에 출력
+#
+# 워커에서는 {"op": "metrics"} 요청으로 Prometheus 텍스트를 받는다 (server.js의 /metrics).
+# 응답 계층(tier) 시간은 샘플링과 관계없이 항상 모은다 (predict_cascade.py의 retrieval/generator 비율 조정용).
+
+import contextlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+STAGES = ('load', 'index_lookup', 'scoring', 'model_forward', 'sampling', 'postprocess')
+# 히스토그램 버킷 상한 (초)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_config = {
+    'sample_rate': float(os.environ.get('REZE_TRACE_SAMPLE', 0) or 0),
+    'log_path': os.environ.get('REZE_TRACE_LOG') or None,
+    'debug': os.environ.get('REZE_DEBUG', '') not in ('', '0'),
+}
+_local = threading.local()
+_lock = threading.Lock()
+_NOOP = contextlib.nullcontext()
+
+
+def configure(sample_rate=None, log_path=None, debug=None):
+    """환경변수 대신 코드에서 설정 (None이면 그대로 둠)"""
+    if sample_rate is not None:
+        _config['sample_rate'] = float(sample_rate)
+    if log_path is not None:
+        _config['log_path'] = log_path or None
+    if debug is not None:
+        _config['debug'] = bool(debug)
+
+
+def enabled():
+    return _config['sample_rate'] > 0
+
+
+def debug_enabled():
+    return _config['debug']
+
+
+def debug(*args):
+    """REZE_DEBUG일 때만 stderr에 출력 (요청마다 찍던 추적 줄용)"""
+    if _config['debug']:
+        print(*args, file=sys.stderr)
+
+
+# ---------- 집계 ----------
+
+class Histogram:
+    """누적 버킷 히스토그램 (Prometheus와 같은 le 의미)"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.total += seconds
+        self.count += 1
+
+    def cumulative(self):
+        running = 0
+        for bound, count in zip(BUCKETS + (float('inf'),), self.counts):
+            running += count
+            yield bound, running
+
+
+class Metrics:
+    """예측기별 요청 수/오류 수 카운터, 요청/단계 시간 히스토그램"""
+
+    def __init__(self):
+        self.requests = {}   # predictor -> 전체 요청 수 (측정이 켜져 있을 때)
+        self.sampled = {}    # predictor -> 측정한 요청 수
+        self.errors = {}     # predictor -> 예외로 끝난 요청 수
+        self.request_seconds = {}  # predictor -> Histogram
+        self.stage_seconds = {}    # (predictor, stage) -> Histogram
+        self.tier_seconds = {}     # (predictor, tier) -> Histogram (모든 요청)
+
+    def count(self, predictor, error=False):
+        with _lock:
+            self.requests[predictor] = self.requests.get(predictor, 0) + 1
+            if error:
+                self.errors[predictor] = self.errors.get(predictor, 0) + 1
+
+    def record(self, trace):
+        with _lock:
+            self.sampled[trace.predictor] = self.sampled.get(trace.predictor, 0) + 1
+            self.request_seconds.setdefault(trace.predictor, Histogram()).observe(trace.total)
+            for stage, seconds in trace.stages.items():
+                self.stage_seconds.setdefault((trace.predictor, stage), Histogram()).observe(seconds)
+
+    def error(self, predictor):
+        """요청은 응답했지만 내부 단계가 실패해 대체 응답을 쓴 경우 (샘플링 없이 항상)"""
+        with _lock:
+            self.errors[predictor] = self.errors.get(predictor, 0) + 1
+
+    def record_tier(self, predictor, tier, seconds):
+        """요청 하나를 처리한 계층과 시간 (샘플링 없이 항상)"""
+        with _lock:
+            self.tier_seconds.setdefault((predictor, tier), Histogram()).observe(seconds)
+
+    def prometheus(self):
+        """Prometheus 텍스트 형식 (version 0.0.4)"""
+        lines = ["# HELP reze_trace_sample_rate 측정하는 요청 비율",
+                 "# TYPE reze_trace_sample_rate gauge",
+                 f"reze_trace_sample_rate {_config['sample_rate']}"]
+        with _lock:
+            for name, values, help_text in (('reze_requests_total', self.requests, '예측 요청 수'),
+                                            ('reze_requests_sampled_total', self.sampled, '단계 시간을 측정한 요청 수'),
+                                            ('reze_request_errors_total', self.errors, '예외로 끝난 요청 수')):
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+                lines += [f'{name}{{predictor="{predictor}"}} {value}' for predictor, value in sorted(values.items())]
+            lines += _histogram_lines('reze_request_seconds', '요청 전체 시간 (초)',
+                                      {(('predictor', p),): h for p, h in self.request_seconds.items()})
+            lines += _histogram_lines('reze_stage_seconds', '요청 안의 단계별 시간 합 (초)',
+                                      {(('predictor', p), ('stage', s)): h for (p, s), h in self.stage_seconds.items()})
+            lines += _histogram_lines('reze_tier_seconds', '응답한 계층별 요청 시간 (초, 모든 요청)',
+                                      {(('predictor', p), ('tier', t)): h for (p, t), h in self.tier_seconds.items()})
+        return '\n'.join(lines) + '\n'
+
+    def snapshot(self):
+        """JSON으로 내보낼 요약 (히스토그램은 count/sum/버킷)"""
+        with _lock:
+            return {
+                'sample_rate': _config['sample_rate'],
+                'requests': dict(self.requests),
+                'sampled': dict(self.sampled),
+                'errors': dict(self.errors),
+                'request_seconds': {p: _histogram_dict(h) for p, h in self.request_seconds.items()},
+                'stage_seconds': {f"{p}/{s}": _histogram_dict(h) for (p, s), h in self.stage_seconds.items()},
+                'tier_seconds': {f"{p}/{t}": _histogram_dict(h) for (p, t), h in self.tier_seconds.items()},
+            }
+
+
+def _labels(pairs, extra=()):
+    return '{' + ','.join(f'{key}="{value}"' for key, value in pairs + extra) + '}'
+
+
+def _histogram_lines(name, help_text, histograms):
+    lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+    for labels, histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{name}_bucket{_labels(labels, (('le', le),))} {count}")
+        lines.append(f"{name}_sum{_labels(labels)} {histogram.total:.6f}")
+        lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+    return lines
+
+
+def _histogram_dict(histogram):
+    return {'count': histogram.count, 'sum': round(histogram.total, 6),
+            'buckets': {('+Inf' if b == float('inf') else repr(b)): c for b, c in histogram.cumulative()}}
+
+
+metrics = Metrics()
+
+
+# ---------- 요청/단계 ----------
+
+class Trace:
+    """샘플링된 요청 하나의 단계별 시간 합"""
+
+    def __init__(self, predictor):
+        self.predictor = predictor
+        self.stages = {}
+        self.start = time.perf_counter()
+        self.total = 0.0
+
+    def add(self, stage, seconds):
+        self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+@contextlib.contextmanager
+def _timed(trace, stage):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(stage, time.perf_counter() - start)
+
+
+def span(stage):
+    """
+    현재 요청이 샘플링됐으면 stage 시간을 더하는 컨텍스트, 아니면 아무것도 안 하는 공용 컨텍스트
+    같은 단계가 여러 번 나오면 (토큰마다 sampling 등) 합산
+    """
+    trace = getattr(_local, 'trace', None)
+    if trace is None:
+        return _NOOP
+    return _timed(trace, stage)
+
+
+@contextlib.contextmanager
+def request(predictor):
+    """
+    예측 요청 하나를 감쌈 (이미 요청 안이면 바깥 요청에 합쳐짐)
+    측정이 켜져 있으면 요청 수를 세고, sample_rate 확률로 단계 시간을 모아 히스토그램/JSON 줄로 기록
+    """
+    if not enabled() or getattr(_local, 'active', False):
+        yield
+        return
+    trace = Trace(predictor) if random.random() < _config['sample_rate'] else None
+    _local.active = True
+    _local.trace = trace
+    error = False
+    try:
+        yield
+    except GeneratorExit:
+        # 스트리밍 중 클라이언트가 끊겨 제너레이터가 닫힌 경우: 오류가 아니라 정상 종료
+        raise
+    except BaseException:
+        error = True
+        raise
+    finally:
+        _local.active = False
+        _local.trace = None
+        metrics.count(predictor, error)
+        if trace is not None:
+            trace.total = time.perf_counter() - trace.start
+            metrics.record(trace)
+            _write_line(trace, error)
+
+
+def _write_line(trace, error):
+    path = _config['log_path']
+    if not path:
+        return
+    line = json.dumps({
+        'ts': round(time.time(), 3),
+        'predictor': trace.predictor,
+        'total_ms': round(trace.total * 1000, 3),
+        'stages_ms': {stage: round(seconds * 1000, 3) for stage, seconds in trace.stages.items()},
+        'error': error,
+    }, ensure_ascii=False)
+    with _lock:
+        if path == '-':
+            print(line, file=sys.stderr, flush=True)
+        else:
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line + '\n')
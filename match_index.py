@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+# match_index.py - find_best_match_response용 역색인
+# dataset.json을 한 번만 전처리(소문자화/단어 분리)하고
+# 단어·문자 바이그램 포스팅 리스트로 후보를 먼저 추린 뒤
+# 후보에만 SequenceMatcher 점수를 계산한다.
+#
+# 점수 공식은 predict_hybrid_smart.find_best_match_response와 동일하며,
+# SequenceMatcher 없이 구한 점수 상한으로만 잘라내므로 상위 k개 순서가
+# 전체 스캔 결과와 항상 같다. 유사도 계산 방식은 similarity.py 백엔드로 바꿀 수 있다.
+
+import heapq
+from collections import Counter
+
+from similarity import get_similarity
+
+GREETING_WORDS = ['안녕', 'hi', 'hello']
+QUESTION_WORDS = ['뭐', '뭔']
+
+
+def char_bigrams(text):
+    """문자 바이그램 집합"""
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def pattern_flags(text_lower):
+    """특별 패턴 플래그 (인사, 뭐/뭔, 물음표)"""
+    return (
+        any(word in text_lower for word in GREETING_WORDS),
+        any(word in text_lower for word in QUESTION_WORDS),
+        '?' in text_lower,
+    )
+
+
+def length_score(query, entry):
+    """길이 유사성 (20자 차이까지 허용)"""
+    length_diff = abs(query.raw_len - entry.raw_len)
+    return max(0, 1 - length_diff / 20)
+
+
+def combine_scores(similarity, keyword_score, length_score, special_score):
+    """종합 점수 (원래 가중치 그대로)"""
+    return (similarity * 0.4 +
+            keyword_score * 0.3 +
+            length_score * 0.1 +
+            special_score * 0.2)
+
+
+class MatchEntry:
+    """미리 소문자화/분리해 둔 데이터셋 항목"""
+    __slots__ = ('item', 'lower', 'words', 'raw_len', 'flags', 'char_counts', 'profile')
+
+    def __init__(self, item, similarity, lower=None):
+        self.item = item
+        self.lower = lower if lower is not None else item['input'].lower().strip()
+        self.words = set(self.lower.split())
+        self.raw_len = len(item['input'])
+        self.flags = pattern_flags(self.lower)
+        self.char_counts = Counter(self.lower)
+        self.profile = similarity.profile(self.lower)
+
+
+class MatchQuery:
+    """메시지 쪽 전처리 결과"""
+
+    def __init__(self, message, similarity):
+        self.message = message
+        self.lower = message.lower().strip()
+        self.words = set(self.lower.split())
+        self.raw_len = len(message)
+        self.flags = pattern_flags(self.lower)
+        self.char_counts = Counter(self.lower)
+        self.profile = similarity.profile(self.lower)
+
+
+class MatchIndex:
+    def __init__(self, dataset, similarity=None):
+        self.dataset = dataset
+        self.similarity = get_similarity(similarity)
+        if hasattr(dataset, 'input_lower'):
+            # 컴파일된 데이터셋: 소문자 형태가 미리 계산되어 있음
+            self.entries = [MatchEntry(item, self.similarity, dataset.input_lower(idx))
+                            for idx, item in enumerate(dataset)]
+        else:
+            self.entries = [MatchEntry(item, self.similarity) for item in dataset]
+
+        # 포스팅 리스트: 단어 / 문자 바이그램 / 특별 패턴 -> 항목 id
+        self.token_postings = {}
+        self.bigram_postings = {}
+        self.flag_postings = ([], [], [])
+
+        # (소문자 길이, 원문 길이) -> 항목 id (후보 밖 항목의 상한 계산용)
+        self.length_buckets = {}
+
+        for idx, entry in enumerate(self.entries):
+            for word in entry.words:
+                self.token_postings.setdefault(word, []).append(idx)
+            for bigram in char_bigrams(entry.lower):
+                self.bigram_postings.setdefault(bigram, []).append(idx)
+            for flag_idx, flag in enumerate(entry.flags):
+                if flag:
+                    self.flag_postings[flag_idx].append(idx)
+            self.length_buckets.setdefault((len(entry.lower), entry.raw_len), []).append(idx)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def score(self, query, idx, similarity=None):
+        """항목 하나의 점수 계산 -> (total, similarity, keyword_score)"""
+        entry = self.entries[idx]
+
+        # 1. 직접 유사도
+        if similarity is None:
+            similarity = self.similarity.ratio(query, entry)
+
+        # 2. 키워드 매칭
+        common_words = query.words & entry.words
+        keyword_score = len(common_words) / max(len(query.words), 1) if query.words else 0
+
+        # 3. 길이 유사성
+        length = length_score(query, entry)
+
+        # 4. 특별 패턴 매칭
+        special_score = 0
+        if entry.flags[0] and query.flags[0]:
+            special_score += 0.3
+        if entry.flags[1] and query.flags[1]:
+            special_score += 0.3
+        if entry.flags[2] and query.flags[2]:
+            special_score += 0.2
+
+        # 5. 종합 점수
+        total_score = combine_scores(similarity, keyword_score, length, special_score)
+        return total_score, similarity, keyword_score
+
+    def shortlist(self, query):
+        """포스팅 리스트로 1차 후보 추출 (단어/바이그램/특별 패턴이 하나라도 겹치는 항목)"""
+        ids = set()
+        for word in query.words:
+            ids.update(self.token_postings.get(word, ()))
+        for bigram in char_bigrams(query.lower):
+            ids.update(self.bigram_postings.get(bigram, ()))
+        for flag_idx, flag in enumerate(query.flags):
+            if flag:
+                ids.update(self.flag_postings[flag_idx])
+        return ids
+
+    def upper_bound(self, query, idx):
+        """
+        SequenceMatcher 없이 계산하는 점수 상한
+        유사도만 백엔드의 싼 상한(difflib은 quick_ratio와 같은 값)으로 바꾸고
+        나머지 항목은 정확히 계산
+        """
+        return self.score(query, idx, self.similarity.upper_bound(query, self.entries[idx]))[0]
+
+    def _candidate(self, idx, scored):
+        total, similarity, keyword_score = scored
+        return {
+            'item': self.entries[idx].item,
+            'score': total,
+            'similarity': similarity,
+            'keyword_score': keyword_score
+        }
+
+    def rank_all(self, message):
+        """전체 항목 점수순 정렬 (원래 동작과 동일, 전처리만 재사용)"""
+        query = MatchQuery(message, self.similarity)
+        candidates = [self._candidate(idx, self.score(query, idx)) for idx in range(len(self.entries))]
+        candidates.sort(key=lambda x: x['score'], reverse=True)
+        return candidates
+
+    def top_k(self, message, k=5, where=None):
+        """
+        상위 k개 후보 (전체 스캔과 같은 순서 보장)
+        where: 데이터셋 항목(dict)을 받아 True/False를 반환하는 필터
+
+        1차 후보(포스팅 리스트)와 나머지 항목(길이 버킷)을 점수 상한이 높은 순서로
+        꺼내면서, 상한이 현재 k번째 점수보다 낮아지면 바로 멈춘다.
+        """
+        query = MatchQuery(message, self.similarity)
+        shortlist = self.shortlist(query)
+
+        def accept(idx):
+            return where is None or where(self.entries[idx].item)
+
+        # (-상한, 항목 id, 버킷) 힙 - 버킷은 음수 id로 구분
+        pending = []
+        for idx in shortlist:
+            if accept(idx):
+                pending.append((-self.upper_bound(query, idx), idx, None))
+
+        # 후보 밖 항목: 공통 단어/바이그램/특별 패턴이 없으므로 키워드·특별 점수는 0
+        # 같은 길이 버킷은 상한이 같으므로 버킷 단위로 넣어두고 필요할 때 펼친다
+        for bucket_no, ((lower_len, raw_len), ids) in enumerate(self.length_buckets.items()):
+            similarity_bound = self.similarity.length_bound(len(query.lower), lower_len)
+            bound = combine_scores(similarity_bound, 0, max(0, 1 - abs(query.raw_len - raw_len) / 20), 0)
+            pending.append((-bound, -1 - bucket_no, ids))
+        heapq.heapify(pending)
+
+        scored = {}
+        best_scores = []  # 상위 k개 점수 (최소 힙)
+
+        def threshold():
+            return best_scores[0] if len(best_scores) >= k else float('-inf')
+
+        while pending:
+            neg_bound, idx, bucket = heapq.heappop(pending)
+            if -neg_bound < threshold():
+                break
+
+            if bucket is not None:
+                for bucket_idx in bucket:
+                    if bucket_idx not in shortlist and accept(bucket_idx):
+                        heapq.heappush(pending, (-self.upper_bound(query, bucket_idx), bucket_idx, None))
+                continue
+
+            scored[idx] = self.score(query, idx)
+            heapq.heappush(best_scores, scored[idx][0])
+            if len(best_scores) > k:
+                heapq.heappop(best_scores)
+
+        # 점수 내림차순, 동점은 데이터셋 순서 (원래 안정 정렬과 동일)
+        ranked = sorted(scored.items(), key=lambda x: (-x[1][0], x[0]))[:k]
+        return [self._candidate(idx, s) for idx, s in ranked]
+
+
+_cached_index = None
+
+
+def get_match_index(dataset, similarity=None):
+    """같은 데이터셋 객체/유사도 백엔드에 대해서는 색인을 한 번만 만든다"""
+    global _cached_index
+    similarity = get_similarity(similarity)
+    if (_cached_index is None or _cached_index.dataset is not dataset
+            or _cached_index.similarity is not similarity):
+        _cached_index = MatchIndex(dataset, similarity)
+    return _cached_index
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+# predict_cascade.py - 검색 매칭 → 신경망 생성 2단계 예측
+# 먼저 predict_hybrid_smart의 검색 매칭으로 후보를 찾고, 최고 점수가 임계값을 넘으면 그대로 응답한다 (retrieval).
+# 넘지 못한 메시지만 학습된 Transformer(predict_enhanced)로 넘기고, 검색 후보 상위 3개를 템플릿으로 재사용한다
+# (generator). 생성 모델은 처음 넘어온 요청 때 로드하므로 검색만으로 끝나는 동안은 torch를 올리지 않는다.
+# 생성 모델을 로드하거나 돌리다 실패하면 (체크포인트가 없는 새 checkout 등) 검색 후보로 응답한다
+# (retrieval_fallback, 오류는 /metrics의 reze_request_errors_total{predictor="cascade_generator"}).
+#
+# 임계값: REZE_CASCADE_THRESHOLD (기본 0.3, 요청마다 "threshold"로 바꿀 수 있음)
+#   0.3 이하는 generate_smart_response가 길이만 보고 고르던 구간이고, 0.5를 넘으면 검색 결과를 그대로 쓰던 구간
+#
+# 계층별 비율/지연: 워커에 {"op": "stats"} (최근 요청 기준, 임계값별 생성 비율과 예상 평균 지연 포함)
+#                   /metrics의 reze_tier_seconds{predictor="cascade",tier=...} (instrumentation.py)
+#
+# 사용법: python3 predict_cascade.py '{"message": "안녕", "threshold": 0.4}'
+#         python3 predict_cascade.py --worker [--socket /tmp/reze_cascade.sock] [--max-batch 8]
+
+import collections
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+
+from batch_scheduler import MicroBatcher
+from instrumentation import debug, metrics, request, span
+from predict_hybrid_smart import (generate_smart_response, get_response_cache, load_dataset,
+                                  postprocess_response, rank_candidates)
+from prediction_worker import is_worker_mode, parse_worker_args, run_worker
+
+DEFAULT_THRESHOLD = float(os.environ.get('REZE_CASCADE_THRESHOLD', 0.3))
+TIERS = ('retrieval', 'generator', 'retrieval_fallback')
+STATS_WINDOW = 10000  # 비율/지연을 계산할 최근 요청 수
+TUNING_THRESHOLDS = (0.2, 0.3, 0.4, 0.5, 0.6, 0.7)
+
+# 모델 경로별 생성 모델 (처음 넘어온 요청 때 로드)
+_generators = {}
+_generator_lock = threading.Lock()
+
+
+def _percentile_ms(sorted_seconds, p):
+    if not sorted_seconds:
+        return None
+    rank = max(1, -(-len(sorted_seconds) * p // 100))
+    return round(sorted_seconds[int(rank) - 1] * 1000, 3)
+
+
+class CascadeStats:
+    """최근 요청의 (최고 검색 점수, 응답 계층, 시간)으로 계층별 비율/지연과 임계값별 비용 추정"""
+
+    def __init__(self, window=STATS_WINDOW):
+        self._recent = collections.deque(maxlen=window)
+        self._totals = dict.fromkeys(TIERS, 0)
+        self._lock = threading.Lock()
+
+    def record(self, tier, score, seconds):
+        with self._lock:
+            self._recent.append((score, tier, seconds))
+            self._totals[tier] += 1
+        metrics.record_tier('cascade', tier, seconds)
+
+    def snapshot(self, threshold=DEFAULT_THRESHOLD):
+        with self._lock:
+            recent = list(self._recent)
+            totals = dict(self._totals)
+
+        tiers = {}
+        for tier in TIERS:
+            seconds = sorted(s for _, t, s in recent if t == tier)
+            tiers[tier] = {
+                'total': totals[tier],
+                'hit_rate': round(len(seconds) / len(recent), 3) if recent else 0,
+                'p50_ms': _percentile_ms(seconds, 50),
+                'p95_ms': _percentile_ms(seconds, 95),
+                'mean_ms': round(sum(seconds) / len(seconds) * 1000, 3) if seconds else None,
+            }
+
+        # 임계값을 바꾸면 생성 모델로 넘어갈 비율과, 계층별 평균 지연으로 본 요청당 예상 평균 지연
+        scores = [score for score, _, _ in recent]
+        generator_rate_at, estimated_mean_ms_at = {}, {}
+        for candidate in TUNING_THRESHOLDS:
+            rate = sum(score <= candidate for score in scores) / len(scores) if scores else 0
+            generator_rate_at[str(candidate)] = round(rate, 3)
+            if tiers['retrieval']['mean_ms'] is not None and tiers['generator']['mean_ms'] is not None:
+                estimated_mean_ms_at[str(candidate)] = round(
+                    rate * tiers['generator']['mean_ms'] + (1 - rate) * tiers['retrieval']['mean_ms'], 3)
+
+        return {'threshold': threshold, 'window': len(recent), 'tiers': tiers,
+                'generator_rate_at': generator_rate_at, 'estimated_mean_ms_at': estimated_mean_ms_at}
+
+
+cascade_stats = CascadeStats()
+
+
+def load_generator(model_path=None):
+    """생성 계층 모델 (model, char_to_idx, idx_to_char, max_seq_len), 경로별로 한 번만 로드"""
+    from predict_enhanced import default_model_path, load_enhanced_model
+
+    model_path = model_path or default_model_path()
+    with _generator_lock:
+        if model_path not in _generators:
+            with span('load'):
+                _generators[model_path] = load_enhanced_model(model_path)
+        return _generators[model_path]
+
+
+def generate_batch(messages, templates, dataset, loaded_model):
+    """생성 계층: 검색 후보를 템플릿으로 넘겨 predict_enhanced 배치 예측"""
+    from predict_enhanced import predict_batch_with_new_model
+
+    model, char_to_idx, idx_to_char, max_seq_len = loaded_model
+    return predict_batch_with_new_model(messages, model, char_to_idx, idx_to_char, max_seq_len, dataset,
+                                        templates=templates)
+
+
+def predict_cascade(message, dataset_path='./dataset.json', dataset=None, loaded_model=None, threshold=None,
+                    generate=None, stats=cascade_stats):
+    """
+    검색 최고 점수가 threshold를 넘으면 검색 응답, 아니면 생성 모델 응답
+    loaded_model: 생성 모델 (없으면 처음 넘어올 때 load_generator)
+    generate: (메시지, 템플릿) -> 응답 (워커는 MicroBatcher로 넘김)
+    """
+    threshold = DEFAULT_THRESHOLD if threshold is None else threshold
+    start = time.perf_counter()
+    with request('cascade'):
+        if dataset is None:
+            with span('load'):
+                dataset = load_dataset(dataset_path)
+
+        with span('index_lookup'):
+            candidates, length_matched = rank_candidates(message, dataset, get_response_cache(dataset_path))
+        score = candidates[0]['score'] if candidates else 0.0
+
+        if score > threshold:
+            tier = 'retrieval'
+            with span('sampling'):
+                response = generate_smart_response(message, dataset, candidates, length_matched)
+        else:
+            tier = 'generator'
+            templates = [(candidate['item'], candidate['score']) for candidate in candidates[:3]]
+            debug(f"생성 모델로 넘김: 최고 점수 {score:.2f} <= {threshold}")
+            try:
+                if generate is not None:
+                    response = generate(message, templates)
+                else:
+                    response = generate_batch([message], [templates], dataset, loaded_model or load_generator())[0]
+            except Exception as e:
+                if getattr(e, 'retryable', False):
+                    raise  # 과부하 (QueueFull)는 그대로 재시도 오류로
+                tier = 'retrieval_fallback'
+                print(f"생성 계층 오류, 검색 응답으로 대체: {e}", file=sys.stderr)
+                traceback.print_exc(file=sys.stderr)
+                metrics.error('cascade_generator')
+                with span('sampling'):
+                    response = generate_smart_response(message, dataset, candidates, length_matched)
+
+        with span('postprocess'):
+            response = postprocess_response(response)
+
+    stats.record(tier, score, time.perf_counter() - start)
+    debug(f"{tier} 응답 (점수 {score:.2f}): '{response}'")
+    return response
+
+
+def run_worker_mode(argv, model_path=None, dataset_path='./dataset.json'):
+    """
+    상주 워커 모드: 데이터셋을 한 번만 로드하고 NDJSON 요청을 계속 처리
+    생성 계층으로 넘어간 동시 요청은 MicroBatcher로 묶어 처리 (--max-batch, --max-wait-ms)
+    {"op": "stats"}: 계층별 비율/지연, 순위 캐시, 배치 통계
+    """
+    args = parse_worker_args(argv)
+    cache = get_response_cache(dataset_path)
+    state = {'dataset': load_dataset(dataset_path), 'generation': cache.generation}
+
+    def current_dataset():
+        # dataset.json 내용이 바뀌면 캐시가 비워지고 데이터셋도 다시 로드
+        cache.check_source()
+        if cache.generation != state['generation']:
+            state['dataset'] = load_dataset(dataset_path)
+            state['generation'] = cache.generation
+        return state['dataset']
+
+    def run_batch(items):
+        # 템플릿을 뽑은 데이터셋으로 생성 (대기 중에 다시 로드됐으면 데이터셋 세대별로 나눠 처리)
+        groups = {}
+        for i, (_, _, dataset) in enumerate(items):
+            groups.setdefault(id(dataset), []).append(i)
+        responses = [None] * len(items)
+        with request('cascade_generator_batch'):
+            loaded_model = load_generator(model_path)
+            for indices in groups.values():
+                dataset = items[indices[0]][2]
+                batch = generate_batch([items[i][0] for i in indices], [items[i][1] for i in indices],
+                                       dataset, loaded_model)
+                for i, response in zip(indices, batch):
+                    responses[i] = response
+        return responses
+
+    batcher = MicroBatcher(run_batch, args.max_batch, args.max_wait_ms)
+
+    def handle_request(request):
+        if request.get('op') == 'stats':
+            return {'cascade': cascade_stats.snapshot(request.get('threshold', DEFAULT_THRESHOLD)),
+                    'cache': cache.stats(), 'batch': batcher.stats()}
+        dataset = current_dataset()
+        return predict_cascade(request['message'], dataset_path, dataset,
+                               threshold=request.get('threshold'),
+                               generate=lambda message, templates: batcher.submit((message, templates, dataset)))
+
+    # 배치 하나가 도는 동안 다음 배치가 찰 수 있게 요청 스레드는 max_batch의 두 배
+    # (--max-queue 상한은 run_worker가 요청을 받을 때 모든 연결을 합쳐 한 번만 검사)
+    run_worker(handle_request, argv, min_threads=2 * args.max_batch)
+
+
+if __name__ == "__main__":
+    if is_worker_mode(sys.argv[1:]):
+        run_worker_mode(sys.argv[1:])
+        sys.exit(0)
+
+    try:
+        args = json.loads(sys.argv[1])
+        response = predict_cascade(args['message'], threshold=args.get('threshold'))
+        print(json.dumps({"status": "success", "response": response, "stats": cascade_stats.snapshot(args.get('threshold', DEFAULT_THRESHOLD))},
+                         ensure_ascii=False))
+
+    except Exception as e:
+        print(f"에러: {str(e)}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        print(json.dumps({"status": "error", "message": str(e)}, ensure_ascii=False))
+        sys.exit(1)
@@ -1,72 +1,164 @@
 import torch
-import torch.nn as nn
 import json
+import os
 import sys
 import torch.nn.functional as F
-from difflib import SequenceMatcher
-
-# 최적화된 Transformer 모델 (학습과 동일)
-class TransformerModel(nn.Module):
-    def __init__(self, vocab_size, embed_dim, num_heads, num_layers, max_seq_len):
-        super(TransformerModel, self).__init__()
-        self.embedding = nn.Embedding(vocab_size, embed_dim)
-        self.positional_encoding = nn.Parameter(torch.zeros(1, max_seq_len, embed_dim))
-        self.transformer = nn.Transformer(
-            d_model=embed_dim,
-            nhead=num_heads,
-            num_encoder_layers=num_layers,
-            num_decoder_layers=num_layers,
-            batch_first=True
-        )
-        self.fc_out = nn.Linear(embed_dim, vocab_size)
-        
-    def forward(self, src, tgt):
-        src = self.embedding(src) + self.positional_encoding[:, :src.size(1), :]
-        tgt = self.embedding(tgt) + self.positional_encoding[:, :tgt.size(1), :]
-        output = self.transformer(src, tgt)
-        return self.fc_out(output)
+import heapq
+import time
+import traceback
+
+from batch_scheduler import MicroBatcher
+from compiled_dataset import load_dataset_fast
+from export_model import DEFAULT_CHECKPOINT, DEFAULT_EXPORT, load_exported, passed_parity
+from instrumentation import debug, debug_enabled, metrics, request, span
+from prediction_worker import is_worker_mode, parse_worker_args, run_worker
+from reze_model import TransformerModel
+from similarity import get_similarity, pruned_ratio
 
-def predict_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len, dataset):
+def find_best_templates(message, dataset, k=3, min_score=0.3, similarity=None):
     """
-    새로 학습된 모델로 향상된 예측
+    점수가 min_score를 넘는 템플릿 중 상위 k개 (점수순, 동점은 데이터셋 순서)
+    유사도 상한으로 k번째 점수를 넘을 수 없는 항목은 정확한 계산을 건너뜀
+    컴파일된 데이터셋이면 미리 계산한 소문자 형태/길이를 쓰고, 항목 dict는 상위 k개에 들 때만 꺼냄
     """
-    print(f"새 모델 예측: {message}", file=sys.stderr)
-    
-    # 1. 유사한 패턴 찾기 (향상된 매칭)
-    best_templates = []
     message_lower = message.lower().strip()
+    msg_words = set(message_lower.split())
+    top = []  # (점수, -순번) 최소 힙
+    compiled = hasattr(dataset, 'input_lower')
+    similarity = get_similarity(similarity)  # 항목마다 REZE_SIMILARITY를 다시 읽지 않게 한 번만
     
-    for item in dataset:
-        input_lower = item['input'].lower().strip()
-        
-        # 문자열 유사도
-        char_sim = SequenceMatcher(None, message_lower, input_lower).ratio()
+    for order in range(len(dataset)):
+        if compiled:
+            input_lower, input_len = dataset.input_lower(order), dataset.input_length(order)
+        else:
+            item = dataset[order]
+            input_lower, input_len = item['input'].lower().strip(), len(item['input'])
         
         # 단어 유사도
-        msg_words = set(message_lower.split())
         inp_words = set(input_lower.split())
         word_sim = len(msg_words & inp_words) / max(len(msg_words), 1) if msg_words else 0
         
         # 길이 유사도
-        len_sim = 1.0 - abs(len(message) - len(item['input'])) / 30
+        len_sim = 1.0 - abs(len(message) - input_len) / 30
         len_sim = max(0, len_sim)
         
+        def keep(char_bound):
+            bound = char_bound * 0.5 + word_sim * 0.3 + len_sim * 0.2
+            return bound > min_score and (len(top) < k or (bound, -order) > top[0][:2])
+        
+        # 문자열 유사도 (상한으로 먼저 거름)
+        char_sim = pruned_ratio(message_lower, input_lower, keep, similarity)
+        if char_sim is None:
+            continue
+        
         # 종합 점수
         total_score = char_sim * 0.5 + word_sim * 0.3 + len_sim * 0.2
         
-        if total_score > 0.3:
-            best_templates.append((item, total_score))
+        if total_score > min_score:
+            heapq.heappush(top, (total_score, -order, dataset[order] if compiled else item))
+            if len(top) > k:
+                heapq.heappop(top)
     
-    # 점수순 정렬
-    best_templates.sort(key=lambda x: x[1], reverse=True)
-    if not best_templates:
-        best_templates = [(dataset[0], 0.1)]
+    top.sort(key=lambda x: (-x[0], -x[1]))
+    return [(item, score) for score, _, item in top]
+
+def sample_top_k(k):
+    """상위 k개 토큰 중 확률 비례 샘플링 (로짓 (..., vocab) -> 토큰 id (...), 모든 위치를 한 번에)"""
+    def choose(logits):
+        probs = F.softmax(logits, dim=-1)
+        top = probs.topk(min(k, probs.size(-1)), dim=-1)
+        weights = F.softmax(top.values, dim=-1)
+        picks = torch.multinomial(weights.reshape(-1, weights.size(-1)), 1).view(*weights.shape[:-1], 1)
+        return top.indices.gather(-1, picks).squeeze(-1)
+    return choose
+
+# 후보 토큰 선택 방식 (로짓 (..., vocab) -> 토큰 id (...))
+SAMPLING_METHODS = ['greedy', 'top3', 'top5']
+SAMPLERS = {
+    'greedy': lambda logits: logits.argmax(dim=-1),
+    'top3': sample_top_k(3),
+    'top5': sample_top_k(5),
+}
+
+# 템플릿 응답 앞부분을 얼마나 남기고 생성할지
+PREFIX_RATIOS = [0.8, 0.6, 0.4, 0.2]
+
+# 스트리밍 생성: 후보 탐색 없이 최상위 템플릿 하나, 이 prefix 비율/샘플링 방식으로 한 행만 생성
+# (36개 후보 중 고르는 /chat/enhanced와 같은 메시지에도 응답이 다를 수 있음, stream_with_new_model 참고)
+STREAM_PREFIX_RATIO = 0.6
+STREAM_SAMPLING = 'top3'
+# 응답 최대 글자 수 (tokens_to_text)
+MAX_RESPONSE_CHARS = 25
+
+# 추측 디코딩: 템플릿의 prefix 뒤 나머지를 초안으로 한 번에 검증 (인과 모델만, REZE_SPECULATIVE=1로 켬)
+SPECULATIVE = os.environ.get('REZE_SPECULATIVE', '') not in ('', '0')
+
+# 후보 생성 방식 (REZE_DECODING)
+#   sample: 템플릿 3개 x PREFIX_RATIOS x SAMPLING_METHODS = 36개 후보를 만들고 score_candidates 휴리스틱으로 고름
+#   beam  : 템플릿 3개 x BEAM_PREFIX_RATIOS마다 빔 탐색, 길이 정규화 로그 확률로 고름 (인과 모델만, 아니면 sample)
+DECODINGS = ('sample', 'beam')
+DECODING = os.environ.get('REZE_DECODING', 'sample')
+BEAM_WIDTH = int(os.environ.get('REZE_BEAM_WIDTH', 4))
+BEAM_PREFIX_RATIOS = [0.4]
+LENGTH_PENALTY = 1.0   # 점수 = 로그 확률 합 / 길이 ** LENGTH_PENALTY
+NO_REPEAT_NGRAM = 3    # 같은 3-gram 반복 금지 (sample의 다양성 검사 대신)
+
+def score_candidates(candidates, similarity=None):
+    """
+    후보 응답들을 한꺼번에 평가해 (최고 응답, 점수) 반환 (없으면 ("", 0))
+    candidates: (응답, 템플릿 응답, 템플릿 점수) 목록, 동점이면 앞의 후보가 이김
+    유사도를 뺀 점수를 먼저 모두 계산하고, 상한이 높은 후보부터 유사도를 구해
+    현재 최고 점수를 넘을 수 없는 후보는 건너뜀
+    """
+    scored = []  # (상한, 순번, 기본 점수, 응답, 템플릿 응답, 한국어 비율, 다양성)
+    for order, (response, template_response, template_score) in enumerate(candidates):
+        response = response.strip()
+        if len(response) < 2:
+            continue
+        
+        # 품질 평가
+        response_len = len(response)
+        korean_ratio = sum(1 for c in response if '가' <= c <= '힣') / response_len
+        
+        # 반복 패턴 체크 (너무 반복적이면 제외)
+        diversity = len(set(response)) / response_len
+        if diversity <= 0.3:
+            continue
+        
+        # 길이 점수
+        length_score = min(response_len / 15, 1.0)
+        
+        base = korean_ratio * 0.3 + diversity * 0.2 + length_score * 0.2 + template_score * 0.15
+        scored.append((base + 0.15, order, base, response, template_response, korean_ratio, diversity))
     
-    print(f"상위 템플릿들:", file=sys.stderr)
-    for i, (template, score) in enumerate(best_templates[:3]):
-        print(f"  {i+1}. '{template['input']}' → '{template['label']}' ({score:.2f})", file=sys.stderr)
+    scored.sort(key=lambda x: (-x[0], x[1]))
+    best_response = ""
+    best_key = (0, 1)  # (점수, -순번): 0점을 넘어야 채택
+    for bound, order, base, response, template_response, korean_ratio, diversity in scored:
+        if (bound, -order) <= best_key:
+            break
+        
+        # 템플릿과의 유사도 (현재 최고 점수를 넘을 수 없으면 건너뜀)
+        template_sim = pruned_ratio(response.lower(), template_response.lower(),
+                                    lambda sim_bound: (base + sim_bound * 0.15, -order) > best_key, similarity)
+        if template_sim is None:
+            continue
+        
+        # 최종 점수
+        final_score = base + template_sim * 0.15
+        
+        if debug_enabled():
+            debug(f"    후보: '{response}' (점수: {final_score:.2f}, 한국어: {korean_ratio:.1f}, 다양성: {diversity:.1f})")
+        
+        if (final_score, -order) > best_key:
+            best_response = response
+            best_key = (final_score, -order)
     
-    # 2. 입력 인코딩
+    return best_response, best_key[0]
+
+
+def message_indices(message, model, char_to_idx, max_seq_len):
+    """메시지 -> 인코더 입력 토큰 id 목록 (어휘 밖 문자는 <PAD>, 끝에 <EOS>)"""
     input_indices = []
     for char in message:
         if char in char_to_idx:
@@ -75,182 +167,547 @@ def predict_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len
             input_indices.append(char_to_idx['<PAD>'])
     input_indices.append(char_to_idx['<EOS>'])
     
-    # 패딩
-    if len(input_indices) < max_seq_len:
-        input_indices.extend([char_to_idx['<PAD>']] * (max_seq_len - len(input_indices)))
-    else:
+    # 패딩 (패딩 마스크로 학습한 모델은 메시지 하나라 패딩 없이 그대로)
+    if len(input_indices) >= max_seq_len:
         input_indices = input_indices[:max_seq_len-1] + [char_to_idx['<EOS>']]
+    elif not model.padding_mask:
+        input_indices.extend([char_to_idx['<PAD>']] * (max_seq_len - len(input_indices)))
+    
+    return input_indices
+
+def encode_message(message, model, char_to_idx, max_seq_len):
+    """메시지 -> 인코더 입력 (1, 길이)"""
+    return torch.tensor([message_indices(message, model, char_to_idx, max_seq_len)], dtype=torch.long)
+
+def template_tokens(template_response, char_to_idx):
+    """템플릿 응답 -> 토큰 id 목록 (어휘 밖 문자는 <PAD>, 끝에 <EOS>)"""
+    return [char_to_idx.get(char, char_to_idx['<PAD>']) for char in template_response] + [char_to_idx['<EOS>']]
+
+def plan_candidates(message, char_to_idx, max_seq_len, dataset, similarity=None, templates=None, ratios=PREFIX_RATIOS):
+    """
+    메시지 하나의 후보 계획: (상위 템플릿 목록, prefix 목록)
+    prefix 목록: 템플릿 3개 x ratios마다 (템플릿 응답, 템플릿 점수, prefix 토큰)
+    templates: 이미 찾아둔 (항목, 점수) 목록 (predict_cascade가 검색 후보를 넘김), 없으면 직접 검색
+    """
+    debug(f"새 모델 예측: {message}")
     
-    input_tensor = torch.tensor([input_indices], dtype=torch.long)
+    # 유사한 패턴 찾기 (향상된 매칭)
+    if templates is not None:
+        best_templates = list(templates)
+    else:
+        with span('index_lookup'):
+            best_templates = find_best_templates(message, dataset, similarity=similarity)
+    if not best_templates:
+        best_templates = [(dataset[0], 0.1)]
     
-    # 3. 다양한 템플릿으로 예측 시도
-    best_response = ""
-    best_score = 0
+    if debug_enabled():
+        debug(f"상위 템플릿들:")
+        for i, (template, score) in enumerate(best_templates[:3]):
+            debug(f"  {i+1}. '{template['input']}' → '{template['label']}' ({score:.2f})")
     
+    prefixes = []  # (템플릿 응답, 템플릿 점수, prefix 토큰)
     for template_item, template_score in best_templates[:3]:
         template_response = template_item['label']
         
-        try:
-            # 템플릿을 시작점으로 사용
-            template_indices = []
-            for char in template_response:
-                if char in char_to_idx:
-                    template_indices.append(char_to_idx[char])
-                else:
-                    template_indices.append(char_to_idx['<PAD>'])
-            template_indices.append(char_to_idx['<EOS>'])
+        # 템플릿을 시작점으로 사용
+        template_indices = template_tokens(template_response, char_to_idx)
+        
+        # 다양한 길이로 시도
+        for prefix_ratio in ratios:
+            prefix_len = min(max(1, int(len(template_indices) * prefix_ratio)), max_seq_len - 1)
+            prefixes.append((template_response, template_score, template_indices[:prefix_len]))
+    return best_templates, prefixes
+
+def source_batch(model, inputs, pad_idx):
+    """인코더 입력 목록 -> (장치, 오른쪽 패딩한 소스 (B, S), 길이가 다르면 key padding 마스크 아니면 None)"""
+    device = model.device
+    width = max(len(ids) for ids in inputs)
+    src = torch.tensor([ids + [pad_idx] * (width - len(ids)) for ids in inputs], dtype=torch.long, device=device)
+    src_mask = None
+    if any(len(ids) != width for ids in inputs):
+        lengths = torch.tensor([len(ids) for ids in inputs], device=device)
+        src_mask = torch.zeros(src.shape, device=device).masked_fill(
+            torch.arange(width, device=device)[None, :] >= lengths[:, None], float('-inf'))
+    return device, src, src_mask
+
+def generate_beams(model, inputs, prefix_lists, pad_idx, eos_idx, beam_width=BEAM_WIDTH):
+    """
+    메시지 여러 개의 prefix마다 빔 탐색 (인과 모델, 모든 prefix x 빔이 디코더 한 배치)
+    반환: 메시지마다 [prefix j] -> [(prefix + 생성 토큰, 정규화 점수)] (점수 높은 순)
+    """
+    _, src, src_mask = source_batch(model, inputs, pad_idx)
+    owners = [m for m, prefixes in enumerate(prefix_lists) for _ in prefixes]
+    flat = [prefix for prefixes in prefix_lists for prefix in prefixes]
+    
+    with span('model_forward'):
+        memory = model.encode(src) if src_mask is None else model.encode(src, src_key_padding_mask=src_mask)
+        cache = model.init_cache(memory, src_mask).select(owners)
+        beams = model.beam_search(cache, flat, pad_idx, eos_idx, beam_width,
+                                  [max(0, MAX_RESPONSE_CHARS - len(p)) for p in flat], LENGTH_PENALTY, NO_REPEAT_NGRAM)
+    
+    results = [[] for _ in prefix_lists]
+    for owner, prefix, prefix_beams in zip(owners, flat, beams):
+        results[owner].append([(prefix + tokens, score) for tokens, score in prefix_beams])
+    return results
+
+def generate_rows(model, inputs, prefix_lists, pad_idx, eos_idx, max_seq_len, draft_lists=None):
+    """
+    메시지 여러 개의 후보를 한 배치로 생성
+    inputs: 메시지마다 인코더 입력 토큰 id 목록, prefix_lists: 메시지마다 prefix 토큰 목록
+    draft_lists: prefix마다 추측 디코딩 초안 토큰 (템플릿 나머지, 인과 모델에서만 사용)
+    소스는 한 번에 인코딩하고 (길이가 다르면 오른쪽 패딩 + key padding 마스크), 모든 prefix x 샘플링 방식을
+    디코더 한 배치로 계산
+    반환: 메시지마다 [샘플링 방식 i][prefix j] 토큰 목록
+    """
+    device, src, src_mask = source_batch(model, inputs, pad_idx)
+    
+    # 행 순서: 샘플링 방식별로 (메시지 순서대로 이어 붙인) prefix 전체
+    owners = [m for m, prefixes in enumerate(prefix_lists) for _ in prefixes]
+    flat = [prefix for prefixes in prefix_lists for prefix in prefixes]
+    num_prefixes = len(flat)
+    
+    with span('model_forward'):
+        # 소스는 메시지마다 한 번만 인코딩하고 그 메시지의 모든 후보가 공유
+        memory = model.encode(src) if src_mask is None else model.encode(src, src_key_padding_mask=src_mask)
+        
+        if model.causal:
+            cache = model.init_cache(memory, src_mask)
             
-            # 다양한 길이로 시도
-            for prefix_ratio in [0.8, 0.6, 0.4, 0.2]:
-                prefix_len = max(1, int(len(template_indices) * prefix_ratio))
-                target_prefix = template_indices[:prefix_len]
-                
-                # 패딩하여 고정 길이로 만들기
-                target_tokens = target_prefix + [char_to_idx['<PAD>']] * (max_seq_len - len(target_prefix))
-                target_tokens = target_tokens[:max_seq_len]
-                
-                tgt_input = torch.tensor([target_tokens[:-1]], dtype=torch.long)
-                
-                model.eval()
-                with torch.no_grad():
-                    output = model(input_tensor, tgt_input)
-                    
-                    # Top-k 샘플링으로 다양성 추가
-                    probs = F.softmax(output[0], dim=-1)
-                    
-                    # 여러 방식으로 토큰 선택
-                    for sampling_method in ['greedy', 'top3', 'top5']:
-                        if sampling_method == 'greedy':
-                            predicted_tokens = output[0].argmax(dim=-1)
-                        elif sampling_method == 'top3':
-                            predicted_tokens = []
-                            for prob_dist in probs:
-                                top_k = min(3, len(prob_dist))
-                                top_indices = prob_dist.topk(top_k).indices
-                                predicted_tokens.append(torch.multinomial(F.softmax(prob_dist[top_indices], dim=0), 1).item())
-                            predicted_tokens = torch.tensor(predicted_tokens)
-                        else:  # top5
-                            predicted_tokens = []
-                            for prob_dist in probs:
-                                top_k = min(5, len(prob_dist))
-                                top_indices = prob_dist.topk(top_k).indices
-                                predicted_tokens.append(top_indices[torch.multinomial(F.softmax(prob_dist[top_indices], dim=0), 1)].item())
-                            predicted_tokens = torch.tensor(predicted_tokens)
-                        
-                        # 토큰을 문자로 변환
-                        response_chars = []
-                        for token in predicted_tokens:
-                            token_val = token.item() if hasattr(token, 'item') else token
-                            
-                            if token_val in idx_to_char:
-                                char = idx_to_char[token_val]
-                                if char not in ['<PAD>', '<EOS>']:
-                                    response_chars.append(char)
-                            
-                            # 적당한 길이에서 중단
-                            if len(response_chars) >= 25:
-                                break
-                        
-                        if response_chars:
-                            response = ''.join(response_chars).strip()
-                            
-                            if len(response) >= 2:
-                                # 품질 평가
-                                korean_chars = sum(1 for c in response if '가' <= c <= '힣')
-                                response_len = len(response)
-                                korean_ratio = korean_chars / response_len if response_len > 0 else 0
-                                
-                                # 반복 패턴 체크
-                                unique_chars = len(set(response))
-                                diversity = unique_chars / response_len if response_len > 0 else 0
-                                
-                                # 길이 점수
-                                length_score = min(response_len / 15, 1.0)
-                                
-                                # 템플릿과의 유사도
-                                template_sim = SequenceMatcher(None, response.lower(), template_response.lower()).ratio()
-                                
-                                # 최종 점수
-                                final_score = (
-                                    korean_ratio * 0.3 +
-                                    diversity * 0.2 + 
-                                    length_score * 0.2 +
-                                    template_sim * 0.15 +
-                                    template_score * 0.15
-                                )
-                                
-                                print(f"    후보: '{response}' (점수: {final_score:.2f}, 한국어: {korean_ratio:.1f}, 다양성: {diversity:.1f})", file=sys.stderr)
-                                
-                                if final_score > best_score and diversity > 0.3:  # 너무 반복적이면 제외
-                                    best_response = response
-                                    best_score = final_score
-                        
-        except Exception as e:
-            continue
+            def choose(step_logits):
+                with span('sampling'):
+                    blocks = step_logits.split(num_prefixes)
+                    return torch.cat([SAMPLERS[method](block) for method, block in zip(SAMPLING_METHODS, blocks)])
+            
+            max_new_tokens = [max(0, MAX_RESPONSE_CHARS - len(p)) for p in flat] * len(SAMPLING_METHODS)
+            if draft_lists is not None:
+                # 추측 디코딩: 행마다 템플릿 나머지를 한 번에 검증해 맞는 데까지 받아들이고 어긋난 행만 이어 생성
+                drafts = [draft for drafts in draft_lists for draft in drafts]
+                cache = cache.select(owners).repeat(len(SAMPLING_METHODS))
+                generated, accepted = model.speculate_batch(
+                    cache, flat * len(SAMPLING_METHODS), drafts * len(SAMPLING_METHODS), pad_idx, eos_idx,
+                    choose, max_new_tokens)
+                if debug_enabled():
+                    debug(f"추측 디코딩: 초안 {sum(len(d) for d in drafts) * len(SAMPLING_METHODS)}토큰 중 "
+                          f"{sum(accepted)}개 채택")
+            else:
+                # 인과 마스크로 학습된 모델: prefix를 왼쪽 패딩해 한 번에 넣고,
+                # 샘플링 방식만큼 캐시를 복제한 뒤 모든 행을 같이 <EOS>까지 생성
+                if len(inputs) > 1:
+                    cache = cache.select(owners)
+                cache, logits = model.prefill(cache, flat, pad_idx)
+                cache = cache.repeat(len(SAMPLING_METHODS))
+                logits = logits.repeat(len(SAMPLING_METHODS), 1)
+                generated = model.generate_batch(cache, logits, eos_idx, choose, torch.tensor(max_new_tokens))
+            rows = [flat[i % num_prefixes] + tokens for i, tokens in enumerate(generated)]
+        else:
+            # 패딩하여 고정 길이로 만든 뒤 디코더 한 번으로 전체 후보 계산
+            tgt_input = torch.tensor(
+                [(p + [pad_idx] * (max_seq_len - len(p)))[:max_seq_len - 1] for p in flat],
+                dtype=torch.long, device=device,
+            )
+            if len(inputs) == 1:
+                output = model.decode(tgt_input, memory.expand(num_prefixes, -1, -1))
+            else:
+                index = torch.tensor(owners, dtype=torch.long, device=device)
+                masks = {} if src_mask is None else {'memory_key_padding_mask': src_mask.index_select(0, index)}
+                output = model.decode(tgt_input, memory.index_select(0, index), **masks)
+            
+            # 여러 방식으로 모든 위치의 토큰을 한 번에 선택
+            with span('sampling'):
+                rows = torch.cat([SAMPLERS[method](output) for method in SAMPLING_METHODS]).tolist()
+    
+    results = []
+    start = 0
+    for prefixes in prefix_lists:
+        results.append([[rows[i * num_prefixes + start + j] for j in range(len(prefixes))]
+                        for i in range(len(SAMPLING_METHODS))])
+        start += len(prefixes)
+    return results
+
+def tokens_to_text(tokens, idx_to_char):
+    """토큰을 문자로 변환 (<PAD>/<EOS> 제외, MAX_RESPONSE_CHARS에서 중단)"""
+    response_chars = []
+    for token_val in tokens:
+        if token_val in idx_to_char:
+            char = idx_to_char[token_val]
+            if char not in ['<PAD>', '<EOS>']:
+                response_chars.append(char)
+        
+        if len(response_chars) >= MAX_RESPONSE_CHARS:
+            break
+    return ''.join(response_chars)
+
+def pick_response(best_templates, prefixes, rows, idx_to_char, similarity=None):
+    """생성된 후보(rows[방식][prefix])를 점수화해 최종 응답 (실패하면 최상위 템플릿 응답)"""
+    candidates = []
+    with span('postprocess'):
+        if rows:
+            for j, (template_response, template_score, _) in enumerate(prefixes):
+                for i in range(len(SAMPLING_METHODS)):
+                    response = tokens_to_text(rows[i][j], idx_to_char)
+                    candidates.append((response, template_response, template_score))
+    with span('scoring'):
+        best_response, best_score = score_candidates(candidates, similarity)
     
-    # 4. 결과 반환
     if best_response and best_score > 0.4:
-        print(f"최적 응답: '{best_response}' (점수: {best_score:.2f})", file=sys.stderr)
+        debug(f"최적 응답: '{best_response}' (점수: {best_score:.2f})")
         return best_response
     else:
         # 백업: 가장 유사한 템플릿 직접 사용
         fallback = best_templates[0][0]['label']
-        print(f"생성 실패, 템플릿 사용: '{fallback}'", file=sys.stderr)
+        debug(f"생성 실패, 템플릿 사용: '{fallback}'")
         return fallback
 
-def predict_with_enhanced_model(message, model_path='reze_optimized_final.pth', dataset_path='./dataset.json'):
+def pick_beam_response(best_templates, beams, idx_to_char):
+    """빔 탐색 후보(beams[prefix] -> [(토큰, 점수)]) 중 정규화 로그 확률이 가장 높은 응답 (2글자 미만 제외)"""
+    best_response, best_score = "", float('-inf')
+    with span('scoring'):
+        for prefix_beams in beams:
+            for tokens, score in prefix_beams:
+                response = tokens_to_text(tokens, idx_to_char).strip()
+                if len(response) >= 2 and score > best_score:
+                    best_response, best_score = response, score
+    
+    if best_response:
+        debug(f"빔 탐색 응답: '{best_response}' (로그 확률: {best_score:.2f})")
+        return best_response
+    fallback = best_templates[0][0]['label']
+    debug(f"생성 실패, 템플릿 사용: '{fallback}'")
+    return fallback
+
+def predict_batch_with_new_model(messages, model, char_to_idx, idx_to_char, max_seq_len, dataset, similarity=None,
+                                 templates=None, speculative=None, decoding=None, beam_width=None):
     """
-    향상된 새 모델로 예측
+    메시지 여러 개를 한 번의 인코더/디코더 배치로 예측 (batch_scheduler.MicroBatcher가 모은 동시 요청)
+    메시지마다 결과는 predict_with_new_model과 같은 방식으로 고름
+    templates: 메시지마다 미리 찾은 템플릿 (plan_candidates 참고)
+    speculative: 템플릿 나머지를 초안으로 쓰는 추측 디코딩 (기본 SPECULATIVE, 인과 모델만)
+    decoding: 'sample' 또는 'beam' (기본 DECODING), beam_width: 빔 수 (기본 BEAM_WIDTH)
     """
-    print(f"향상된 모델 예측 시작: {message}", file=sys.stderr)
+    pad_idx = char_to_idx['<PAD>']
+    eos_idx = char_to_idx['<EOS>']
+    decoding = decoding or DECODING
+    if decoding not in DECODINGS:
+        raise ValueError(f"알 수 없는 생성 방식: {decoding} (가능: {', '.join(DECODINGS)})")
+    templates = templates or [None] * len(messages)
+    inputs = [message_indices(message, model, char_to_idx, max_seq_len) for message in messages]
+    model.eval()
+    
+    if decoding == 'beam' and model.causal:
+        plans = [plan_candidates(message, char_to_idx, max_seq_len, dataset, similarity, message_templates,
+                                 BEAM_PREFIX_RATIOS)
+                 for message, message_templates in zip(messages, templates)]
+        beams = [[] for _ in messages]
+        try:
+            with torch.no_grad():
+                beams = generate_beams(model, inputs, [[p for _, _, p in prefixes] for _, prefixes in plans],
+                                       pad_idx, eos_idx, beam_width or BEAM_WIDTH)
+        except Exception as e:
+            print(f"빔 탐색 오류 ({len(messages)}개 메시지, 템플릿으로 대체): {e}", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            metrics.error('enhanced_generate')
+        return [pick_beam_response(best_templates, message_beams, idx_to_char)
+                for (best_templates, _), message_beams in zip(plans, beams)]
     
-    # 데이터셋 로드
+    speculative = (SPECULATIVE if speculative is None else speculative) and model.causal
+    plans = [plan_candidates(message, char_to_idx, max_seq_len, dataset, similarity, message_templates)
+             for message, message_templates in zip(messages, templates)]
+    rows = [[] for _ in messages]
+    drafts = None
+    if speculative:
+        # 초안: 템플릿 토큰에서 prefix 뒤의 나머지
+        drafts = [[template_tokens(response, char_to_idx)[len(p):] for response, _, p in prefixes] for _, prefixes in plans]
     try:
-        with open(dataset_path, 'r', encoding='utf-8') as f:
-            dataset = json.load(f)
-        print(f"확장된 데이터셋: {len(dataset)}개", file=sys.stderr)
+        with torch.no_grad():
+            rows = generate_rows(model, inputs, [[p for _, _, p in prefixes] for _, prefixes in plans],
+                                 pad_idx, eos_idx, max_seq_len, drafts)
     except Exception as e:
-        return f"데이터 로드 오류: {e}"
+        # 메시지마다 템플릿으로 대체되므로 조용히 넘기지 않고 traceback과 오류 수를 남김
+        print(f"후보 생성 오류 ({len(messages)}개 메시지, 템플릿으로 대체): {e}", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        metrics.error('enhanced_generate')
+    
+    return [pick_response(best_templates, prefixes, message_rows, idx_to_char, similarity)
+            for (best_templates, prefixes), message_rows in zip(plans, rows)]
+
+def predict_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len, dataset, similarity=None,
+                           templates=None, speculative=None, decoding=None, beam_width=None):
+    """
+    새로 학습된 모델로 향상된 예측
+    similarity: 유사도 백엔드 이름 (similarity.py, 기본은 REZE_SIMILARITY 또는 difflib)
+    templates: 미리 찾은 (항목, 점수) 템플릿 목록 (없으면 find_best_templates)
+    speculative: 템플릿 추측 디코딩 (기본 REZE_SPECULATIVE)
+    decoding / beam_width: 'sample'(36개 후보) 또는 'beam' (기본 REZE_DECODING, REZE_BEAM_WIDTH)
+    """
+    return predict_batch_with_new_model([message], model, char_to_idx, idx_to_char, max_seq_len, dataset, similarity,
+                                        None if templates is None else [templates], speculative,
+                                        decoding, beam_width)[0]
+
+def stream_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len, dataset, similarity=None):
+    """
+    응답을 (조각, 출처) 단위로 yield하는 스트리밍 예측 (출처: 'prefix'는 템플릿 원문, 'model'은 디코딩한 토큰)
+    최상위 템플릿의 앞부분(STREAM_PREFIX_RATIO)을 먼저 내보내고, 이어지는 토큰을 KV 캐시로 한 개씩 생성하며 바로 내보냄
+    predict_with_new_model(/chat/enhanced)과 응답이 다르다: 그쪽은 템플릿 3개 x prefix 비율 4개 x 샘플링 3개 = 36개 후보를
+    모두 만든 뒤 score_candidates로 고르므로 마지막 후보가 나올 때까지 첫 글자를 낼 수 없다. 여기서는 템플릿 1개,
+    prefix 비율 1개, STREAM_SAMPLING 한 행만 생성하고 후보 비교는 없다.
+    증분 디코딩이 없는 모델(인과 마스크 없이 학습)은 predict_with_new_model 결과를 한 번에 내보낸다.
+    """
+    if not model.causal:
+        yield predict_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len, dataset, similarity), 'model'
+        return
+    
+    with span('index_lookup'):
+        best_templates = find_best_templates(message, dataset, k=1, similarity=similarity)
+    template_response = (best_templates[0][0] if best_templates else dataset[0])['label']
+    
+    pad_idx = char_to_idx['<PAD>']
+    eos_idx = char_to_idx['<EOS>']
+    template_indices = [char_to_idx.get(char, pad_idx) for char in template_response] + [eos_idx]
+    prefix_len = min(max(1, int(len(template_indices) * STREAM_PREFIX_RATIO)), max_seq_len - 1)
+    prefix = template_indices[:prefix_len]
+    
+    # prefix는 템플릿 원문이므로 모델 계산 전에 바로 내보냄 (ttft_prefix_ms)
+    emitted = template_response[:prefix_len][:MAX_RESPONSE_CHARS]
+    if emitted:
+        yield emitted, 'prefix'
+    
+    model.eval()
+    sampler = SAMPLERS[STREAM_SAMPLING]
+    
+    def choose(step_logits):
+        with span('sampling'):
+            return sampler(step_logits)
+    
+    with torch.no_grad():
+        with span('model_forward'):
+            cache = model.init_cache(model.encode(encode_message(message, model, char_to_idx, max_seq_len)))
+        tokens = model.stream(cache, prefix, eos_idx, choose, max(0, MAX_RESPONSE_CHARS - len(prefix)))
+        count = len(emitted)
+        while count < MAX_RESPONSE_CHARS:
+            with span('model_forward'):
+                token = next(tokens, None)
+            if token is None:
+                break
+            char = idx_to_char.get(token)
+            if char is None or char in ('<PAD>', '<EOS>'):
+                continue
+            count += 1
+            yield char, 'model'
+
+def stream_events(chunks, start=None):
+    """
+    (조각, 출처) 이터레이터 -> 스트리밍 이벤트 dict
+      {"type": "token", "text": 조각, "source": "prefix"|"model", "t_ms": 시작부터 경과}
+      {"type": "done", "response": 전체 응답,
+       "timing": {ttft_ms, ttft_prefix_ms, itl_ms_mean, itl_ms_p95, tokens, total_ms}}
+    ttft_ms는 모델이 디코딩한 첫 토큰까지, ttft_prefix_ms는 템플릿 prefix 조각까지 (없으면 None)
+    itl(inter-token latency)은 모델이 디코딩한 토큰 사이 간격
+    """
+    start = time.perf_counter() if start is None else start
+    parts, stamps = [], []
+    first_prefix = None
+    for text, source in chunks:
+        now = time.perf_counter()
+        parts.append(text)
+        if source == 'model':
+            stamps.append(now)
+        elif first_prefix is None:
+            first_prefix = now
+        yield {"type": "token", "text": text, "source": source, "t_ms": round((now - start) * 1000, 3)}
+    total = time.perf_counter() - start
+    gaps = sorted((b - a) * 1000 for a, b in zip(stamps, stamps[1:]))
+    yield {
+        "type": "done",
+        "response": ''.join(parts),
+        "timing": {
+            "ttft_ms": round((stamps[0] - start) * 1000, 3) if stamps else None,
+            "ttft_prefix_ms": round((first_prefix - start) * 1000, 3) if first_prefix is not None else None,
+            "itl_ms_mean": round(sum(gaps) / len(gaps), 3) if gaps else None,
+            "itl_ms_p95": round(gaps[min(len(gaps) - 1, int(len(gaps) * 0.95))], 3) if gaps else None,
+            "tokens": len(parts),
+            "total_ms": round(total * 1000, 3),
+        },
+    }
+
+def load_dataset(dataset_path='./dataset.json'):
+    """데이터셋 로드 (컴파일된 바이너리를 mmap, JSON이 바뀌면 자동 재컴파일)"""
+    dataset = load_dataset_fast(dataset_path)
+    print(f"확장된 데이터셋: {len(dataset)}개", file=sys.stderr)
+    return dataset
+
+def default_model_path():
+    """
+    내보낸 추론 파일(export_model.py)이 체크포인트보다 새것이고 내보낼 때 eager 모델과의 동등성 검사를
+    통과했으면 그쪽, 아니면 체크포인트
+    """
+    try:
+        exported = os.path.getmtime(DEFAULT_EXPORT)
+    except OSError:
+        return DEFAULT_CHECKPOINT
+    if not passed_parity(DEFAULT_EXPORT):
+        print(f"{DEFAULT_EXPORT}가 동등성 검사 기록이 없거나 통과하지 못해 {DEFAULT_CHECKPOINT} 사용", file=sys.stderr)
+        return DEFAULT_CHECKPOINT
+    try:
+        return DEFAULT_EXPORT if exported >= os.path.getmtime(DEFAULT_CHECKPOINT) else DEFAULT_CHECKPOINT
+    except OSError:
+        return DEFAULT_EXPORT
+
+def load_exported_model(model_path=DEFAULT_EXPORT):
+    """
+    INT8 TorchScript 추론 파일 로드 (옵티마이저 상태 없음, 가중치 전체 unpickle 없음)
+    반환: (model, char_to_idx, idx_to_char, max_seq_len) - load_enhanced_model과 같은 형태
+    """
+    model, config = load_exported(model_path)
+    char_to_idx = config['char_to_idx']
+    idx_to_char = dict(enumerate(config['idx_to_char']))
+    
+    print(f"추론 모델 로드 완료 (Vocab: {config['vocab_size']}, {'INT8' if config['quantized'] else 'fp32'} TorchScript)", file=sys.stderr)
+    
+    return model, char_to_idx, idx_to_char, config['max_seq_len']
+
+def load_enhanced_model(model_path=DEFAULT_CHECKPOINT):
+    """
+    체크포인트에서 모델과 어휘 사전 로드 (.pt면 내보낸 추론 파일)
+    반환: (model, char_to_idx, idx_to_char, max_seq_len)
+    """
+    if model_path.endswith('.pt'):
+        return load_exported_model(model_path)
     
-    # 새 모델 로드
     try:
+        # 텐서를 통째로 읽지 않고 mmap (가중치/기본 타입만 허용해 전체 unpickle도 피함)
+        checkpoint = torch.load(model_path, map_location=torch.device('cpu'), mmap=True, weights_only=True)
+    except Exception:
+        # 예전 형식(zip 아님) 체크포인트
         checkpoint = torch.load(model_path, map_location=torch.device('cpu'))
+    
+    vocab_size = checkpoint['vocab_size']
+    embed_dim = checkpoint['embed_dim']
+    num_heads = checkpoint['num_heads']
+    num_layers = checkpoint['num_layers']
+    max_seq_len = checkpoint['max_seq_len']
+    char_to_idx = checkpoint['char_to_idx']
+    idx_to_char = checkpoint['idx_to_char']
+    
+    model = TransformerModel(vocab_size, embed_dim, num_heads, num_layers, max_seq_len,
+                             tie_embeddings=checkpoint.get('tie_embeddings', False))
+    model.load_state_dict(checkpoint['model_state_dict'])
+    model.eval()
+    # 인과 마스크로 학습된 체크포인트만 KV 캐시 증분 디코딩 사용
+    model.causal = bool(checkpoint.get('causal', False))
+    # 패딩 마스크로 학습된 체크포인트는 소스를 패딩 없이 인코딩
+    model.padding_mask = bool(checkpoint.get('padding_mask', False))
+    
+    print(f"새 모델 로드 완료 (Vocab: {vocab_size}, Loss: {checkpoint.get('loss', 'N/A'):.4f})", file=sys.stderr)
+    
+    return model, char_to_idx, idx_to_char, max_seq_len
+
+def predict_with_enhanced_model(message, model_path=None, dataset_path='./dataset.json',
+                                dataset=None, loaded_model=None):
+    """
+    향상된 새 모델로 예측
+    dataset / loaded_model을 넘기면 다시 로드하지 않음 (워커 모드)
+    model_path가 없으면 default_model_path() (내보낸 INT8 파일 우선)
+    """
+    with request('enhanced'):
+        debug(f"향상된 모델 예측 시작: {message}")
         
-        vocab_size = checkpoint['vocab_size']
-        embed_dim = checkpoint['embed_dim']
-        num_heads = checkpoint['num_heads']
-        num_layers = checkpoint['num_layers']
-        max_seq_len = checkpoint['max_seq_len']
-        char_to_idx = checkpoint['char_to_idx']
-        idx_to_char = checkpoint['idx_to_char']
+        # 데이터셋 로드
+        if dataset is None:
+            try:
+                with span('load'):
+                    dataset = load_dataset(dataset_path)
+            except Exception as e:
+                return f"데이터 로드 오류: {e}"
         
-        model = TransformerModel(vocab_size, embed_dim, num_heads, num_layers, max_seq_len)
-        model.load_state_dict(checkpoint['model_state_dict'])
+        # 새 모델 로드
+        if loaded_model is None:
+            try:
+                with span('load'):
+                    loaded_model = load_enhanced_model(model_path or default_model_path())
+            except Exception as e:
+                return f"모델 로드 오류: {e}"
         
-        print(f"새 모델 로드 완료 (Vocab: {vocab_size}, Loss: {checkpoint.get('loss', 'N/A'):.4f})", file=sys.stderr)
+        model, char_to_idx, idx_to_char, max_seq_len = loaded_model
         
-    except Exception as e:
-        return f"모델 로드 오류: {e}"
+        # 향상된 예측 수행
+        return predict_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len, dataset)
+
+def stream_enhanced_model(message, model_path=None, dataset_path='./dataset.json', dataset=None, loaded_model=None):
+    """
+    predict_with_enhanced_model의 스트리밍 버전: stream_events 이벤트 dict를 yield
+    ttft는 이 함수 호출(로드 포함)부터 잼
+    """
+    start = time.perf_counter()
+    with request('enhanced_stream'):
+        if dataset is None:
+            with span('load'):
+                dataset = load_dataset(dataset_path)
+        if loaded_model is None:
+            with span('load'):
+                loaded_model = load_enhanced_model(model_path or default_model_path())
+        
+        model, char_to_idx, idx_to_char, max_seq_len = loaded_model
+        yield from stream_events(stream_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len, dataset),
+                                 start)
+
+def run_worker_mode(argv, model_path=None, dataset_path='./dataset.json'):
+    """
+    상주 워커 모드: 데이터셋과 모델을 한 번만 로드하고 NDJSON 요청을 계속 처리
+    사용법: python3 predict_enhanced.py --worker [--socket /tmp/reze_enhanced.sock]
+    {"message": ..., "stream": true}면 문자 조각마다 chunk 줄을 보냄 (prediction_worker 참고)
+    동시에 들어온 요청은 MicroBatcher가 모아 한 배치로 모델에 넣음 (--max-batch, --max-wait-ms)
+    {"op": "stats"}: 배치 통계
+    """
+    args = parse_worker_args(argv)
+    dataset = load_dataset(dataset_path)
+    loaded_model = load_enhanced_model(model_path or default_model_path())
+    model, char_to_idx, idx_to_char, max_seq_len = loaded_model
     
-    # 향상된 예측 수행
-    response = predict_with_new_model(message, model, char_to_idx, idx_to_char, max_seq_len, dataset)
+    def run_batch(messages):
+        # 스케줄러 스레드에서 배치 하나를 요청 하나로 측정
+        with request('enhanced_batch'):
+            return predict_batch_with_new_model(messages, model, char_to_idx, idx_to_char, max_seq_len, dataset)
     
-    return response
+    batcher = None
+    if args.max_batch > 1:
+        batcher = MicroBatcher(run_batch, args.max_batch, args.max_wait_ms)
+    
+    def handle_request(request):
+        if request.get('op') == 'stats':
+            return batcher.stats() if batcher is not None else {'max_batch_size': 1}
+        if request.get('stream'):
+            return stream_enhanced_model(request['message'], dataset=dataset, loaded_model=loaded_model)
+        if batcher is not None:
+            return batcher.submit(request['message'])
+        return predict_with_enhanced_model(request['message'], dataset=dataset, loaded_model=loaded_model)
+    
+    # 배치 하나가 도는 동안 다음 배치가 찰 수 있게 요청 스레드는 max_batch의 두 배
+    # (--max-queue 상한은 run_worker가 요청을 받을 때 모든 연결을 합쳐 한 번만 검사)
+    run_worker(handle_request, argv, min_threads=2 * args.max_batch if batcher is not None else 1)
 
 if __name__ == "__main__":
+    if is_worker_mode(sys.argv[1:]):
+        run_worker_mode(sys.argv[1:])
+        sys.exit(0)
+    
     try:
-        print("predict_enhanced.py 시작", file=sys.stderr)
+        debug("predict_enhanced.py 시작")
         args = json.loads(sys.argv[1])
         message = args['message']
         
+        if args.get('stream'):
+            # NDJSON: 조각마다 {"type": "token", ...}, 마지막에 {"type": "done", ...}
+            for event in stream_enhanced_model(message):
+                print(json.dumps(event, ensure_ascii=False), flush=True)
+            sys.exit(0)
+        
         response = predict_with_enhanced_model(message)
         
-        print(f"최종 응답: '{response}'", file=sys.stderr)
+        debug(f"최종 응답: '{response}'")
         print(json.dumps({"status": "success", "response": response}, ensure_ascii=False))
     
     except Exception as e:
         print(f"에러: {str(e)}", file=sys.stderr)
-        import traceback
         traceback.print_exc(file=sys.stderr)
         print(json.dumps({"status": "error", "message": str(e)}, ensure_ascii=False))
         sys.exit(1)
\ No newline at end of file
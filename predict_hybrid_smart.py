@@ -1,66 +1,105 @@
 import json
+import os
 import sys
-from difflib import SequenceMatcher
 import random
 import re
 
-def find_best_match_response(message, dataset):
+from batch_scorer import get_batch_scorer
+from compiled_dataset import load_dataset_fast
+from instrumentation import debug, debug_enabled, request, span
+from match_index import get_match_index
+from prediction_worker import is_worker_mode, run_worker
+from response_cache import ResponseCache, normalize_message
+
+# 데이터셋 경로별 후보 순위 캐시
+_response_caches = {}
+
+def find_best_match_response(message, dataset, top_k=None, where=None):
     """
     고도화된 유사도 매칭으로 최적 응답 찾기
+    top_k를 주면 역색인으로 후보를 추려 상위 k개만 반환 (순서는 전체 스캔과 동일)
+    where: 데이터셋 항목 필터 (top_k와 함께 사용)
     """
-    message_lower = message.lower().strip()
-    candidates = []
+    index = get_match_index(dataset)
     
-    for item in dataset:
-        input_lower = item['input'].lower().strip()
-        
-        # 1. 직접 유사도
-        similarity = SequenceMatcher(None, message_lower, input_lower).ratio()
-        
-        # 2. 키워드 매칭
-        message_words = set(message_lower.split())
-        input_words = set(input_lower.split())
-        common_words = message_words & input_words
-        keyword_score = len(common_words) / max(len(message_words), 1) if message_words else 0
-        
-        # 3. 길이 유사성
-        length_diff = abs(len(message) - len(item['input']))
-        length_score = max(0, 1 - length_diff / 20)  # 20자 차이까지 허용
-        
-        # 4. 특별 패턴 매칭
-        special_score = 0
-        if any(word in input_lower for word in ['안녕', 'hi', 'hello']) and any(word in message_lower for word in ['안녕', 'hi', 'hello']):
-            special_score += 0.3
-        if any(word in input_lower for word in ['뭐', '뭔']) and any(word in message_lower for word in ['뭐', '뭔']):
-            special_score += 0.3
-        if '?' in input_lower and '?' in message_lower:
-            special_score += 0.2
-            
-        # 5. 종합 점수
-        total_score = (similarity * 0.4 + 
-                      keyword_score * 0.3 + 
-                      length_score * 0.1 + 
-                      special_score * 0.2)
-        
-        candidates.append({
-            'item': item,
-            'score': total_score,
-            'similarity': similarity,
-            'keyword_score': keyword_score
-        })
-    
-    # 점수순 정렬
-    candidates.sort(key=lambda x: x['score'], reverse=True)
-    return candidates
+    if top_k is None:
+        # 전체 항목 점수순 정렬
+        return index.rank_all(message)
+    
+    return index.top_k(message, top_k, where)
+
+def find_best_match_batch(messages, dataset, top_k=5):
+    """
+    여러 메시지의 상위 후보를 한 번에 계산 (NumPy 행렬 연산)
+    numpy가 없으면 한 건씩 find_best_match_response로 처리
+    """
+    scorer = get_batch_scorer(dataset)
+    
+    if scorer is None:
+        return [find_best_match_response(message, dataset, top_k=top_k) for message in messages]
+    
+    return scorer.top_k_batch(messages, top_k)
 
-def generate_smart_response(message, dataset):
+def get_response_cache(dataset_path='./dataset.json'):
+    """
+    데이터셋 경로별 순위 캐시 (dataset.json이 바뀌면 자동으로 비워짐)
+    크기/TTL은 REZE_CACHE_SIZE, REZE_CACHE_TTL(초) 환경변수로 조정
+    """
+    if dataset_path not in _response_caches:
+        _response_caches[dataset_path] = ResponseCache(
+            max_size=int(os.environ.get('REZE_CACHE_SIZE', 1024)),
+            ttl=float(os.environ.get('REZE_CACHE_TTL', 600)),
+            watch_path=dataset_path
+        )
+    return _response_caches[dataset_path]
+
+def rank_length_matched(message, dataset):
+    """길이가 비슷한 응답 중 점수순 상위 3개 (낮은 유사도일 때 사용)"""
+    target_length = len(message)
+    return find_best_match_response(
+        message, dataset, top_k=3,
+        where=lambda item: abs(target_length - len(item['label'])) <= 5
+    )
+
+def rank_candidates(message, dataset, cache=None, candidates=None):
+    """
+    정규화된 메시지로 후보 순위 계산 (캐시 사용)
+    반환: (상위 5개 후보, 길이 비슷한 상위 3개 또는 None)
+    최종 응답이 아니라 순위를 저장하므로 상위 3개 랜덤 선택은 매번 달라진다
+    candidates: 배치로 미리 계산한 상위 후보 (캐시 조회 없이 저장만 함)
+    """
+    key = normalize_message(message)
+    
+    if cache is not None and candidates is None:
+        cache.bind(dataset)
+        ranking = cache.get(key)
+        if ranking is not None:
+            return ranking
+    
+    if candidates is None:
+        candidates = find_best_match_response(key, dataset, top_k=5)
+    
+    # 낮은 유사도면 길이 기반 후보도 함께 저장
+    length_matched = None
+    if candidates and candidates[0]['score'] <= 0.3:
+        length_matched = rank_length_matched(key, dataset)
+    
+    ranking = (candidates, length_matched)
+    if cache is not None:
+        cache.put(key, ranking)
+    return ranking
+
+def generate_smart_response(message, dataset, candidates=None, length_matched=None):
     """
     스마트한 응답 생성: 유사도 매칭 + 약간의 변형
+    candidates / length_matched: 미리 계산한 후보 순위 (캐시, 배치 처리 시)
     """
-    print(f"스마트 응답 생성: {message}", file=sys.stderr)
+    debug(f"스마트 응답 생성: {message}")
     
-    # 최적 매칭 찾기
-    candidates = find_best_match_response(message, dataset)
+    # 최적 매칭 찾기 (상위 5개만 필요)
+    if candidates is None:
+        with span('index_lookup'):
+            candidates = find_best_match_response(message, dataset, top_k=5)
     
     if not candidates:
         return random.choice([
@@ -72,10 +111,11 @@ def generate_smart_response(message, dataset):
     # 상위 후보들 분석
     top_candidates = candidates[:5]
     
-    print(f"상위 후보들:", file=sys.stderr)
-    for i, cand in enumerate(top_candidates[:3]):
-        item = cand['item']
-        print(f"  {i+1}. '{item['input']}' → '{item['label']}' (점수: {cand['score']:.2f})", file=sys.stderr)
+    if debug_enabled():
+        debug(f"상위 후보들:")
+        for i, cand in enumerate(top_candidates[:3]):
+            item = cand['item']
+            debug(f"  {i+1}. '{item['input']}' → '{item['label']}' (점수: {cand['score']:.2f})")
     
     # 최고 점수 응답 선택
     best_candidate = top_candidates[0]
@@ -83,31 +123,28 @@ def generate_smart_response(message, dataset):
     if best_candidate['score'] > 0.5:
         # 높은 유사도: 그대로 사용
         response = best_candidate['item']['label']
-        print(f"고유사도 매칭: '{response}'", file=sys.stderr)
+        debug(f"고유사도 매칭: '{response}'")
         return response
         
     elif best_candidate['score'] > 0.3:
         # 중간 유사도: 상위 3개 중 랜덤 선택으로 다양성 추가
         selected = random.choice(top_candidates[:3])
         response = selected['item']['label']
-        print(f"다양성 선택: '{response}' (점수: {selected['score']:.2f})", file=sys.stderr)
+        debug(f"다양성 선택: '{response}' (점수: {selected['score']:.2f})")
         return response
         
     else:
         # 낮은 유사도: 길이나 패턴 기반 선택
-        suitable_responses = []
-        
-        # 길이가 비슷한 응답 찾기
-        target_length = len(message)
-        for cand in candidates:
-            response_length = len(cand['item']['label'])
-            if abs(target_length - response_length) <= 5:
-                suitable_responses.append(cand)
+        # 길이가 비슷한 응답 찾기 (점수순 상위 3개)
+        suitable_responses = length_matched
+        if suitable_responses is None:
+            with span('index_lookup'):
+                suitable_responses = rank_length_matched(message, dataset)
         
         if suitable_responses:
             selected = random.choice(suitable_responses[:3])
             response = selected['item']['label']
-            print(f"길이 기반 선택: '{response}'", file=sys.stderr)
+            debug(f"길이 기반 선택: '{response}'")
             return response
         else:
             # 최후의 수단: 일반적인 좋은 응답들
@@ -119,41 +156,120 @@ def generate_smart_response(message, dataset):
                 "흠... 그렇구나."
             ]
             response = random.choice(good_responses)
-            print(f"백업 응답: '{response}'", file=sys.stderr)
+            debug(f"백업 응답: '{response}'")
             return response
 
-def predict_hybrid_smart(message, dataset_path='./dataset.json'):
+def load_dataset(dataset_path='./dataset.json'):
+    """데이터셋 로드 (컴파일된 바이너리를 mmap, JSON이 바뀌면 자동 재컴파일)"""
+    dataset = load_dataset_fast(dataset_path)
+    print(f"데이터셋 로드: {len(dataset)}개", file=sys.stderr)
+    return dataset
+
+def predict_hybrid_smart(message, dataset_path='./dataset.json', dataset=None):
     """
     하이브리드 스마트 예측: 실용적이고 자연스러운 응답
+    dataset을 넘기면 파일을 다시 읽지 않음 (워커 모드)
     """
-    print(f"하이브리드 스마트 예측: {message}", file=sys.stderr)
-    
-    # 데이터셋 로드
-    try:
-        with open(dataset_path, 'r', encoding='utf-8') as f:
-            dataset = json.load(f)
-        print(f"데이터셋 로드: {len(dataset)}개", file=sys.stderr)
-    except Exception as e:
-        return f"데이터 로드 오류: {e}"
-    
-    # 스마트 응답 생성
-    response = generate_smart_response(message, dataset)
-    
-    # 후처리: 불필요한 공백이나 반복 제거
+    with request('hybrid_smart'):
+        debug(f"하이브리드 스마트 예측: {message}")
+        
+        # 데이터셋 로드
+        if dataset is None:
+            try:
+                with span('load'):
+                    dataset = load_dataset(dataset_path)
+            except Exception as e:
+                return f"데이터 로드 오류: {e}"
+        
+        # 후보 순위 (캐시) → 스마트 응답 생성
+        with span('index_lookup'):
+            candidates, length_matched = rank_candidates(message, dataset, get_response_cache(dataset_path))
+        with span('sampling'):
+            response = generate_smart_response(message, dataset, candidates, length_matched)
+        
+        with span('postprocess'):
+            return postprocess_response(response)
+
+def predict_hybrid_smart_batch(messages, dataset_path='./dataset.json', dataset=None):
+    """
+    여러 메시지를 한 번에 예측 (동시 요청 마이크로 배치용)
+    후보 점수는 배치 행렬 연산으로, 응답 선택은 메시지별로 수행
+    """
+    with request('hybrid_smart_batch'):
+        debug(f"하이브리드 스마트 배치 예측: {len(messages)}개")
+        
+        if dataset is None:
+            with span('load'):
+                dataset = load_dataset(dataset_path)
+        
+        # 캐시에 없는 메시지만 배치로 계산
+        with span('index_lookup'):
+            cache = get_response_cache(dataset_path)
+            cache.bind(dataset)
+            keys = [normalize_message(message) for message in messages]
+            rankings = [cache.get(key) for key in keys]
+            misses = sorted({key for key, ranking in zip(keys, rankings) if ranking is None})
+            
+            computed = {}
+            if misses:
+                for key, candidates in zip(misses, find_best_match_batch(misses, dataset, top_k=5)):
+                    computed[key] = rank_candidates(key, dataset, cache, candidates)
+        
+        responses = []
+        for message, key, ranking in zip(messages, keys, rankings):
+            candidates, length_matched = ranking if ranking is not None else computed[key]
+            with span('sampling'):
+                response = generate_smart_response(message, dataset, candidates, length_matched)
+            with span('postprocess'):
+                responses.append(postprocess_response(response))
+        return responses
+
+def postprocess_response(response):
+    """후처리: 불필요한 공백이나 반복 제거"""
     response = re.sub(r'\s+', ' ', response).strip()  # 다중 공백 제거
     response = re.sub(r'(.)\1{3,}', r'\1\1', response)  # 3회 이상 반복 → 2회로
-    
     return response
 
+def run_worker_mode(argv, dataset_path='./dataset.json'):
+    """
+    상주 워커 모드: 데이터셋을 한 번만 로드하고 NDJSON 요청을 계속 처리
+    사용법: python3 predict_hybrid_smart.py --worker [--socket /tmp/reze.sock]
+    """
+    cache = get_response_cache(dataset_path)
+    state = {'dataset': load_dataset(dataset_path), 'generation': cache.generation}
+    
+    def current_dataset():
+        # dataset.json 내용이 바뀌면 캐시가 비워지고 데이터셋도 다시 로드
+        cache.check_source()
+        if cache.generation != state['generation']:
+            state['dataset'] = load_dataset(dataset_path)
+            state['generation'] = cache.generation
+        return state['dataset']
+    
+    def handle_request(request):
+        # {"op": "stats"}: 캐시 통계
+        if request.get('op') == 'stats':
+            return cache.stats()
+        # {"messages": [...]} 형태면 배치로 한 번에 처리
+        if 'messages' in request:
+            return predict_hybrid_smart_batch(request['messages'], dataset_path, current_dataset())
+        return predict_hybrid_smart(request['message'], dataset_path, current_dataset())
+    
+    run_worker(handle_request, argv)
+
 if __name__ == "__main__":
+    if is_worker_mode(sys.argv[1:]):
+        run_worker_mode(sys.argv[1:])
+        sys.exit(0)
+    
     try:
-        print("predict_hybrid_smart.py 시작", file=sys.stderr)
+        debug("predict_hybrid_smart.py 시작")
         args = json.loads(sys.argv[1])
         message = args['message']
         
         response = predict_hybrid_smart(message)
         
-        print(f"최종 응답: '{response}'", file=sys.stderr)
+        debug(f"최종 응답: '{response}'")
         print(json.dumps({"status": "success", "response": response}, ensure_ascii=False))
     
     except Exception as e:
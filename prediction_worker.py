@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# prediction_worker.py - 상주형 예측 워커
+# 데이터셋과 모델을 한 번만 로드해두고, 줄 단위 JSON(NDJSON) 요청을
+# stdin 또는 Unix 소켓으로 받아 응답을 스트리밍으로 돌려준다.
+#
+# 요청:  {"id": "abc", "message": "안녕"}
+# 응답:  {"id": "abc", "status": "success", "response": "..."}
+# 오류:  {"id": "abc", "status": "error", "message": "..."}
+#
+# 요청마다 id가 붙어 있으므로 여러 메시지를 동시에 보내도 되고,
+# 응답은 처리가 끝난 순서대로 나간다.
+#
+# 스트리밍: handle_request가 이벤트 dict 제너레이터를 돌려주면 (predict_enhanced의 "stream": true)
+#   조각마다 {"id": "abc", "status": "chunk", "text": "...", "t_ms": ...}
+#   끝에     {"id": "abc", "status": "success", "response": "전체 응답", "timing": {...}}
+#
+# 백프레셔: 처리 중이거나 스레드를 기다리는 요청이 (모든 연결을 합쳐) --max-queue개면 새 요청은 바로
+#   {"id": "abc", "status": "error", "message": "...", "retryable": true} (잠시 후 재시도)
+#
+# 취소: {"op": "cancel", "target": "abc"} - 같은 연결에서 받은 요청 abc가 스트리밍 중이면 다음 조각 전에 멈추고
+#   {"id": "abc", "status": "cancelled"}로 끝냄, 아직 스레드를 기다리는 중이면 처리하지 않음 (클라이언트가 끊겼을 때)
+#
+# 관리 요청: {"op": "ping"}, {"op": "metrics"} (Prometheus 텍스트), {"op": "metrics_json"}
+# (단계별 시간 측정은 instrumentation.py, REZE_TRACE_SAMPLE로 켬)
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import traceback
+import types
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import instrumentation
+from batch_scheduler import QueueFull
+
+
+def parse_worker_args(argv):
+    """워커 모드 명령줄 인자 파싱"""
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument('--worker', action='store_true')
+    parser.add_argument('--socket', default=None, help='Unix 소켓 경로 (없으면 stdin/stdout 사용)')
+    parser.add_argument('--threads', type=int, default=4, help='동시에 처리할 요청 수')
+    # 마이크로 배치 (batch_scheduler.py, 지원하는 워커만 사용)
+    parser.add_argument('--max-batch', type=int, default=8, help='한 번에 모델에 넣을 최대 요청 수 (1이면 배치 없음)')
+    parser.add_argument('--max-wait-ms', type=float, default=5.0, help='배치를 모으려고 기다리는 최대 시간')
+    parser.add_argument('--max-queue', type=int, default=64, help='처리를 기다리는 요청 수 상한 (넘으면 재시도 오류)')
+    args, _ = parser.parse_known_args(argv)
+    return args
+
+
+def is_worker_mode(argv):
+    """`--worker` 플래그가 있으면 워커 모드"""
+    return '--worker' in argv
+
+
+def handle_line(line, handle_request, cancelled=None):
+    """
+    요청 한 줄을 처리해서 응답 dict 반환 (스트리밍이면 응답 dict 제너레이터)
+    cancelled: 취소되면 설정되는 threading.Event (스트리밍은 조각 사이마다 확인)
+    """
+    request_id = None
+    try:
+        request = json.loads(line)
+        request_id = request.get('id')
+        if cancelled is not None and cancelled.is_set():
+            return {"id": request_id, "status": "cancelled"}
+
+        if request.get('op') == 'ping':
+            return {"id": request_id, "status": "success", "response": "pong"}
+        if request.get('op') == 'metrics':
+            return {"id": request_id, "status": "success", "response": instrumentation.metrics.prometheus()}
+        if request.get('op') == 'metrics_json':
+            return {"id": request_id, "status": "success", "response": instrumentation.metrics.snapshot()}
+
+        response = handle_request(request)
+        if isinstance(response, types.GeneratorType):
+            return _stream_results(request_id, response, cancelled)
+        return {"id": request_id, "status": "success", "response": response}
+
+    except Exception as e:
+        return _error_result(request_id, e)
+
+
+def _error_result(request_id, error):
+    result = {"id": request_id, "status": "error", "message": str(error)}
+    if getattr(error, 'retryable', False):
+        # 과부하 등 잠시 후 다시 보내면 되는 오류 (batch_scheduler.QueueFull)
+        result["retryable"] = True
+        return result
+    print(f"워커 요청 에러 ({request_id}): {str(error)}", file=sys.stderr)
+    traceback.print_exc(file=sys.stderr)
+    return result
+
+
+def _stream_results(request_id, events, cancelled=None):
+    """
+    스트리밍 이벤트 -> 응답 줄 dict (token은 chunk, done은 success, 도중 예외는 error로 끝남)
+    cancelled가 설정되면 다음 이벤트를 만들지 않고 제너레이터를 닫은 뒤 cancelled로 끝남
+    """
+    try:
+        for event in events:
+            event = dict(event)
+            kind = event.pop('type')
+            yield {"id": request_id, "status": "chunk" if kind == 'token' else "success", **event}
+            if cancelled is not None and cancelled.is_set():
+                events.close()
+                yield {"id": request_id, "status": "cancelled"}
+                return
+    except Exception as e:
+        yield _error_result(request_id, e)
+
+
+def _request_fields(line):
+    """요청 줄 -> (id, 취소할 요청 id) (cancel 요청이 아니면 취소 대상은 None)"""
+    try:
+        request = json.loads(line)
+        return request.get('id'), request.get('target') if request.get('op') == 'cancel' else None
+    except (ValueError, AttributeError):
+        return None, None
+
+
+class AdmissionLimit:
+    """처리 중 + 스레드를 기다리는 요청 수 상한 (워커의 모든 연결이 하나를 같이 씀)"""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = threading.BoundedSemaphore(limit)
+
+    def try_acquire(self):
+        return self._slots.acquire(blocking=False)
+
+    def release(self):
+        self._slots.release()
+
+
+def _serve_stream(read_lines, write_line, handle_request, pool, admission=None):
+    """
+    입력 스트림에서 요청을 읽어 공유 스레드 풀로 처리하고 응답을 한 줄씩 쓴다
+    admission: AdmissionLimit (꽉 차면 스레드 풀에 넣지 않고 바로 재시도 오류)
+    입력이 끝나면 이 스트림에서 받은 요청이 모두 끝날 때까지 기다렸다가 돌아감
+    {"op": "cancel"}은 스레드 풀을 거치지 않고 읽는 즉시 처리 (이 스트림에서 받은 요청만 취소)
+    """
+    write_lock = threading.Lock()
+    in_flight = set()
+    cancels = {}  # 처리 중이거나 스레드를 기다리는 요청 id -> 취소 Event
+    cancels_lock = threading.Lock()
+
+    def write(item):
+        payload = json.dumps(item, ensure_ascii=False)
+        with write_lock:
+            write_line(payload)
+
+    def process(line, request_id, cancelled):
+        try:
+            result = handle_line(line, handle_request, cancelled)
+            for item in (result,) if isinstance(result, dict) else result:
+                write(item)
+        finally:
+            with cancels_lock:
+                if cancels.get(request_id) is cancelled:
+                    del cancels[request_id]
+            if admission is not None:
+                admission.release()
+
+    for line in read_lines():
+        line = line.strip()
+        if not line:
+            continue
+        request_id, target = _request_fields(line)
+        if target is not None:
+            with cancels_lock:
+                cancelled = cancels.get(target)
+            if cancelled is not None:
+                cancelled.set()
+            write({"id": request_id, "status": "success", "response": cancelled is not None})
+            continue
+        if admission is not None and not admission.try_acquire():
+            write(_error_result(request_id, QueueFull(f"처리 대기 요청이 가득 참 ({admission.limit}개)")))
+            continue
+        cancelled = threading.Event()
+        if request_id is not None:
+            with cancels_lock:
+                cancels[request_id] = cancelled
+        future = pool.submit(process, line, request_id, cancelled)
+        in_flight.add(future)
+        future.add_done_callback(in_flight.discard)
+    wait(list(in_flight))
+
+
+def serve_stdio(handle_request, pool, admission=None):
+    """stdin/stdout 기반 워커 루프 (EOF가 오면 처리 중인 요청을 마치고 종료)"""
+    def read_lines():
+        for line in sys.stdin:
+            yield line
+
+    def write_line(payload):
+        sys.stdout.write(payload + '\n')
+        sys.stdout.flush()
+
+    print(f"워커 준비 완료 (stdio, max_queue={admission.limit if admission else None})", file=sys.stderr)
+    _serve_stream(read_lines, write_line, handle_request, pool, admission)
+
+
+def serve_unix_socket(path, handle_request, pool, admission=None):
+    """Unix 소켓 기반 워커 루프 (연결마다 읽기 스레드, 처리는 모든 연결이 pool과 admission을 같이 씀)"""
+    if os.path.exists(path):
+        os.unlink(path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    print(f"워커 준비 완료 (socket={path}, max_queue={admission.limit if admission else None})", file=sys.stderr)
+
+    def serve_connection(conn):
+        with conn:
+            reader = conn.makefile('r', encoding='utf-8')
+            writer = conn.makefile('w', encoding='utf-8')
+
+            def write_line(payload):
+                writer.write(payload + '\n')
+                writer.flush()
+
+            try:
+                _serve_stream(lambda: reader, write_line, handle_request, pool, admission)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+    try:
+        while True:
+            conn, _ = server.accept()
+            threading.Thread(target=serve_connection, args=(conn,), daemon=True).start()
+    finally:
+        server.close()
+        if os.path.exists(path):
+            os.unlink(path)
+
+
+def run_worker(handle_request, argv, min_threads=1):
+    """
+    명령줄 인자에 따라 stdio 또는 Unix 소켓 워커 실행
+    min_threads: 요청 스레드 수 하한 (마이크로 배치는 스레드가 결과를 기다리는 동안 다른 요청이 들어와야 함)
+    스레드 풀과 대기 요청 상한(--max-queue, 스레드 수보다 작으면 스레드 수)은 워커 전체에 하나 (연결 수와 무관)
+    """
+    args = parse_worker_args(argv)
+    threads = max(args.threads, min_threads)
+    admission = AdmissionLimit(max(args.max_queue, threads))
+    print(f"요청 스레드 {threads}개, 대기 요청 상한 {admission.limit}개 (워커 전체)", file=sys.stderr)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        if args.socket:
+            serve_unix_socket(args.socket, handle_request, pool, admission)
+        else:
+            serve_stdio(handle_request, pool, admission)
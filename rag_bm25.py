@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# rag_bm25.py - 레제 지식 베이스 BM25 검색 (오프라인, numpy만 사용)
+# 한국어는 조사(은/는/이/가)가 단어에 붙으므로 어절 단위 대신 어절 안의 문자 바이그램으로 색인한다.
+#   "레제는" -> 레제, 제는   /   "레제가" -> 레제, 제가   => '레제'로 매칭됨
+#
+# 저장 구조 (index_dir):
+#   meta.json     - 용어 사전, 평균 문서 길이, 색인된 파일 목록(sha1), BM25 파라미터
+#   passages.json - passage 본문/섹션/출처
+#   indptr.npy / doc_ids.npy / tfs.npy - 용어별 포스팅 (CSR)
+#   doc_len.npy   - passage 길이 (토큰 수)
+# 포스팅 배열은 첫 검색 때 mmap으로 로드한다.
+#
+# 지연 시간 확인: python3 rag_bm25.py --bench [배수]
+
+import hashlib
+import json
+import os
+import re
+import sys
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_INDEX_DIR = './rag_bm25_index'
+# 기본 점수 하한 = 질의가 낼 수 있는 최대 점수 x 이 비율
+# 최대 점수는 질의 바이그램마다 idf x (k1 + 1)의 합 (색인에 없는 바이그램은 df=0일 때의 idf)
+# 바이그램 한두 개만 겹치는 잡담 질의는 보통 0.05~0.09, 지식 질문의 정답 passage는 0.1 이상
+MIN_SCORE_RATIO = 0.09
+ARRAYS = ('indptr', 'doc_ids', 'tfs', 'doc_len')
+
+
+def tokenize(text):
+    """어절별 문자 바이그램 (한 글자 어절은 그대로)"""
+    tokens = []
+    for word in re.findall(r'\w+', text.lower()):
+        if len(word) == 1:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 2] for i in range(len(word) - 1))
+    return tokens
+
+
+def file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+class BM25Index:
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR, k1=1.5, b=0.75):
+        if np is None:
+            raise ImportError("BM25 검색에는 numpy가 필요합니다 (pip install numpy)")
+        self.index_dir = index_dir
+        self.k1 = k1
+        self.b = b
+
+        self.terms = {}
+        self.passages = []
+        self.sources = {}
+        self.avg_len = 0.0
+        self._arrays = None  # 첫 검색 때 로드
+
+    # ---------- 저장 / 로드 ----------
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def exists(self):
+        return os.path.exists(self._path('meta.json'))
+
+    def save(self, arrays):
+        os.makedirs(self.index_dir, exist_ok=True)
+        for name in ARRAYS:
+            # mmap 중인 다른 프로세스가 있으므로 임시 파일을 교체
+            tmp_path = self._path(f'{name}.npy.tmp{os.getpid()}')
+            with open(tmp_path, 'wb') as f:
+                np.save(f, arrays[name])
+            os.replace(tmp_path, self._path(f'{name}.npy'))
+        with open(self._path('passages.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.passages, f, ensure_ascii=False)
+        with open(self._path('meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'terms': self.terms, 'sources': self.sources, 'avg_len': self.avg_len,
+                       'k1': self.k1, 'b': self.b}, f, ensure_ascii=False)
+
+    def load(self):
+        """메타데이터만 읽고, 포스팅 배열은 첫 검색 때 로드"""
+        with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(self._path('passages.json'), 'r', encoding='utf-8') as f:
+            self.passages = json.load(f)
+        self.terms = meta['terms']
+        self.sources = meta['sources']
+        self.avg_len = meta['avg_len']
+        self.k1, self.b = meta['k1'], meta['b']
+        self._arrays = None
+        return self
+
+    def _load_arrays(self):
+        if self._arrays is None:
+            self._arrays = {name: np.load(self._path(f'{name}.npy'), mmap_mode='r') for name in ARRAYS}
+            # 문서 길이 정규화 항은 질의마다 같으므로 미리 계산
+            doc_len = np.asarray(self._arrays['doc_len'], dtype=np.float64)
+            self._length_norm = self.k1 * (1 - self.b + self.b * doc_len / max(self.avg_len, 1e-9))
+            num_docs = len(doc_len)
+            df = np.diff(self._arrays['indptr']).astype(np.float64)
+            self._idf = np.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+        return self._arrays
+
+    # ---------- 색인 ----------
+
+    def build(self, files):
+        """지식 파일들로 색인 생성"""
+        from rag_reze import split_knowledge_file
+
+        self.sources = {}
+        passages = []
+        for path in files:
+            passages.extend(split_knowledge_file(path))
+            self.sources[path] = file_sha1(path)
+        return self._build_from_passages(passages)
+
+    def _build_from_passages(self, passages):
+        self.terms = {}
+        rows_by_term = {}
+        doc_len = np.zeros(len(passages), dtype=np.int32)
+
+        for doc_id, passage in enumerate(passages):
+            counts = {}
+            tokens = tokenize(passage['embed_text'])
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            doc_len[doc_id] = len(tokens)
+            for token, tf in counts.items():
+                term_id = self.terms.setdefault(token, len(self.terms))
+                rows_by_term.setdefault(term_id, []).append((doc_id, tf))
+
+        indptr = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        for term_id, rows in rows_by_term.items():
+            indptr[term_id + 1] = len(rows)
+        np.cumsum(indptr, out=indptr)
+        doc_ids = np.empty(indptr[-1], dtype=np.int32)
+        tfs = np.empty(indptr[-1], dtype=np.float32)
+        for term_id, rows in rows_by_term.items():
+            start = indptr[term_id]
+            doc_ids[start:start + len(rows)] = [doc_id for doc_id, _ in rows]
+            tfs[start:start + len(rows)] = [tf for _, tf in rows]
+
+        self.passages = passages
+        self.avg_len = float(doc_len.mean()) if len(doc_len) else 0.0
+        arrays = {'indptr': indptr, 'doc_ids': doc_ids, 'tfs': tfs, 'doc_len': doc_len}
+        self.save(arrays)
+        self._arrays = None
+        print(f"BM25 색인 생성: {len(passages)}개 passage, {len(self.terms)}개 용어", file=sys.stderr)
+        return self
+
+    def add_file(self, path):
+        """
+        지식 파일 추가 (이미 같은 내용이면 건너뜀)
+        문서 빈도/평균 길이가 바뀌므로 포스팅은 새로 만들지만, 기존 passage 분할은 재사용한다
+        """
+        from rag_reze import split_knowledge_file
+
+        digest = file_sha1(path)
+        if self.sources.get(path) == digest:
+            return 0
+        new_passages = split_knowledge_file(path)
+        self.sources[path] = digest
+        self._build_from_passages([p for p in self.passages if p['source'] != path] + new_passages)
+        return len(new_passages)
+
+    # ---------- 검색 ----------
+
+    def search(self, query, top_k=5, min_score=None):
+        """
+        BM25 점수 상위 top_k passage -> [(점수, passage), ...]
+        min_score: 이 점수 이하 passage는 버림 (없으면 질의 최대 점수 x MIN_SCORE_RATIO)
+        """
+        tokens = set(tokenize(query))
+        term_ids = {self.terms[t] for t in tokens if t in self.terms}
+        if not term_ids:
+            return []
+
+        arrays = self._load_arrays()
+        if min_score is None:
+            min_score = MIN_SCORE_RATIO * self.max_score(tokens)
+        indptr, doc_ids, tfs = arrays['indptr'], arrays['doc_ids'], arrays['tfs']
+        scores = np.zeros(len(self.passages))
+        for term_id in term_ids:
+            start, end = indptr[term_id], indptr[term_id + 1]
+            docs = doc_ids[start:end]
+            tf = tfs[start:end]
+            # 한 용어의 포스팅에는 같은 문서가 한 번만 있으므로 인덱스 덧셈으로 충분
+            scores[docs] += self._idf[term_id] * tf * (self.k1 + 1) / (tf + self._length_norm[docs])
+
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.lexsort((top, -scores[top]))]  # 동점이면 파일 순서
+        return [(float(scores[i]), self.passages[i]) for i in top if scores[i] > min_score]
+
+    def max_score(self, tokens):
+        """질의 바이그램이 모두 겹칠 때 낼 수 있는 점수의 상한 (tf가 커질수록 용어별 점수는 idf x (k1 + 1)에 수렴)"""
+        self._load_arrays()
+        unseen_idf = np.log(1 + (len(self.passages) + 0.5) / 0.5)
+        idf = sum(float(self._idf[self.terms[t]]) if t in self.terms else unseen_idf for t in tokens)
+        return idf * (self.k1 + 1)
+
+
+def load_or_build_index(files, index_dir=DEFAULT_INDEX_DIR):
+    """저장된 색인을 로드하고, 새로 생기거나 바뀐 지식 파일만 반영"""
+    index = BM25Index(index_dir)
+    if not index.exists():
+        return index.build(files)
+
+    index.load()
+    for path in files:
+        index.add_file(path)
+    return index
+
+
+def _synthetic_word(passage_id):
+    """passage마다 다른 세 글자 한글 어절 (번호를 섞어 한글 음절 11172개 진법으로 씀)"""
+    n = passage_id * 7919 % 11172 ** 3
+    return ''.join(chr(0xAC00 + n // 11172 ** k % 11172) for k in range(3))
+
+
+def benchmark(knowledge_file='reze_knowledge.txt', scale=100, repeats=200):
+    """지식 베이스를 scale배로 복제해 질의 지연 시간 측정"""
+    import tempfile
+    import time
+
+    from rag_reze import split_knowledge_file
+
+    base = split_knowledge_file(knowledge_file)
+    # 복제본마다 색인되는 embed_text에 다른 합성 어절을 붙여 용어 사전도 코퍼스와 함께 커지게 함
+    passages = [dict(p, text=f"{p['text']} #{copy}",
+                     embed_text=f"{p['embed_text']} {_synthetic_word(copy * len(base) + i)}")
+                for copy in range(scale) for i, p in enumerate(base)]
+    queries = ["레제 너 어디 출신이야?", "덴지 알아?", "폭탄 악마가 뭐야?", "카페에서 일해?", "좋아하는 거 있어?"]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = BM25Index(tmp)._build_from_passages(passages)
+        index = BM25Index(tmp).load()
+        index.search(queries[0])  # 배열 로드
+
+        started = time.perf_counter()
+        for _ in range(repeats):
+            for query in queries:
+                index.search(query)
+        elapsed = time.perf_counter() - started
+
+    return {
+        'passages': len(passages),
+        'terms': len(index.terms),
+        'queries': repeats * len(queries),
+        'ms_per_query': round(elapsed * 1000 / (repeats * len(queries)), 4),
+    }
+
+
+if __name__ == "__main__":
+    if '--bench' in sys.argv:
+        rest = [a for a in sys.argv[1:] if a != '--bench']
+        print(json.dumps(benchmark(scale=int(rest[0]) if rest else 100), ensure_ascii=False))
+    else:
+        # 사용법: python3 rag_bm25.py [지식 파일 ...]  (색인 생성/갱신)
+        paths = sys.argv[1:] or ['reze_knowledge.txt']
+        index = load_or_build_index(paths)
+        print(json.dumps({"status": "success", "passages": len(index.passages),
+                          "terms": len(index.terms), "sources": list(index.sources)}, ensure_ascii=False))
@@ -1,22 +1,102 @@
 #!/usr/bin/env python3
 # rag_reze.py - 레제 지식 베이스 RAG 시스템
 # 나무위키나 다른 소스에서 레제 정보를 임베딩하고 검색
+#
+# 검색 모드:
+#   keyword : 줄 단위 키워드 포함 검색 (기존 방식, 기본값)
+#   vector  : passage 임베딩 코사인 유사도 top-k (rag_vector.py, numpy 필요)
+#   bm25    : 문자 바이그램 BM25 top-k (rag_bm25.py, numpy 필요)
+#
+# min_score: vector/bm25 검색에서 이 점수 이하 passage는 붙이지 않음
+#   (없으면 색인 기본값: vector는 임베딩별 min_score, bm25는 질의 최대 점수 x MIN_SCORE_RATIO)
 
 import json
 from pathlib import Path
 
+
+def split_passages(text, source=None):
+    """
+    지식 텍스트를 passage 단위로 분할
+    '## 섹션' 아래의 '- 항목' 하나(딸린 '* 하위 항목' 포함)가 passage 하나
+    embed_text에는 섹션 제목을 붙여 문맥을 같이 임베딩한다
+    """
+    passages = []
+    section = ''
+    current = []
+
+    def flush():
+        if current:
+            body = '\n'.join(current)
+            passages.append({
+                'text': body,
+                'section': section,
+                'source': source,
+                'embed_text': f"{section} {body}".strip(),
+            })
+            current.clear()
+
+    for line in text.split('\n'):
+        stripped = line.strip()
+        if not stripped or stripped.startswith('# '):
+            continue
+        if stripped.startswith('##'):
+            flush()
+            section = stripped.lstrip('#').strip()
+        elif stripped.startswith('*') or line.startswith((' ', '\t')):
+            current.append(line.rstrip())  # 하위 항목은 앞 항목에 붙임
+        else:
+            flush()
+            current.append(stripped)
+    flush()
+    return passages
+
+
+def split_knowledge_file(file_path):
+    """지식 파일 -> passage 목록"""
+    with open(file_path, 'r', encoding='utf-8') as f:
+        return split_passages(f.read(), source=str(file_path))
+
+
 # 간단한 RAG 구현 (프로토타입)
 class SimpleRezeRAG:
-    def __init__(self, knowledge_file="reze_knowledge.txt"):
+    def __init__(self, knowledge_file="reze_knowledge.txt", mode="keyword", index_dir=None, min_score=None):
         self.knowledge = self.load_knowledge(knowledge_file)
-        
+        self.mode = mode
+        self.min_score = min_score
+        self.index = None  # search(query, top_k) / add_file(path)를 가진 검색 색인
+
+        if mode == "vector":
+            from rag_vector import DEFAULT_INDEX_DIR, load_or_build_index
+            self.index = load_or_build_index([knowledge_file], index_dir or DEFAULT_INDEX_DIR)
+        elif mode == "bm25":
+            from rag_bm25 import DEFAULT_INDEX_DIR, load_or_build_index
+            self.index = load_or_build_index([knowledge_file], index_dir or DEFAULT_INDEX_DIR)
+        elif mode != "keyword":
+            raise ValueError(f"알 수 없는 검색 모드: {mode} (keyword, vector, bm25)")
+
     def load_knowledge(self, file_path):
         """지식 베이스 로드"""
         with open(file_path, 'r', encoding='utf-8') as f:
             return f.read()
     
-    def search(self, query):
-        """간단한 키워드 검색 (나중에 벡터 검색으로 업그레이드)"""
+    def add_knowledge_file(self, file_path):
+        """지식 파일 추가 (벡터 모드는 새 passage만 임베딩)"""
+        self.knowledge += '\n' + self.load_knowledge(file_path)
+        if self.index is not None:
+            self.index.add_file(file_path)
+
+    def search(self, query, top_k=5):
+        """모드에 따라 관련 지식 검색 (vector/bm25는 점수 높은 순서)"""
+        if self.index is not None:
+            if self.min_score is None:
+                results = self.index.search(query, top_k)
+            else:
+                results = self.index.search(query, top_k, min_score=self.min_score)
+            return '\n'.join(passage['text'] for _, passage in results)
+        return self.keyword_search(query, top_k)
+
+    def keyword_search(self, query, top_k=5):
+        """간단한 키워드 검색"""
         lines = self.knowledge.split('\n')
         results = []
         
@@ -25,7 +105,7 @@ class SimpleRezeRAG:
             if any(keyword in line.lower() for keyword in keywords):
                 results.append(line)
         
-        return '\n'.join(results[:5])  # 상위 5개 결과
+        return '\n'.join(results[:top_k])  # 파일 순서로 앞의 top_k개
     
     def enhance_prompt(self, user_message):
         """사용자 메시지에 관련 지식 추가"""
@@ -45,7 +125,9 @@ class SimpleRezeRAG:
 
 # 사용 예시
 if __name__ == "__main__":
-    rag = SimpleRezeRAG()
+    import sys
+    mode = sys.argv[1] if len(sys.argv) > 1 else "keyword"
+    rag = SimpleRezeRAG(mode=mode)
     
     # 테스트
     test_queries = [
@@ -0,0 +1,365 @@
+#!/usr/bin/env python3
+# rag_vector.py - 레제 지식 베이스 벡터 검색 엔진
+# 지식 파일을 passage 단위로 나눠 오프라인으로 임베딩하고, NumPy 행렬로 저장해 둔다.
+# 질의는 코사인 유사도 top-k (정확 검색 또는 IVF 근사 검색).
+#
+# 임베딩:
+#   tfidf : 문자 1~2-gram 해싱 + TF-IDF (의존성 없음, 기본값, 조사 붙은 한국어도 잘 맞음)
+#   sbert : sentence-transformers 로컬 모델 (설치되어 있을 때만, CPU)
+#
+# 저장 구조 (index_dir):
+#   embeddings.npy  - (N, dim) float32, L2 정규화
+#   passages.json   - passage 본문/섹션/출처
+#   meta.json       - 임베딩 설정, 문서 빈도(df), 색인된 파일 목록(sha1)
+#   ivf.npz         - IVF 중심점/할당 (index_type='ivf'일 때)
+#
+# 새 지식 파일은 add_file()로 추가한다. 기존 passage는 다시 임베딩하지 않는다.
+
+import hashlib
+import json
+import os
+import sys
+import zlib
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_INDEX_DIR = './rag_index'
+# passage 수가 이보다 적으면 IVF를 쓰지 않고 정확 검색
+IVF_MIN_PASSAGES = 256
+
+
+def _require_numpy():
+    if np is None:
+        raise ImportError("벡터 검색에는 numpy가 필요합니다 (pip install numpy)")
+
+
+def file_sha1(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def char_ngrams(text, sizes=(1, 2)):
+    """공백을 경계 문자로 바꾼 문자 n-gram (조사가 붙어도 어간 바이그램은 그대로 맞음)"""
+    normalized = ' ' + ' '.join(text.lower().split()) + ' '
+    grams = []
+    for n in sizes:
+        grams.extend(normalized[i:i + n] for i in range(len(normalized) - n + 1) if normalized[i:i + n].strip())
+    return grams
+
+
+class HashingTfidfEmbedder:
+    """
+    문자 n-gram 해싱 + 서브리니어 TF * IDF, L2 정규화
+    IDF는 처음 색인할 때 고정되고, 이후 추가되는 passage도 같은 IDF로 임베딩한다
+    (모르는 n-gram은 최대 IDF). 전체 재계산은 VectorIndex.rebuild().
+    """
+    name = 'tfidf'
+    # search 기본 점수 하한: reze_knowledge.txt에서 지식 질문의 1위는 0.14 이상이고,
+    # 잡담 메시지의 상위 passage는 대부분 0.06~0.13 (그대로 두면 아무 글자만 겹쳐도 붙음)
+    min_score = 0.14
+
+    def __init__(self, dim=4096):
+        self.dim = dim
+        self.df = np.zeros(dim, dtype=np.float64)
+        self.num_docs = 0
+        self.idf = None
+
+    def _bucket(self, gram):
+        return zlib.crc32(gram.encode('utf-8')) % self.dim
+
+    def _term_counts(self, text):
+        counts = {}
+        for gram in char_ngrams(text):
+            bucket = self._bucket(gram)
+            counts[bucket] = counts.get(bucket, 0) + 1
+        return counts
+
+    def fit(self, texts):
+        """문서 빈도 누적 후 IDF 고정"""
+        for text in texts:
+            for bucket in self._term_counts(text):
+                self.df[bucket] += 1
+        self.num_docs += len(texts)
+        self.idf = np.log((1 + self.num_docs) / (1 + self.df)) + 1.0
+
+    def update_df(self, texts):
+        """새 passage의 문서 빈도만 기록 (IDF는 rebuild 때 반영)"""
+        for text in texts:
+            for bucket in self._term_counts(text):
+                self.df[bucket] += 1
+        self.num_docs += len(texts)
+
+    def remove_df(self, texts):
+        """색인에서 빠지는 passage의 문서 빈도를 뺌 (update_df의 반대)"""
+        for text in texts:
+            for bucket in self._term_counts(text):
+                self.df[bucket] -= 1
+        self.num_docs -= len(texts)
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, count in self._term_counts(text).items():
+                vectors[row, bucket] = (1.0 + np.log(count)) * self.idf[bucket]
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return vectors / np.maximum(norms, 1e-12)
+
+    def state(self):
+        return {'name': self.name, 'dim': self.dim, 'num_docs': self.num_docs,
+                'df': self.df.tolist(), 'idf': self.idf.tolist()}
+
+    @classmethod
+    def from_state(cls, state):
+        embedder = cls(state['dim'])
+        embedder.num_docs = state['num_docs']
+        embedder.df = np.array(state['df'], dtype=np.float64)
+        embedder.idf = np.array(state['idf'], dtype=np.float64)
+        return embedder
+
+
+class SentenceTransformerEmbedder:
+    """sentence-transformers 로컬 모델 (CPU 전용)"""
+    name = 'sbert'
+    min_score = 0.3
+
+    def __init__(self, model_name='jhgan/ko-sroberta-multitask'):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device='cpu')
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def fit(self, texts):
+        pass
+
+    def update_df(self, texts):
+        pass
+
+    def remove_df(self, texts):
+        pass
+
+    def embed(self, texts):
+        vectors = self.model.encode(list(texts), convert_to_numpy=True, normalize_embeddings=True)
+        return vectors.astype(np.float32)
+
+    def state(self):
+        return {'name': self.name, 'model_name': self.model_name, 'dim': self.dim}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['model_name'])
+
+
+def make_embedder(name='tfidf'):
+    """임베더 생성 (sbert가 없으면 tfidf로 대체)"""
+    if name == 'sbert':
+        try:
+            return SentenceTransformerEmbedder()
+        except ImportError:
+            print("sentence-transformers 없음, TF-IDF 임베딩 사용", file=sys.stderr)
+    return HashingTfidfEmbedder()
+
+
+def embedder_from_state(state):
+    if state['name'] == 'sbert':
+        return SentenceTransformerEmbedder.from_state(state)
+    return HashingTfidfEmbedder.from_state(state)
+
+
+def kmeans(vectors, num_clusters, iterations=20, seed=0):
+    """구면 k-means (코사인) - IVF 중심점 학습용"""
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), num_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(vectors @ centroids.T, axis=1)
+        for c in range(num_clusters):
+            members = vectors[assign == c]
+            if len(members):
+                centroid = members.sum(axis=0)
+                centroids[c] = centroid / max(np.linalg.norm(centroid), 1e-12)
+    return centroids, np.argmax(vectors @ centroids.T, axis=1)
+
+
+class VectorIndex:
+    """
+    passage 임베딩 행렬 + 코사인 top-k 검색
+    index_type: 'exact' (전체 행렬곱) 또는 'ivf' (중심점 nprobe개 클러스터만 검색)
+    """
+
+    def __init__(self, index_dir=DEFAULT_INDEX_DIR, index_type='exact', nprobe=4):
+        _require_numpy()
+        self.index_dir = index_dir
+        self.index_type = index_type
+        self.nprobe = nprobe
+
+        self.embedder = None
+        self.embeddings = np.zeros((0, 0), dtype=np.float32)
+        self.passages = []
+        self.sources = {}  # 파일 경로 -> sha1
+        self.centroids = None
+        self.assign = None
+
+    # ---------- 저장 / 로드 ----------
+
+    def _path(self, name):
+        return os.path.join(self.index_dir, name)
+
+    def exists(self):
+        return os.path.exists(self._path('meta.json'))
+
+    def save(self):
+        os.makedirs(self.index_dir, exist_ok=True)
+        # mmap 중인 다른 프로세스가 있으므로 덮어쓰지 않고 임시 파일을 교체
+        tmp_path = self._path(f'embeddings.npy.tmp{os.getpid()}')
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.embeddings)
+        os.replace(tmp_path, self._path('embeddings.npy'))
+        with open(self._path('passages.json'), 'w', encoding='utf-8') as f:
+            json.dump(self.passages, f, ensure_ascii=False)
+        with open(self._path('meta.json'), 'w', encoding='utf-8') as f:
+            json.dump({'embedder': self.embedder.state(), 'sources': self.sources,
+                       'index_type': self.index_type}, f, ensure_ascii=False)
+        if self.centroids is not None:
+            np.savez(self._path('ivf.npz'), centroids=self.centroids, assign=self.assign)
+        elif os.path.exists(self._path('ivf.npz')):
+            os.remove(self._path('ivf.npz'))  # 정확 검색으로 바뀐 색인에 옛 클러스터가 남지 않게
+
+    def load(self):
+        with open(self._path('meta.json'), 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        with open(self._path('passages.json'), 'r', encoding='utf-8') as f:
+            self.passages = json.load(f)
+        self.embedder = embedder_from_state(meta['embedder'])
+        self.sources = meta['sources']
+        # 읽기 전용 mmap (여러 프로세스가 페이지 공유)
+        self.embeddings = np.load(self._path('embeddings.npy'), mmap_mode='r')
+        self.centroids = self.assign = None
+        if meta.get('index_type') == 'ivf' and os.path.exists(self._path('ivf.npz')):
+            ivf = np.load(self._path('ivf.npz'))
+            if len(ivf['assign']) == len(self.embeddings):
+                self.centroids, self.assign = ivf['centroids'], ivf['assign']
+        return self
+
+    # ---------- 색인 ----------
+
+    def build(self, files, embedder='tfidf'):
+        """지식 파일들로 전체 색인 생성"""
+        from rag_reze import split_knowledge_file
+
+        passages = []
+        for path in files:
+            passages.extend(split_knowledge_file(path))
+            self.sources[path] = file_sha1(path)
+
+        self.embedder = make_embedder(embedder)
+        self.embedder.fit([p['embed_text'] for p in passages])
+        self.passages = passages
+        self.embeddings = self.embedder.embed([p['embed_text'] for p in passages])
+        self._train_ivf()
+        self.save()
+        print(f"벡터 색인 생성: {len(passages)}개 passage ({self.embedder.name})", file=sys.stderr)
+        return self
+
+    def rebuild(self):
+        """색인된 모든 파일로 다시 생성 (IDF 재계산)"""
+        files = list(self.sources)
+        self.sources = {}
+        return self.build(files, self.embedder.name if self.embedder else 'tfidf')
+
+    def add_file(self, path):
+        """
+        지식 파일 하나를 증분 추가 (기존 passage는 다시 임베딩하지 않음)
+        이미 같은 내용으로 색인된 파일이면 건너뛰고, 내용이 바뀌었으면 그 파일의 passage만 교체
+        """
+        from rag_reze import split_knowledge_file
+
+        digest = file_sha1(path)
+        if self.sources.get(path) == digest:
+            return 0
+
+        keep = [i for i, p in enumerate(self.passages) if p['source'] != path]
+        new_passages = split_knowledge_file(path)
+        self.embedder.remove_df([p['embed_text'] for p in self.passages if p['source'] == path])
+        self.embedder.update_df([p['embed_text'] for p in new_passages])
+        new_vectors = self.embedder.embed([p['embed_text'] for p in new_passages])
+
+        self.passages = [self.passages[i] for i in keep] + new_passages
+        self.embeddings = np.concatenate([np.asarray(self.embeddings)[keep], new_vectors])
+        self.sources[path] = digest
+
+        # 중심점이 없거나, IVF_MIN_PASSAGES 아래로 줄었거나, 절반 넘게 새 passage면 다시 학습 (정확 검색으로 돌아갈 수도 있음)
+        retrain = (self.centroids is None or len(self.passages) < IVF_MIN_PASSAGES
+                   or len(keep) * 2 < len(self.passages))
+        if not retrain:
+            # 기존 중심점에 새 벡터만 할당
+            self.assign = np.concatenate([self.assign[keep], np.argmax(new_vectors @ self.centroids.T, axis=1)])
+        else:
+            self._train_ivf()
+        self.save()
+        print(f"벡터 색인 추가: {path} ({len(new_passages)}개 passage)", file=sys.stderr)
+        return len(new_passages)
+
+    def _train_ivf(self):
+        if self.index_type != 'ivf' or len(self.embeddings) < IVF_MIN_PASSAGES:
+            self.centroids = self.assign = None
+            return
+        num_clusters = max(1, int(np.sqrt(len(self.embeddings))))
+        self.centroids, self.assign = kmeans(np.asarray(self.embeddings), num_clusters)
+
+    # ---------- 검색 ----------
+
+    def search(self, query, top_k=5, min_score=None):
+        """
+        코사인 유사도 상위 top_k passage -> [(점수, passage), ...]
+        min_score: 이 점수 이하 passage는 버림 (없으면 임베딩별 기본값 embedder.min_score)
+        """
+        if not self.passages:
+            return []
+        if min_score is None:
+            min_score = self.embedder.min_score
+        q = self.embedder.embed([query])[0]
+
+        if self.centroids is not None:
+            # IVF: 가까운 클러스터 nprobe개 안에서만 검색
+            probes = np.argsort(-(self.centroids @ q))[:self.nprobe]
+            candidates = np.nonzero(np.isin(self.assign, probes))[0]
+            scores = np.asarray(self.embeddings[candidates]) @ q
+        else:
+            candidates = None
+            scores = np.asarray(self.embeddings) @ q
+
+        k = min(top_k, len(scores))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        results = []
+        for i in top:
+            if scores[i] <= min_score:
+                break
+            row = candidates[i] if candidates is not None else i
+            results.append((float(scores[i]), self.passages[row]))
+        return results
+
+
+def load_or_build_index(files, index_dir=DEFAULT_INDEX_DIR, embedder='tfidf', index_type='exact'):
+    """저장된 색인을 로드하고, 새로 생기거나 바뀐 지식 파일만 증분 추가"""
+    index = VectorIndex(index_dir, index_type)
+    if not index.exists():
+        return index.build(files, embedder)
+
+    index.load()
+    for path in files:
+        index.add_file(path)
+    return index
+
+
+if __name__ == "__main__":
+    # 사용법: python3 rag_vector.py [지식 파일 ...]  (색인 생성/증분 추가)
+    paths = sys.argv[1:] or ['reze_knowledge.txt']
+    index = load_or_build_index(paths)
+    print(json.dumps({"status": "success", "passages": len(index.passages),
+                      "sources": list(index.sources)}, ensure_ascii=False))
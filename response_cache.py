@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+# response_cache.py - 정규화된 메시지를 키로 쓰는 LRU 캐시
+# 실제 대화는 "안녕", "뭐 해?" 같은 반복이 많으므로 후보 순위 계산 결과를 캐시한다.
+# 최종 응답 문자열이 아니라 순위 목록을 저장하므로, 상위 3개 중 랜덤 선택은 매번 달라진다.
+#
+# - 크기(LRU) / TTL 기반 만료
+# - 적중/실패/만료/무효화 카운터
+# - 감시 중인 파일(dataset.json)의 mtime이 바뀌면 해시를 다시 계산하고, 내용이 바뀌었으면 전부 비움
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_message(message):
+    """후처리와 같은 공백 정리 + 소문자화 (캐시 키)"""
+    return re.sub(r'\s+', ' ', message).strip().lower()
+
+
+def file_digest(path):
+    """파일 내용 해시 (sha1)"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, max_size=1024, ttl=600.0, watch_path=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.watch_path = watch_path
+
+        self._entries = OrderedDict()  # key -> (저장 시각, 값)
+        self._lock = threading.Lock()
+        self._owner = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+        # 감시 파일이 바뀔 때마다 1씩 증가 (데이터셋을 다시 로드할지 판단하는 용도)
+        self.generation = 0
+
+        self._source_stat = None
+        self._source_hash = None
+        if watch_path:
+            self._source_stat = self._stat()
+            self._source_hash = file_digest(watch_path) if self._source_stat else None
+
+    def _stat(self):
+        try:
+            st = os.stat(self.watch_path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def check_source(self):
+        """
+        감시 파일이 바뀌었으면 캐시를 비우고 True 반환
+        mtime/크기가 같으면 해시는 다시 계산하지 않는다
+        """
+        if not self.watch_path:
+            return False
+
+        current = self._stat()
+        if current == self._source_stat:
+            return False
+
+        with self._lock:
+            if current == self._source_stat:
+                return False
+            self._source_stat = current
+            new_hash = file_digest(self.watch_path) if current else None
+            if new_hash == self._source_hash:
+                return False  # touch만 된 경우
+            self._source_hash = new_hash
+            self._entries.clear()
+            self.invalidations += 1
+            self.generation += 1
+            return True
+
+    def get(self, key):
+        """캐시 조회 (없거나 만료되면 None)"""
+        self.check_source()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            stored_at, value = entry
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """캐시 저장 (가장 오래 안 쓴 항목부터 밀어냄)"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def bind(self, owner):
+        """캐시 값을 계산한 객체(데이터셋)를 기록하고, 다른 객체로 바뀌면 비운다"""
+        if self._owner is not owner:
+            with self._lock:
+                self._entries.clear()
+                self._owner = owner
+
+    def __len__(self):
+        return len(self._entries)
+
+    def stats(self):
+        """캐시 통계"""
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'invalidations': self.invalidations,
+        }
@@ -0,0 +1,518 @@
+#!/usr/bin/env python3
+# reze_model.py - 학습/추론이 같이 쓰는 Transformer 모델
+# nn.Transformer 가중치 구조(state_dict 키)는 예전 체크포인트와 같고, 추론용 API를 더했다.
+#
+#   encode(src)                        : 인코더 메모리 계산 (메시지당 한 번)
+#   decode(tgt, memory)                : 디코더 전체 실행 (teacher forcing, 예전 forward와 같은 값)
+#   decode_step(tokens, memory, cache) : 새 토큰만 계산하고 층별 key/value를 cache에 누적 (인과 마스크)
+#   prefill(cache, prefixes, pad_idx)  : 길이가 다른 prefix 여러 개를 왼쪽 패딩해 한 번에 캐시에 넣음
+#   generate_batch(cache, logits, ...) : 배치의 모든 행을 한 스텝씩 같이 생성 (행마다 <EOS>에서 멈춤)
+#   generate(memory, prefix, ...)      : prefix부터 <EOS>까지 한 토큰씩 생성 (한 행짜리 generate_batch)
+#   stream(cache, prefix, ...)         : generate와 같지만 토큰이 나올 때마다 yield (스트리밍 응답용)
+#   speculate_batch(cache, prefixes, drafts, ...) : 초안(템플릿 나머지)을 한 번의 forward로 검증하는 추측 디코딩
+#   beam_search(cache, prefixes, ...)  : prefix마다 빔 beam_width개를 한 배치로 넓혀 길이 정규화 로그 확률로 탐색
+#
+# decode_step/generate는 인과 마스크로 학습한 체크포인트('causal': True)를 전제로 한다.
+# 패딩 마스크로 학습한 체크포인트('padding_mask': True)는 소스를 패딩 없이 넣으면 된다.
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def causal_mask(size, device=None):
+    """미래 위치를 막는 float 마스크 (nn.Transformer.generate_square_subsequent_mask와 같음)"""
+    return torch.triu(torch.full((size, size), float('-inf'), device=device), diagonal=1)
+
+
+def padding_mask(tokens, pad_idx):
+    """<PAD> 위치를 막는 float key padding 마스크 (B, L) (causal_mask와 타입을 맞춤)"""
+    return torch.zeros(tokens.shape, device=tokens.device).masked_fill(tokens == pad_idx, float('-inf'))
+
+
+def decoder_positions(start, length, last, pad=None, device=None):
+    """
+    디코더 입력 start..start+length-1번 열의 위치 인코딩 번호 ((1 또는 B), length)
+    왼쪽 패딩된 행은 패딩을 뺀 실제 위치 (패딩 자리는 0번, 결과는 안 쓰임)
+    배치에서 먼저 끝난 행은 다른 행이 끝날 때까지 계속 스텝을 돌므로 마지막 위치 last로 묶음 (결과는 안 쓰임)
+    """
+    columns = start + torch.arange(length, device=device)
+    if pad is None:
+        return columns.clamp(max=last)[None]
+    return (columns[None, :] - pad[:, None]).clamp(min=0, max=last)
+
+
+def step_attention_mask(start, length, pad=None, device=None):
+    """
+    decode_step의 self-attention 허용 마스크: 새 토큰 i는 캐시 전체 + 자기 자신까지 볼 수 있음
+    반환: (length, start+length) 또는 pad가 있으면 (B, 1, length, start+length)
+    """
+    key_columns = torch.arange(start + length, device=device)[None, :]
+    query_columns = (start + torch.arange(length, device=device))[:, None]
+    allowed = key_columns <= query_columns
+    if pad is not None:
+        # 왼쪽 패딩 위치는 가림 (패딩 자리 자신은 열어 두어 softmax가 비지 않게 함)
+        real = key_columns[None] >= pad[:, None, None]
+        allowed = (allowed[None] & (real | (key_columns == query_columns)[None])).unsqueeze(1)
+    return allowed
+
+
+def _banned_tokens(history, n):
+    """history 끝의 (n-1)개 토큰 뒤에 붙으면 이미 나온 n-gram이 되는 토큰들"""
+    if len(history) < n:
+        return []
+    tail = tuple(history[len(history) - n + 1:])
+    return [history[i + n - 1] for i in range(len(history) - n + 1) if tuple(history[i:i + n - 1]) == tail]
+
+
+class DecoderCache:
+    """
+    디코더 층별 self-attention key/value 캐시 + 인코더 메모리의 cross-attention key/value
+    truncate(n)은 앞 n개 위치만 남긴 새 캐시를 돌려준다 (원본은 그대로라서 여러 prefix가 공유 가능)
+    pad: 행마다 왼쪽 패딩 개수 (B,) - prefill로 길이가 다른 prefix를 같이 넣었을 때만 있음
+    memory_mask: cross-attention 마스크 (B, 1, 1, S) - 길이가 다른 소스 여러 개를 같이 인코딩했을 때만 있음
+    """
+
+    def __init__(self, memory_kv, keys=None, values=None, length=0, memory_mask=None, pad=None):
+        self.memory_kv = memory_kv
+        self.keys = keys if keys is not None else [None] * len(memory_kv)
+        self.values = values if values is not None else [None] * len(memory_kv)
+        self.length = length
+        self.memory_mask = memory_mask
+        self.pad = pad
+
+    def truncate(self, length):
+        return DecoderCache(
+            self.memory_kv,
+            [k[:, :, :length] if k is not None else None for k in self.keys],
+            [v[:, :, :length] if v is not None else None for v in self.values],
+            min(length, self.length),
+            self.memory_mask,
+            self.pad,
+        )
+
+    def expand(self, batch, pad=None):
+        """빈 캐시의 메모리 key/value를 batch 행으로 넓힘 (복사 없이 view)"""
+        if self.length:
+            raise ValueError("expand는 비어 있는 캐시에만 쓸 수 있습니다")
+        memory_kv = [(k.expand(batch, -1, -1, -1), v.expand(batch, -1, -1, -1)) for k, v in self.memory_kv]
+        memory_mask = self.memory_mask.expand(batch, -1, -1, -1) if self.memory_mask is not None else None
+        return DecoderCache(memory_kv, memory_mask=memory_mask, pad=pad)
+
+    def select(self, rows):
+        """빈 캐시에서 메모리 행을 골라 새 배치를 만듦 (rows: 행마다 원래 메모리 번호, 같은 번호 반복 가능)"""
+        if self.length:
+            raise ValueError("select는 비어 있는 캐시에만 쓸 수 있습니다")
+        index = torch.as_tensor(rows, dtype=torch.long, device=self.memory_kv[0][0].device)
+        memory_kv = [(k.index_select(0, index), v.index_select(0, index)) for k, v in self.memory_kv]
+        memory_mask = self.memory_mask.index_select(0, index) if self.memory_mask is not None else None
+        return DecoderCache(memory_kv, memory_mask=memory_mask)
+
+    def reorder(self, rows):
+        """캐시(채워진 것 포함)의 행을 rows 순서로 골라 새 캐시를 만듦 (빔 탐색에서 살아남은 빔 따라가기)"""
+        index = torch.as_tensor(rows, dtype=torch.long, device=self.memory_kv[0][0].device)
+
+        def pick(x):
+            return x.index_select(0, index) if x is not None else None
+        return DecoderCache(
+            [(pick(k), pick(v)) for k, v in self.memory_kv],
+            [pick(k) for k in self.keys],
+            [pick(v) for v in self.values],
+            self.length,
+            pick(self.memory_mask),
+            pick(self.pad),
+        )
+
+    def repeat(self, times):
+        """모든 행을 times번 이어 붙인 새 캐시 (행 순서: 원래 배치 전체가 times번 반복)"""
+        def tile(x):
+            return x.repeat(times, *([1] * (x.dim() - 1))) if x is not None else None
+        return DecoderCache(
+            [(tile(k), tile(v)) for k, v in self.memory_kv],
+            [tile(k) for k in self.keys],
+            [tile(v) for v in self.values],
+            self.length,
+            tile(self.memory_mask),
+            tile(self.pad),
+        )
+
+
+class TransformerModel(nn.Module):
+    def __init__(self, vocab_size, embed_dim, num_heads, num_layers, max_seq_len, tie_embeddings=False):
+        super(TransformerModel, self).__init__()
+        self.embedding = nn.Embedding(vocab_size, embed_dim)
+        self.positional_encoding = nn.Parameter(torch.zeros(1, max_seq_len, embed_dim))
+        self.transformer = nn.Transformer(
+            d_model=embed_dim,
+            nhead=num_heads,
+            num_encoder_layers=num_layers,
+            num_decoder_layers=num_layers,
+            batch_first=True
+        )
+        self.fc_out = nn.Linear(embed_dim, vocab_size)
+        if tie_embeddings:
+            # 입력 임베딩과 출력층이 같은 (vocab, embed_dim) 가중치를 공유 (체크포인트 'tie_embeddings')
+            self.fc_out.weight = self.embedding.weight
+        self.tie_embeddings = tie_embeddings
+        self.num_heads = num_heads
+        self.max_seq_len = max_seq_len
+        # 체크포인트의 'causal' / 'padding_mask' 값 (load 쪽에서 설정)
+        self.causal = False
+        self.padding_mask = False
+
+    @property
+    def device(self):
+        return self.embedding.weight.device
+
+    def _embed(self, tokens, start=0, pad=None):
+        last = self.positional_encoding.size(1) - 1
+        if pad is None and start + tokens.size(1) <= last + 1:
+            return self.embedding(tokens) + self.positional_encoding[:, start:start + tokens.size(1), :]
+        positions = decoder_positions(start, tokens.size(1), last, pad, tokens.device)
+        return self.embedding(tokens) + self.positional_encoding[0, positions]
+
+    def forward(self, src, tgt, tgt_mask=None, src_key_padding_mask=None, tgt_key_padding_mask=None):
+        """
+        src_key_padding_mask / tgt_key_padding_mask: padding_mask() 결과 (B, S) / (B, T)
+        소스 마스크는 인코더 self-attention과 디코더 cross-attention에 같이 쓰임
+        """
+        output = self.transformer(
+            self._embed(src), self._embed(tgt),
+            tgt_mask=tgt_mask,
+            src_key_padding_mask=src_key_padding_mask,
+            tgt_key_padding_mask=tgt_key_padding_mask,
+            memory_key_padding_mask=src_key_padding_mask,
+        )
+        return self.fc_out(output)
+
+    def encode(self, src, src_key_padding_mask=None):
+        """인코더 메모리 (B, S, E)"""
+        return self.transformer.encoder(self._embed(src), src_key_padding_mask=src_key_padding_mask)
+
+    def decode(self, tgt, memory, tgt_mask=None, tgt_key_padding_mask=None, memory_key_padding_mask=None):
+        """디코더 전체 실행 -> (B, T, vocab) 로짓"""
+        return self.fc_out(self.transformer.decoder(
+            self._embed(tgt), memory,
+            tgt_mask=tgt_mask,
+            tgt_key_padding_mask=tgt_key_padding_mask,
+            memory_key_padding_mask=memory_key_padding_mask,
+        ))
+
+    # ---------- 증분 디코딩 ----------
+
+    def _split_heads(self, x):
+        batch, length, dim = x.shape
+        return x.view(batch, length, self.num_heads, dim // self.num_heads).transpose(1, 2)
+
+    def _merge_heads(self, x):
+        batch, _, length, head_dim = x.shape
+        return x.transpose(1, 2).reshape(batch, length, self.num_heads * head_dim)
+
+    def init_cache(self, memory, memory_key_padding_mask=None):
+        """
+        메모리의 cross-attention key/value를 층마다 한 번만 계산
+        memory_key_padding_mask: encode에 넣은 padding_mask() 결과 (B, S) (배치 소스 길이가 다를 때)
+        """
+        memory_mask = memory_key_padding_mask[:, None, None, :] if memory_key_padding_mask is not None else None
+        return DecoderCache(self._memory_kv(memory), memory_mask=memory_mask)
+
+    def _memory_kv(self, memory):
+        """층마다 (key, value) (B, heads, S, head_dim)"""
+        dim = memory.size(-1)
+        memory_kv = []
+        for layer in self.transformer.decoder.layers:
+            attn = layer.multihead_attn
+            k = F.linear(memory, attn.in_proj_weight[dim:2 * dim], attn.in_proj_bias[dim:2 * dim])
+            v = F.linear(memory, attn.in_proj_weight[2 * dim:], attn.in_proj_bias[2 * dim:])
+            memory_kv.append((self._split_heads(k), self._split_heads(v)))
+        return memory_kv
+
+    def decode_step(self, tokens, cache):
+        """
+        새 토큰들(B, T)만 디코더에 통과시켜 (B, T, vocab) 로짓 반환
+        앞 위치는 cache의 key/value를 쓰고, 새 위치의 key/value는 cache에 추가된다
+        (T > 1이면 prefix를 한 번에 넣는 것, 새 토큰끼리도 인과 마스크 적용)
+        """
+        start = cache.length
+        length = tokens.size(1)
+        x = self._embed(tokens, start, cache.pad)
+        allowed = step_attention_mask(start, length, cache.pad, x.device)
+        logits, cache.keys[:], cache.values[:] = self._step_layers(
+            x, cache.keys, cache.values, cache.memory_kv, allowed, cache.memory_mask)
+        cache.length = start + length
+        return logits
+
+    def _step_layers(self, x, past_keys, past_values, memory_kv, allowed, memory_mask=None):
+        """
+        decode_step의 디코더 층 계산 (임베딩된 새 토큰 x (B, T, E))
+        past_keys/past_values: 층마다 앞 위치의 key/value (없으면 None)
+        반환: ((B, T, vocab) 로짓, 층마다 앞 + 새 위치 key 목록, value 목록)
+        """
+        dim = x.size(-1)
+        keys, values = [], []
+        for i, layer in enumerate(self.transformer.decoder.layers):
+            # self-attention (post-norm, nn.TransformerDecoderLayer와 같은 순서)
+            attn = layer.self_attn
+            q, k, v = F.linear(x, attn.in_proj_weight, attn.in_proj_bias).chunk(3, dim=-1)
+            q, k, v = self._split_heads(q), self._split_heads(k), self._split_heads(v)
+            if past_keys[i] is not None:
+                k = torch.cat([past_keys[i], k], dim=2)
+                v = torch.cat([past_values[i], v], dim=2)
+            keys.append(k)
+            values.append(v)
+            out = F.scaled_dot_product_attention(q, k, v, attn_mask=allowed)
+            x = layer.norm1(x + attn.out_proj(self._merge_heads(out)))
+
+            # cross-attention (메모리 key/value는 init_cache에서 계산됨)
+            attn = layer.multihead_attn
+            q = self._split_heads(F.linear(x, attn.in_proj_weight[:dim], attn.in_proj_bias[:dim]))
+            memory_k, memory_v = memory_kv[i]
+            out = F.scaled_dot_product_attention(q, memory_k, memory_v, attn_mask=memory_mask)
+            x = layer.norm2(x + attn.out_proj(self._merge_heads(out)))
+
+            # feed-forward
+            x = layer.norm3(x + layer.linear2(layer.activation(layer.linear1(x))))
+
+        if self.transformer.decoder.norm is not None:
+            x = self.transformer.decoder.norm(x)
+        return self.fc_out(x), keys, values
+
+    @torch.no_grad()
+    def prefill(self, cache, prefixes, pad_idx):
+        """
+        길이가 다른 prefix(토큰 id 목록) 여러 개를 왼쪽 패딩해 한 번의 decode_step으로 넣음
+        cache: init_cache(memory) 결과 (빈 캐시, 메모리는 모든 행이 공유)
+        반환: (배치 캐시, 행마다 마지막 위치의 로짓 (B, vocab))
+        """
+        tokens, pad = self._left_pad(prefixes, pad_idx)
+        batch = cache.expand(len(prefixes), pad)
+        return batch, self.decode_step(tokens, batch)[:, -1]
+
+    def _left_pad(self, sequences, pad_idx):
+        """토큰 id 목록들 -> 왼쪽 패딩한 (B, 최대 길이) 텐서, 행마다 패딩 개수 (B,)"""
+        width = max(len(sequence) for sequence in sequences)
+        device = self.device
+        tokens = torch.tensor([[pad_idx] * (width - len(sequence)) + list(sequence) for sequence in sequences],
+                              dtype=torch.long, device=device)
+        pad = torch.tensor([width - len(sequence) for sequence in sequences], dtype=torch.long, device=device)
+        return tokens, pad
+
+    @torch.no_grad()
+    def generate_batch(self, cache, logits, eos_idx, choose=None, max_new_tokens=None):
+        """
+        배치의 모든 행을 한 스텝에 한 번의 decode_step으로 같이 생성
+        cache: prefix가 모두 들어간 캐시 (prefill 결과 등), logits: 마지막 위치의 로짓 (B, vocab)
+        choose: 로짓(B, vocab) -> 토큰 id (B,) 함수 (기본 greedy)
+        max_new_tokens: 정수 또는 행마다 다른 값 (B,)
+        행은 <EOS>가 나오거나 길이 한도에 닿으면 끝나고, 모든 행이 끝나면 멈춤
+        반환: 행마다 생성된 토큰 id 목록 (<EOS> 제외)
+        """
+        choose = choose or (lambda step_logits: step_logits.argmax(dim=-1))
+        batch = logits.size(0)
+        device = logits.device
+        if cache.pad is None:
+            lengths = torch.full((batch,), cache.length, dtype=torch.long, device=device)
+        else:
+            lengths = cache.length - cache.pad
+        limit = torch.full((batch,), self.max_seq_len - 1, dtype=torch.long, device=device)
+        if max_new_tokens is not None:
+            limit = torch.minimum(limit, lengths + torch.as_tensor(max_new_tokens, device=device))
+
+        steps = []
+        done = lengths >= limit
+        while not bool(done.all()):
+            tokens = choose(logits)
+            stop = done | (tokens == eos_idx)
+            steps.append(torch.where(stop, torch.full_like(tokens, eos_idx), tokens))
+            lengths = lengths + 1
+            done = stop | (lengths >= limit)
+            if bool(done.all()):
+                break
+            logits = self.decode_step(tokens[:, None], cache)[:, -1]
+
+        if not steps:
+            return [[] for _ in range(batch)]
+        generated = []
+        for row in torch.stack(steps, dim=1).tolist():
+            generated.append(row[:row.index(eos_idx)] if eos_idx in row else row)
+        return generated
+
+    @torch.no_grad()
+    def speculate_batch(self, cache, prefixes, drafts, pad_idx, eos_idx, choose=None, max_new_tokens=None):
+        """
+        추측 디코딩: 행마다 prefix 뒤에 초안(draft) 토큰을 이어 붙여 한 번의 decode_step으로 모든 위치를 검증
+        choose가 고른 토큰과 초안이 앞에서부터 일치하는 만큼 받아들이고, 처음 어긋난 위치에서는 모델이 고른 토큰을 씀
+        초안이 <EOS>까지 받아들여진 행은 그걸로 끝이고, 어긋난 행이 있을 때만 받아들인 부분까지 다시 prefill해서
+        generate_batch로 이어 생성 (초안이 맞으면 forward 1번, 아니면 2번 + 남은 토큰 수)
+        cache: 행이 prefixes와 같은 수이거나 1개인 빈 캐시 (init_cache, select, repeat 결과), prefix는 1개 이상의 토큰
+        choose: 로짓(B, ..., vocab) -> 토큰 id (B, ...) 함수 (기본 greedy, greedy면 generate_batch와 같은 토큰열)
+        max_new_tokens: 정수 또는 행마다 다른 값 목록 (prefix 뒤로 생성할 최대 토큰 수)
+        반환: (행마다 생성된 토큰 id 목록 (<EOS> 제외), 행마다 받아들인 초안 토큰 수)
+        """
+        choose = choose or (lambda step_logits: step_logits.argmax(dim=-1))
+        batch = len(prefixes)
+        if max_new_tokens is None or isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * batch
+        limits = [min(self.max_seq_len - 1, len(prefix) + (self.max_seq_len if extra is None else int(extra)))
+                  for prefix, extra in zip(prefixes, max_new_tokens)]
+        drafts = [list(draft)[:max(0, limit - len(prefix))] for prefix, draft, limit in zip(prefixes, drafts, limits)]
+
+        # 검증: prefix + 초안을 한 번에 넣고, 초안 각 위치(와 초안 다음 위치)에서 모델이 고를 토큰
+        tokens, pad = self._left_pad([list(prefix) + draft for prefix, draft in zip(prefixes, drafts)], pad_idx)
+        picks = choose(self.decode_step(tokens, cache.expand(batch, pad))).tolist()
+
+        generated, accepted, finished = [], [], []
+        for row, (prefix, draft, limit) in enumerate(zip(prefixes, drafts, limits)):
+            start = int(pad[row]) + len(prefix) - 1  # prefix 마지막 위치 = 초안 첫 토큰을 예측하는 위치
+            predicted = picks[row][start:start + len(draft) + 1]
+            count = 0
+            while count < len(draft) and predicted[count] == draft[count]:
+                count += 1
+            tokens_out = draft[:count]
+            if eos_idx in tokens_out:
+                tokens_out = tokens_out[:tokens_out.index(eos_idx)]
+                done = True
+            else:
+                # 어긋난 위치 (또는 초안 다음 위치)는 모델이 고른 토큰 (길이 한도에 이미 닿았으면 거기서 끝)
+                done = len(prefix) + len(tokens_out) >= limit
+                if not done:
+                    correction = predicted[count]
+                    done = correction == eos_idx
+                    if not done:
+                        tokens_out.append(correction)
+                done = done or len(prefix) + len(tokens_out) >= limit
+            generated.append(tokens_out)
+            accepted.append(count)
+            finished.append(done)
+
+        if all(finished):
+            return generated, accepted
+
+        # 어긋난 행만 이어 생성 (배치 모양은 유지, 끝난 행은 생성 한도 0)
+        continued = [list(prefix) + tokens_out for prefix, tokens_out in zip(prefixes, generated)]
+        remaining = [0 if done else limit - len(sequence)
+                     for done, limit, sequence in zip(finished, limits, continued)]
+        rows, logits = self.prefill(cache, continued, pad_idx)
+        for tokens_out, done, extra in zip(generated, finished,
+                                           self.generate_batch(rows, logits, eos_idx, choose, remaining)):
+            if not done:
+                tokens_out.extend(extra)
+        return generated, accepted
+
+    @torch.no_grad()
+    def beam_search(self, cache, prefixes, pad_idx, eos_idx, beam_width=4, max_new_tokens=None,
+                    length_penalty=1.0, no_repeat_ngram=3):
+        """
+        prefix마다 빔 beam_width개를 (prefix 수 x beam_width) 한 배치로 두고 한 스텝에 decode_step 한 번으로 탐색
+        후보 점수는 로그 확률 합 / (생성 길이 ** length_penalty), 모든 빔이 <EOS>에 닿으면 일찍 멈춤
+        no_repeat_ngram: prefix를 포함해 이미 나온 n-gram을 다시 만드는 토큰을 막음 (0이면 끄기)
+        cache: prefill 전의 빈 캐시 (행 1개 또는 prefixes와 같은 수)
+        max_new_tokens: 정수 또는 행마다 다른 값 목록
+        반환: prefix마다 [(토큰 id 목록 (<EOS> 제외), 정규화 점수)] (점수 높은 순, beam_width개)
+        """
+        batch = len(prefixes)
+        width = beam_width
+        cache, logits = self.prefill(cache, prefixes, pad_idx)
+        device = logits.device
+        vocab = logits.size(-1)
+
+        if max_new_tokens is None or isinstance(max_new_tokens, int):
+            max_new_tokens = [self.max_seq_len if max_new_tokens is None else max_new_tokens] * batch
+        limits = torch.tensor([max(0, min(self.max_seq_len - 1 - len(prefix), int(extra)))
+                               for prefix, extra in zip(prefixes, max_new_tokens)], device=device)
+
+        # 빔 행 순서: prefix 0의 빔 전체, prefix 1의 빔 전체, ... (처음엔 첫 빔만 살아 있음)
+        rows = torch.arange(batch, device=device).repeat_interleave(width)
+        cache = cache.reorder(rows)
+        logits = logits.index_select(0, rows)
+        limits = limits.index_select(0, rows)
+        scores = torch.full((batch, width), float('-inf'), device=device)
+        scores[:, 0] = 0.0
+        scores = scores.view(-1)
+        lengths = torch.zeros(batch * width, dtype=torch.long, device=device)
+        finished = limits <= 0
+        histories = [list(prefixes[int(row)]) for row in rows.tolist()]
+        generated = [[] for _ in histories]
+
+        while not bool(finished.all()):
+            log_probs = F.log_softmax(logits.float(), dim=-1)
+            if no_repeat_ngram > 0:
+                for beam, history in enumerate(histories):
+                    banned = [token for token in _banned_tokens(history, no_repeat_ngram) if token != eos_idx]
+                    if banned:
+                        log_probs[beam, banned] = float('-inf')
+            # 끝난 빔은 <EOS>만 점수 변화 없이 이어짐 (길이도 그대로)
+            log_probs[finished] = float('-inf')
+            log_probs[finished, eos_idx] = 0.0
+            # 이미 한도만큼 생성한 빔은 <EOS>로만 끝낼 수 있음 (generate_batch와 같은 길이)
+            at_limit = ~finished & (lengths >= limits)
+            log_probs.masked_fill_(at_limit[:, None] & (torch.arange(vocab, device=device) != eos_idx)[None],
+                                   float('-inf'))
+
+            totals = scores[:, None] + log_probs
+            new_lengths = lengths + (~finished).long()
+            normalized = totals / new_lengths.clamp(min=1).float()[:, None] ** length_penalty
+            top = normalized.view(batch, width * vocab).topk(width, dim=-1)
+            origin = (top.indices // vocab + torch.arange(batch, device=device)[:, None] * width).view(-1)
+            tokens = (top.indices % vocab).view(-1)
+
+            scores = totals.view(-1)[origin * vocab + tokens]
+            lengths = new_lengths.index_select(0, origin)
+            was_finished = finished.index_select(0, origin)
+            finished = was_finished | (tokens == eos_idx)
+            limits = limits.index_select(0, origin)
+            origin_list, token_list = origin.tolist(), tokens.tolist()
+            done_list = was_finished.tolist()
+            histories = [histories[o] + ([] if done else [t]) for o, t, done in zip(origin_list, token_list, done_list)]
+            generated = [generated[o] + ([] if done or t == eos_idx else [t])
+                         for o, t, done in zip(origin_list, token_list, done_list)]
+            if bool(finished.all()):
+                break
+            cache = cache.reorder(origin)
+            logits = self.decode_step(tokens[:, None], cache)[:, -1]
+
+        final = (scores / lengths.clamp(min=1).float() ** length_penalty).view(batch, width).tolist()
+        results = []
+        for b in range(batch):
+            beams = [(generated[b * width + i], final[b][i]) for i in range(width)]
+            results.append(sorted(beams, key=lambda beam: -beam[1]))
+        return results
+
+    @torch.no_grad()
+    def stream(self, cache, prefix, eos_idx, choose=None, max_new_tokens=None):
+        """
+        prefix 다음 토큰을 하나씩 생성하면서 바로 yield (<EOS>나 길이 한도에서 끝, <EOS>는 내보내지 않음)
+        cache: init_cache(memory) (빈 캐시), choose: 로짓(1, vocab) -> 토큰 id (1,) 함수 (기본 greedy)
+        generate와 같은 토큰열을 내지만 첫 토큰이 prefix 계산 직후에 나온다
+        """
+        choose = choose or (lambda step_logits: step_logits.argmax(dim=-1))
+        device = self.device
+        logits = self.decode_step(torch.tensor([list(prefix)], dtype=torch.long, device=device), cache)[:, -1]
+        length = len(prefix)
+        limit = self.max_seq_len - 1
+        if max_new_tokens is not None:
+            limit = min(limit, length + max_new_tokens)
+        while length < limit:
+            token = int(choose(logits)[0])
+            if token == eos_idx:
+                return
+            yield token
+            length += 1
+            if length >= limit:
+                return
+            logits = self.decode_step(torch.tensor([[token]], dtype=torch.long, device=device), cache)[:, -1]
+
+    @torch.no_grad()
+    def generate(self, cache, prefix, eos_idx, choose=None, max_new_tokens=None, logits=None):
+        """
+        prefix(토큰 id 목록) 다음을 <EOS>가 나오거나 길이 한도까지 생성
+        cache: init_cache(memory) 또는 prefix 일부가 이미 들어간 캐시 (truncate로 나눠 쓸 수 있음)
+        logits: cache에 prefix 전체가 이미 들어 있을 때 마지막 위치의 로짓 (없으면 남은 prefix를 계산)
+        choose: 로짓(1, vocab) -> 토큰 id (1,) 함수 (기본 greedy)
+        반환: 생성된 토큰 id 목록 (<EOS> 제외)
+        """
+        if logits is None:
+            pending = prefix[cache.length:]
+            device = self.device
+            logits = self.decode_step(torch.tensor([pending], dtype=torch.long, device=device), cache)[0, -1]
+        return self.generate_batch(cache, logits[None], eos_idx, choose, max_new_tokens)[0]
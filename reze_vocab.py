@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+# reze_vocab.py - 학습/데이터 컴파일/추론이 같이 쓰는 어휘 사전과 토크나이저
+# 데이터에 실제로 나오는 기호만 어휘로 쓰고 (정렬 순서로 id), 특수 토큰 <PAD>, <EOS>를 더한다.
+#
+# 토크나이저 (텍스트 -> 기호 목록)
+#   char : 문자 하나가 기호 하나 (기본, 예전 create_proper_vocab와 같은 어휘)
+#   jamo : 한글 음절을 초성/중성/종성 자모로 분해 (NFD), 나머지 문자는 그대로
+#          -> 수천 개 음절 대신 자모 67개 정도로 한글 전체를 표현
+#   byte : UTF-8 바이트 (<0x00>..<0xFF> 중 나오는 것만), 어떤 문자도 어휘 밖으로 나가지 않음
+#
+# 사용법: python3 reze_vocab.py [dataset.json]  (토크나이저/가중치 공유별 파라미터 수, 체크포인트 크기, softmax 비용 비교)
+
+import io
+import json
+import sys
+import unicodedata
+
+SPECIAL_TOKENS = ('<PAD>', '<EOS>')
+TOKENIZERS = ('char', 'jamo', 'byte')
+
+
+def _check(tokenizer):
+    if tokenizer not in TOKENIZERS:
+        raise ValueError(f"알 수 없는 토크나이저: {tokenizer} (가능: {', '.join(TOKENIZERS)})")
+
+
+def tokenize(text, tokenizer='char'):
+    """텍스트 -> 기호(문자열) 목록"""
+    _check(tokenizer)
+    if tokenizer == 'char':
+        return list(text)
+    if tokenizer == 'jamo':
+        return list(unicodedata.normalize('NFD', text))
+    return [f"<0x{b:02X}>" for b in text.encode('utf-8')]
+
+
+def detokenize(symbols, tokenizer='char'):
+    """기호 목록 -> 텍스트 (특수 토큰은 버림, 잘린 바이트/자모는 가능한 만큼 복원)"""
+    _check(tokenizer)
+    symbols = [s for s in symbols if s not in SPECIAL_TOKENS]
+    if tokenizer == 'char':
+        return ''.join(symbols)
+    if tokenizer == 'jamo':
+        return unicodedata.normalize('NFC', ''.join(symbols))
+    return bytes(int(s[3:5], 16) for s in symbols).decode('utf-8', errors='ignore')
+
+
+def build_vocab(dataset, tokenizer='char'):
+    """실제 데이터에서 쓰이는 기호 + 특수 토큰 (정렬 순서, 위치가 id)"""
+    symbols = set()
+    for item in dataset:
+        symbols.update(tokenize(item['input'], tokenizer))
+        symbols.update(tokenize(item['label'], tokenizer))
+    symbols.update(SPECIAL_TOKENS)
+    return sorted(symbols)
+
+
+def create_proper_vocab(dataset, tokenizer='char'):
+    """실제 데이터에서 사용되는 기호들만으로 어휘 사전 생성 -> (char_to_idx, idx_to_char, vocab_size)"""
+    vocab = build_vocab(dataset, tokenizer)
+    char_to_idx = {char: idx for idx, char in enumerate(vocab)}
+    idx_to_char = {idx: char for idx, char in enumerate(vocab)}
+    return char_to_idx, idx_to_char, len(vocab)
+
+
+def vocab_report(dataset, embed_dim=128, num_heads=8, num_layers=4, max_seq_len=50):
+    """
+    어휘 방식별 모델 크기 비교
+    legacy(ord 코드포인트, train_model.py 예전 방식) / char / jamo / byte x 가중치 공유 여부
+    softmax_macs: 출력 토큰 하나당 fc_out 곱셈 수 (vocab x embed_dim),
+    softmax_macs_per_text: 텍스트 하나(label)를 만드는 데 드는 양 (평균 토큰 수 x softmax_macs)
+    """
+    import torch
+
+    from reze_model import TransformerModel
+
+    def label_tokens(tokenizer):
+        total = sum(min(len(item['label']) if tokenizer is None else len(tokenize(item['label'], tokenizer)),
+                        max_seq_len) for item in dataset)
+        return total / max(len(dataset), 1)
+
+    max_ord = max(ord(c) for item in dataset for c in item['input'] + item['label'])
+    configs = [('legacy-ord', None, max(11172, max_ord + 1))]
+    configs += [(tokenizer, tokenizer, len(build_vocab(dataset, tokenizer))) for tokenizer in TOKENIZERS]
+
+    report = []
+    for name, tokenizer, vocab_size in configs:
+        for tied in (False, True):
+            if tokenizer is None and tied:
+                continue
+            model = TransformerModel(vocab_size, embed_dim, num_heads, num_layers, max_seq_len, tie_embeddings=tied)
+            buffer = io.BytesIO()
+            torch.save(model.state_dict(), buffer)
+            tokens = label_tokens(tokenizer)
+            report.append({
+                'vocab': name,
+                'tied': tied,
+                'vocab_size': vocab_size,
+                'parameters': sum(p.numel() for p in model.parameters()),
+                'checkpoint_bytes': buffer.tell(),
+                'softmax_macs': vocab_size * embed_dim,
+                'tokens_per_label': round(tokens, 1),
+                'softmax_macs_per_text': round(vocab_size * embed_dim * tokens),
+            })
+    return report
+
+
+if __name__ == "__main__":
+    from compiled_dataset import load_dataset_fast
+
+    path = sys.argv[1] if len(sys.argv) > 1 else './dataset.json'
+    report = vocab_report(load_dataset_fast(path))
+    print(f"{'vocab':>11} {'tied':>5} {'size':>6} {'params':>11} {'ckpt MB':>8} {'softmax/tok':>12} {'tok/label':>9} {'softmax/text':>13}")
+    for row in report:
+        print(f"{row['vocab']:>11} {str(row['tied']):>5} {row['vocab_size']:>6} {row['parameters']:>11,} "
+              f"{row['checkpoint_bytes'] / 1e6:>8.2f} {row['softmax_macs']:>12,} {row['tokens_per_label']:>9} "
+              f"{row['softmax_macs_per_text']:>13,}")
+    print(json.dumps(report))
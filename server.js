@@ -1,5 +1,6 @@
 import express from 'express';
-import { exec } from 'child_process';
+import { exec, spawn } from 'child_process';
+import readline from 'readline';
 
 const app = express();
 const port = 3000;
@@ -23,7 +24,7 @@ app.use(express.json());
 
 // /train 엔드포인트
 app.post('/train', (req, res) => {
-    const { model, dataset, epochs, learning_rate } = req.body;
+    const { model, dataset, epochs, learning_rate, training_mode, tokenizer, tie_embeddings, resume, precision, compile } = req.body;
 
     if (!model || !dataset || !epochs || !learning_rate) {
         return res.status(400).json({ error: 'Missing required parameters' });
@@ -33,7 +34,13 @@ app.post('/train', (req, res) => {
         model,
         dataset,
         epochs,
-        learning_rate
+        learning_rate,
+        training_mode, // 'parallel'(기본) 또는 'stepwise' (비교용)
+        tokenizer, // 'char'(기본), 'jamo', 'byte'
+        tie_embeddings,
+        precision, // 'fp32'(기본) 또는 'bf16' (CPU bf16 autocast)
+        compile, // true면 torch.compile (실패하면 eager)
+        resume // true면 최신 체크포인트, 문자열이면 그 파일에서 이어서 학습
     });
 
     exec(`python3 train_model.py '${args}'`, (error, stdout, stderr) => {
@@ -52,48 +59,262 @@ app.post('/train', (req, res) => {
     });
 });
 
+// 요청마다 찍는 디버그 로그는 REZE_DEBUG=1일 때만 (측정은 /metrics, instrumentation.py)
+const DEBUG = !['', '0', undefined].includes(process.env.REZE_DEBUG);
+const debugLog = (...args) => { if (DEBUG) console.log(...args); };
+
+// 상주 Python 예측 워커
+// 메시지마다 프로세스를 새로 띄우지 않고, 데이터셋을 한 번만 로드한 워커에
+// NDJSON 요청을 보낸다. 요청 id로 응답을 짝지으므로 여러 요청이 동시에 진행될 수 있다.
+class PredictionWorker {
+    constructor(script, args = [], timeoutMs = 30000) {
+        this.script = script;
+        this.args = args;
+        this.timeoutMs = timeoutMs;
+        this.pending = new Map();
+        this.nextId = 1;
+        this.proc = null;
+    }
+
+    start() {
+        console.log(`워커 시작: python3 ${this.script} --worker`);
+        const proc = spawn('python3', [this.script, '--worker', ...this.args], {
+            stdio: ['pipe', 'pipe', 'pipe']
+        });
+        this.proc = proc;
+
+        readline.createInterface({ input: proc.stdout }).on('line', (line) => {
+            let result;
+            try {
+                result = JSON.parse(line);
+            } catch (parseError) {
+                console.error('워커 응답 파싱 실패:', line);
+                return;
+            }
+
+            const entry = this.pending.get(result.id);
+            if (!entry) return;
+            if (result.status === 'chunk') {
+                // 스트리밍 조각: 응답이 끝날 때까지 대기 유지, 타임아웃은 조각마다 다시 시작
+                clearTimeout(entry.timer);
+                entry.timer = this.startTimer(result.id, entry.reject);
+                if (entry.onChunk) entry.onChunk(result);
+                return;
+            }
+            this.pending.delete(result.id);
+            clearTimeout(entry.timer);
+            entry.resolve(result);
+        });
+
+        proc.stderr.on('data', (data) => {
+            console.log('Python stderr:', data.toString());
+        });
+
+        // 실행 실패(python3 없음 등)와 죽은 워커에 쓰다 난 EPIPE는 'error'로 오고,
+        // 처리하지 않으면 서버 프로세스가 죽으므로 대기 중인 요청을 실패시키고 다음 요청 때 다시 시작
+        proc.on('error', (error) => {
+            console.error('워커 프로세스 에러:', error);
+            this.fail(proc, new Error(`Prediction worker error: ${error.message}`));
+        });
+        proc.stdin.on('error', (error) => {
+            console.error('워커 stdin 에러:', error);
+            this.fail(proc, new Error(`Prediction worker error: ${error.message}`));
+        });
+
+        proc.on('exit', (code) => {
+            console.error(`워커 종료 (code: ${code})`);
+            this.fail(proc, new Error('Prediction worker exited'));
+        });
+    }
+
+    // 워커 하나가 끝났을 때 한 번만 정리 (이미 새 워커로 바뀌었으면 무시)
+    fail(proc, error) {
+        if (this.proc !== proc) return;
+        this.proc = null;
+        for (const entry of this.pending.values()) {
+            clearTimeout(entry.timer);
+            entry.reject(error);
+        }
+        this.pending.clear();
+        if (proc.exitCode === null && !proc.killed) proc.kill();
+    }
+
+    predict(message) {
+        return this.request({ message });
+    }
+
+    // {"op": "metrics"} 등 관리 요청도 같은 경로로
+    // onChunk: 스트리밍 요청이면 {"status": "chunk"} 줄마다 호출, Promise는 마지막 줄로 resolve
+    // signal: AbortSignal (클라이언트가 끊기면 abort) - 더 기다리지 않고 워커에 {"op": "cancel"}을 보내
+    //         스레드와 대기열 자리를 돌려받음, Promise는 'Request cancelled'로 reject
+    request(payload, onChunk = null, signal = null) {
+        if (!this.proc) {
+            this.start();
+        }
+
+        const id = String(this.nextId++);
+        return new Promise((resolve, reject) => {
+            if (signal && signal.aborted) {
+                return reject(new Error('Request cancelled'));
+            }
+            const timer = this.startTimer(id, reject);
+            this.pending.set(id, { resolve, reject, timer, onChunk });
+            this.proc.stdin.write(JSON.stringify({ id, ...payload }) + '\n');
+            if (signal) {
+                signal.addEventListener('abort', () => this.cancel(id), { once: true });
+            }
+        });
+    }
+
+    // 대기 중인 요청을 버리고 워커에 취소 요청 (이미 끝났으면 무시, 취소 응답은 짝이 없어 버려짐)
+    cancel(id) {
+        const entry = this.pending.get(id);
+        if (!entry) return;
+        this.pending.delete(id);
+        clearTimeout(entry.timer);
+        entry.reject(new Error('Request cancelled'));
+        if (this.proc) {
+            this.proc.stdin.write(JSON.stringify({ id: `cancel-${id}`, op: 'cancel', target: id }) + '\n');
+        }
+    }
+
+    startTimer(id, reject) {
+        return setTimeout(() => {
+            this.pending.delete(id);
+            reject(new Error('Prediction timed out'));
+        }, this.timeoutMs);
+    }
+}
+
+// /chat 예측기: REZE_PREDICTOR=hybrid(기본, 검색 매칭만) 또는 cascade(확신이 낮은 메시지만 학습된 모델로)
+const PREDICTORS = { hybrid: 'predict_hybrid_smart.py', cascade: 'predict_cascade.py' };
+const predictorScript = PREDICTORS[process.env.REZE_PREDICTOR || 'hybrid'];
+if (!predictorScript) {
+    throw new Error(`Unknown REZE_PREDICTOR: ${process.env.REZE_PREDICTOR} (hybrid, cascade)`);
+}
+const predictionWorker = new PredictionWorker(predictorScript);
+predictionWorker.start();
+
+// 학습된 모델 워커 (torch 로드가 무거워서 첫 /chat/enhanced, /chat/stream 요청 때 시작)
+const enhancedWorker = new PredictionWorker('predict_enhanced.py');
+
 // /chat 엔드포인트 - 학습된 모델을 사용해 대화 응답 생성
-app.post('/chat', (req, res) => {
-    console.log('=== /chat 요청 받음 ===');
-    console.log('Request body:', JSON.stringify(req.body, null, 2));
+app.post('/chat', async (req, res) => {
+    debugLog('=== /chat 요청 받음 ===');
+    debugLog('Request body:', JSON.stringify(req.body, null, 2));
     
     const { message } = req.body;
 
     if (!message) {
-        console.log('메시지 누락');
+        debugLog('메시지 누락');
         return res.status(400).json({ error: 'Message is required' });
     }
 
-    console.log('받은 메시지:', message);
-    
-    // Python 스크립트를 호출하여 학습된 모델로 예측 수행
-    const args = JSON.stringify({ message });
-    const command = `python3 predict_hybrid_smart.py '${args}'`;
-    
-    console.log('빠른 Python 명령 실행:', command);
-    
-    exec(command, (error, stdout, stderr) => {
-        if (error) {
-            console.error('Prediction 에러:', error);
-            console.error('stderr:', stderr);
-            return res.status(500).json({ error: 'Prediction failed', details: stderr });
-        }
+    debugLog('받은 메시지:', message);
+
+    try {
+        // 상주 워커에 예측 요청
+        const result = await predictionWorker.predict(message);
+        const { id, ...body } = result;
 
-        console.log('Python stdout:', stdout);
-        if (stderr) {
-            console.log('Python stderr:', stderr);
+        if (body.status !== 'success') {
+            console.error('Prediction 에러:', body.message);
+            return res.status(500).json({ error: 'Prediction failed', details: body.message });
         }
 
-        try {
-            const result = JSON.parse(stdout);
-            console.log('응답 전송:', JSON.stringify(result, null, 2));
-            res.json(result);
-        } catch (parseError) {
-            console.error('JSON 파싱 실패:', parseError);
-            console.error('원본 stdout:', stdout);
-            res.status(500).json({ error: 'Failed to parse prediction result', details: stdout });
+        debugLog('응답 전송:', JSON.stringify(body, null, 2));
+        res.json(body);
+    } catch (error) {
+        console.error('Prediction 에러:', error);
+        res.status(500).json({ error: 'Prediction failed', details: error.message });
+    }
+});
+
+// /chat/enhanced 엔드포인트 - 학습된 모델 응답 (동시 요청은 워커가 마이크로 배치로 묶어 처리)
+// 워커 대기열이 가득 차면 503 + Retry-After
+app.post('/chat/enhanced', async (req, res) => {
+    const { message } = req.body;
+
+    if (!message) {
+        return res.status(400).json({ error: 'Message is required' });
+    }
+
+    try {
+        const result = await enhancedWorker.predict(message);
+        const { id, ...body } = result;
+
+        if (body.status !== 'success') {
+            if (body.retryable) {
+                return res.status(503).set('Retry-After', '1').json({ error: 'Server busy', details: body.message });
+            }
+            console.error('Prediction 에러:', body.message);
+            return res.status(500).json({ error: 'Prediction failed', details: body.message });
         }
+
+        res.json(body);
+    } catch (error) {
+        console.error('Prediction 에러:', error);
+        res.status(500).json({ error: 'Prediction failed', details: error.message });
+    }
+});
+
+// /chat/stream 엔드포인트 - 학습된 모델 응답을 글자가 생성되는 대로 SSE로 전송
+//   event: token  data: {"text": "...", "source": "prefix"(템플릿 원문) 또는 "model"(디코딩), "t_ms": ...}
+//   event: done   data: {"response": "전체 응답",
+//                        "timing": {ttft_ms, ttft_prefix_ms, itl_ms_mean, itl_ms_p95, tokens, total_ms}}
+//   event: error  data: {"error": "..."}
+// ttft_ms는 모델이 디코딩한 첫 글자까지 (템플릿 prefix는 ttft_prefix_ms)
+// 후보 36개 중 고르는 /chat/enhanced와 달리 템플릿 하나로 한 줄만 생성하므로 같은 메시지에도 응답이 다를 수 있음
+// 클라이언트가 끊기면 워커에 취소를 보내고 더 쓰지 않음
+app.post('/chat/stream', async (req, res) => {
+    const { message } = req.body;
+
+    if (!message) {
+        return res.status(400).json({ error: 'Message is required' });
+    }
+
+    res.set({ 'Content-Type': 'text/event-stream', 'Cache-Control': 'no-cache', Connection: 'keep-alive' });
+    res.flushHeaders();
+    const disconnected = new AbortController();
+    res.on('close', () => {
+        if (!res.writableFinished) disconnected.abort();
     });
+    const send = (event, data) => {
+        if (!disconnected.signal.aborted) res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+    };
+
+    try {
+        const result = await enhancedWorker.request({ message, stream: true }, ({ text, source, t_ms }) => {
+            send('token', { text, source, t_ms });
+        }, disconnected.signal);
+        if (result.status !== 'success') {
+            send('error', { error: result.message });
+        } else {
+            send('done', { response: result.response, timing: result.timing });
+        }
+    } catch (error) {
+        if (disconnected.signal.aborted) return;
+        send('error', { error: error.message });
+    }
+    res.end();
+});
+
+// /metrics 엔드포인트 - 예측 워커의 단계별 지연 시간 (Prometheus 텍스트, ?format=json이면 JSON)
+// 워커를 REZE_TRACE_SAMPLE=0.1 등으로 띄워야 값이 쌓임
+app.get('/metrics', async (req, res) => {
+    try {
+        const json = req.query.format === 'json';
+        const result = await predictionWorker.request({ op: json ? 'metrics_json' : 'metrics' });
+        if (result.status !== 'success') {
+            return res.status(500).json({ error: 'Metrics failed', details: result.message });
+        }
+        if (json) {
+            return res.json(result.response);
+        }
+        res.type('text/plain; version=0.0.4').send(result.response);
+    } catch (error) {
+        res.status(500).json({ error: 'Metrics failed', details: error.message });
+    }
 });
 
 // 서버 시작
@@ -0,0 +1,290 @@
+#!/usr/bin/env python3
+# similarity.py - 문자열 유사도 백엔드
+# SequenceMatcher.ratio()를 그대로 쓰는 기본 백엔드와, 더 빠른 근사 백엔드를 골라 쓸 수 있다.
+#
+#   difflib : SequenceMatcher.ratio() (기존과 동일, 기본값)
+#   lcs     : 비트 병렬 LCS 길이로 2*LCS/(len_a+len_b) 계산 (ratio의 상한이자 근사)
+#   ngram   : 미리 만든 문자 바이그램 프로파일의 코사인 유사도
+#
+# 백엔드는 환경변수 REZE_SIMILARITY 또는 get_similarity(name)으로 선택한다.
+# 순위 일치도 확인: python3 similarity.py --parity (같은 기준을 tests/test_similarity.py에서도 확인)
+
+import json
+import math
+import os
+import sys
+from collections import Counter
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+DEFAULT_BACKEND = 'difflib'
+
+
+def quick_ratio_bound(a_counts, b_counts, len_a, len_b):
+    """문자 다중집합 교집합으로 구한 ratio 상한 (SequenceMatcher.quick_ratio와 같은 값)"""
+    length = len_a + len_b
+    if not length:
+        return 1.0
+    if len(a_counts) > len(b_counts):
+        a_counts, b_counts = b_counts, a_counts
+    matches = sum(min(count, b_counts[char]) for char, count in a_counts.items())
+    return 2.0 * matches / length
+
+
+def length_ratio_bound(len_a, len_b):
+    """길이만으로 구한 ratio 상한 (SequenceMatcher.real_quick_ratio와 같은 값)"""
+    length = len_a + len_b
+    return 2.0 * min(len_a, len_b) / length if length else 1.0
+
+
+@lru_cache(maxsize=8192)
+def char_counts(text):
+    """문자 개수 (같은 메시지/데이터셋 입력이 반복해서 들어오므로 캐시)"""
+    return Counter(text)
+
+
+def lcs_length(a, b):
+    """비트 병렬 LCS 길이 (Allison-Dix / Hyyrö), a 길이만큼의 정수 비트벡터 사용"""
+    if not a or not b:
+        return 0
+    if len(a) > len(b):
+        a, b = b, a
+
+    match_masks = {}
+    for i, char in enumerate(a):
+        match_masks[char] = match_masks.get(char, 0) | (1 << i)
+
+    full = (1 << len(a)) - 1
+    v = full
+    for char in b:
+        u = v & match_masks.get(char, 0)
+        v = ((v + u) | (v - u)) & full
+
+    return len(a) - bin(v).count('1')
+
+
+def pruned_ratio(a, b, keep, similarity=None):
+    """
+    상한 가지치기를 거친 ratio
+    keep(상한)이 False를 돌려주면 정확한 계산을 건너뛰고 None 반환
+    real_quick_ratio -> quick_ratio 순서로 상한을 확인하고, 살아남은 경우에만 ratio 계산
+    SequenceMatcher는 difflib 백엔드일 때만 만든다 (lcs는 같은 상한을 캐시한 문자 개수로 계산)
+    """
+    similarity = get_similarity(similarity)
+    if not similarity.quick_ratio_bounded:
+        return similarity.text_ratio(a, b)
+
+    if similarity.name == DEFAULT_BACKEND:
+        matcher = SequenceMatcher(None, a, b)
+        if not keep(matcher.real_quick_ratio()) or not keep(matcher.quick_ratio()):
+            return None
+        return matcher.ratio()
+
+    if not keep(length_ratio_bound(len(a), len(b))):
+        return None
+    if not keep(quick_ratio_bound(char_counts(a), char_counts(b), len(a), len(b))):
+        return None
+    return similarity.text_ratio(a, b)
+
+
+class DifflibSimilarity:
+    """SequenceMatcher.ratio() 그대로 (기존 점수와 동일)"""
+    name = 'difflib'
+    # ratio <= quick_ratio 가 성립하므로 상한 기반 가지치기가 안전함
+    quick_ratio_bounded = True
+
+    def profile(self, text):
+        return None
+
+    def ratio(self, a, b):
+        """a, b: .lower / .char_counts / .profile 속성을 가진 객체 (MatchQuery, MatchEntry)"""
+        return SequenceMatcher(None, a.lower, b.lower).ratio()
+
+    def text_ratio(self, a, b):
+        return SequenceMatcher(None, a, b).ratio()
+
+    def upper_bound(self, a, b):
+        return quick_ratio_bound(a.char_counts, b.char_counts, len(a.lower), len(b.lower))
+
+    def length_bound(self, len_a, len_b):
+        return length_ratio_bound(len_a, len_b)
+
+
+class LcsSimilarity(DifflibSimilarity):
+    """2 * LCS / (len_a + len_b) - SequenceMatcher가 찾는 매칭 블록 합은 LCS를 넘지 않는다"""
+    name = 'lcs'
+
+    def ratio(self, a, b):
+        return self.text_ratio(a.lower, b.lower)
+
+    def text_ratio(self, a, b):
+        length = len(a) + len(b)
+        if not length:
+            return 1.0
+        return 2.0 * lcs_length(a, b) / length
+
+
+class NgramSimilarity:
+    """문자 바이그램(양끝 경계 포함) 프로파일의 코사인 유사도"""
+    name = 'ngram'
+    quick_ratio_bounded = False
+
+    def profile(self, text):
+        """(바이그램 개수, 노름, 가장 많이 나온 바이그램 개수) - 바이그램 총 개수는 len(text) + 1"""
+        padded = f"\x02{text}\x03"
+        grams = Counter(padded[i:i + 2] for i in range(len(padded) - 1))
+        norm = math.sqrt(sum(count * count for count in grams.values()))
+        return grams, norm, max(grams.values())
+
+    def ratio(self, a, b):
+        return self._cosine(a.profile, b.profile)
+
+    def text_ratio(self, a, b):
+        return self._cosine(self.profile(a), self.profile(b))
+
+    def _cosine(self, a_profile, b_profile):
+        a_grams, a_norm, _ = a_profile
+        b_grams, b_norm, _ = b_profile
+        if len(a_grams) > len(b_grams):
+            a_grams, b_grams = b_grams, a_grams
+        dot = sum(count * b_grams[gram] for gram, count in a_grams.items())
+        return dot / (a_norm * b_norm)
+
+    def upper_bound(self, a, b):
+        """
+        바이그램 공통 부분을 보지 않는 상한: dot = sum(a_g * b_g) <= (a의 바이그램 총 개수) * max(b_g)
+        바이그램이 한 번씩만 나오는 보통 문장에서는 sqrt(짧은 쪽 / 긴 쪽 바이그램 수)와 같음
+        """
+        _, a_norm, a_max = a.profile
+        _, b_norm, b_max = b.profile
+        dot_bound = min((len(a.lower) + 1) * b_max, (len(b.lower) + 1) * a_max)
+        return min(1.0, dot_bound / (a_norm * b_norm))
+
+    def length_bound(self, len_a, len_b):
+        """
+        1차 후보(공통 단어/바이그램) 밖 항목의 상한 (MatchIndex 길이 버킷)
+        겹칠 수 있는 바이그램은 양끝 경계 둘(각각 한 번씩)뿐이고, 노름은 sqrt(바이그램 총 개수) 이상
+        """
+        return min(1.0, 2.0 / math.sqrt((len_a + 1) * (len_b + 1)))
+
+
+BACKENDS = {
+    'difflib': DifflibSimilarity,
+    'lcs': LcsSimilarity,
+    'ngram': NgramSimilarity,
+}
+
+_instances = {}
+
+
+def get_similarity(name=None):
+    """이름(또는 REZE_SIMILARITY 환경변수)으로 유사도 백엔드 선택"""
+    if name is None:
+        name = os.environ.get('REZE_SIMILARITY', DEFAULT_BACKEND)
+    if not isinstance(name, str):
+        return name  # 이미 백엔드 객체
+    if name not in BACKENDS:
+        raise ValueError(f"알 수 없는 유사도 백엔드: {name} (사용 가능: {', '.join(BACKENDS)})")
+    if name not in _instances:
+        _instances[name] = BACKENDS[name]()
+    return _instances[name]
+
+
+def _kendall_tau(xs, ys):
+    """순위 상관 (동점 무시 단순 버전)"""
+    concordant = discordant = 0
+    for i in range(len(xs)):
+        for j in range(i + 1, len(xs)):
+            sign = (xs[i] - xs[j]) * (ys[i] - ys[j])
+            if sign > 0:
+                concordant += 1
+            elif sign < 0:
+                discordant += 1
+    total = concordant + discordant
+    return (concordant - discordant) / total if total else 1.0
+
+
+def _pruned_scan(query, texts, similarity, k):
+    """predict_enhanced처럼 모든 입력을 pruned_ratio로 훑어 유사도 상위 k개"""
+    import heapq
+
+    top = []
+
+    def keep(bound):
+        return len(top) < k or bound > top[0]
+
+    for text in texts:
+        ratio = pruned_ratio(query, text, keep, similarity)
+        if ratio is not None and keep(ratio):
+            heapq.heappush(top, ratio)
+            if len(top) > k:
+                heapq.heappop(top)
+    return sorted(top, reverse=True)
+
+
+def parity_report(dataset, backend_names, num_queries=200, k=5):
+    """
+    difflib 기준 순위와 각 백엔드 순위 비교
+    - top1: 1위가 같은 비율
+    - topk_overlap: 상위 k개 겹치는 비율
+    - kendall_tau: difflib 상위 20개 안에서의 점수 순위 상관
+    - ms_per_query: MatchIndex.top_k 평균 소요 시간
+    - scan_ms_per_query: 전체 입력을 pruned_ratio로 훑는 평균 소요 시간 (predict_enhanced 경로)
+    """
+    import time
+    from match_index import MatchIndex
+
+    step = max(1, len(dataset) // num_queries)
+    queries = [item['input'] for item in dataset[::step]][:num_queries]
+    # 데이터셋에 없는 변형 문장도 섞는다 (앞뒤 자르기)
+    queries += [q[1:] for q in queries if len(q) > 3]
+
+    reference = MatchIndex(dataset, similarity='difflib')
+    report = {}
+    for name in backend_names:
+        index = MatchIndex(dataset, similarity=name)
+        top1 = overlap = 0
+        taus = []
+        elapsed = scan_elapsed = 0.0
+        texts = [item['input'].lower().strip() for item in dataset]
+        for query in queries:
+            ref = reference.top_k(query, 20)
+            started = time.perf_counter()
+            got = index.top_k(query, k)
+            elapsed += time.perf_counter() - started
+            ref_ids = [id(c['item']) for c in ref]
+            got_ids = [id(c['item']) for c in got]
+
+            top1 += ref_ids[:1] == got_ids[:1]
+            overlap += len(set(ref_ids[:k]) & set(got_ids)) / k
+
+            started = time.perf_counter()
+            _pruned_scan(query.lower(), texts, index.similarity, k)
+            scan_elapsed += time.perf_counter() - started
+
+            ranked = {id(c['item']): c['score'] for c in index.rank_all(query)}
+            taus.append(_kendall_tau([c['score'] for c in ref], [ranked[i] for i in ref_ids]))
+
+        report[name] = {
+            'queries': len(queries),
+            'top1': round(top1 / len(queries), 4),
+            'topk_overlap': round(overlap / len(queries), 4),
+            'kendall_tau': round(sum(taus) / len(taus), 4),
+            'ms_per_query': round(elapsed * 1000 / len(queries), 3),
+            'scan_ms_per_query': round(scan_elapsed * 1000 / len(queries), 3),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    # 순위 일치도 확인 (difflib 기준)
+    if '--parity' in sys.argv:
+        with open('./dataset.json', 'r', encoding='utf-8') as f:
+            dataset = json.load(f)
+
+        report = parity_report(dataset, list(BACKENDS))
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+
+        # difflib 자신은 완전히 같아야 하고, 근사 백엔드는 1위가 대부분 같아야 함
+        failed = report['difflib']['top1'] < 1.0 or any(r['top1'] < 0.8 for r in report.values())
+        sys.exit(1 if failed else 0)
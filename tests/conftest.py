@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VOCAB_CHARS = list('가나다라마바사아자차카타파하 .?!')
+MAX_SEQ_LEN = 50
+
+
+@pytest.fixture
+def vocab():
+    """<PAD>=0, <EOS>=1 + 한글 몇 글자 (char_to_idx, idx_to_char)"""
+    tokens = ['<PAD>', '<EOS>'] + VOCAB_CHARS
+    return {t: i for i, t in enumerate(tokens)}, {i: t for i, t in enumerate(tokens)}
+
+
+@pytest.fixture
+def tiny_model(vocab):
+    """무작위 초기화한 작은 인과 모델 (결정적 출력을 위해 시드 고정, dropout 끔)"""
+    torch = pytest.importorskip('torch')
+    from reze_model import TransformerModel
+
+    torch.manual_seed(0)
+    model = TransformerModel(len(vocab[0]), 16, 2, 2, MAX_SEQ_LEN)
+    model.eval()
+    model.causal = True
+    model.padding_mask = True
+    return model
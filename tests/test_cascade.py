@@ -0,0 +1,86 @@
+# 검색 → 생성 2단계 예측 테스트 (생성 계층 실패 시 대체)
+
+import pytest
+
+from batch_scheduler import QueueFull
+from instrumentation import metrics
+from predict_cascade import CascadeStats, predict_cascade
+
+DATASET = [
+    {'input': '안녕', 'label': '안녕! 오늘 어땠어?'},
+    {'input': '배고파', 'label': '뭐 먹을래?'},
+    {'input': '잘 자', 'label': '응 잘 자!'},
+]
+
+
+def _failing_generator(message, templates):
+    raise FileNotFoundError('reze_optimized_final.pth')
+
+
+def test_generator_failure_falls_back_to_retrieval(tmp_path):
+    """생성 모델이 없어도 검색 후보로 응답하고 retrieval_fallback과 오류 지표로 남김"""
+    stats = CascadeStats()
+    errors = metrics.errors.get('cascade_generator', 0)
+
+    response = predict_cascade('전혀 다른 메시지', str(tmp_path / 'dataset.json'), DATASET, threshold=1.0,
+                               generate=_failing_generator, stats=stats)
+
+    assert response in {item['label'] for item in DATASET}
+    snapshot = stats.snapshot(1.0)
+    assert snapshot['tiers']['retrieval_fallback']['total'] == 1
+    assert snapshot['tiers']['generator']['total'] == 0
+    assert metrics.errors['cascade_generator'] == errors + 1
+
+
+def test_overload_is_not_masked_by_fallback(tmp_path):
+    """대기열 초과 (QueueFull)는 대체 응답 없이 재시도 오류로 올라감"""
+    def overloaded(message, templates):
+        raise QueueFull('요청 대기열이 가득 참')
+
+    with pytest.raises(QueueFull):
+        predict_cascade('전혀 다른 메시지', str(tmp_path / 'dataset.json'), DATASET, threshold=1.0,
+                        generate=overloaded, stats=CascadeStats())
+
+
+def test_worker_batch_generates_with_the_dataset_its_templates_came_from(tmp_path, monkeypatch):
+    """대기 중에 dataset.json이 다시 로드돼도, 배치는 요청마다 템플릿을 뽑은 데이터셋 세대로 생성"""
+    import json
+    import os
+
+    import predict_cascade
+
+    path = tmp_path / 'dataset.json'
+    path.write_text(json.dumps(DATASET, ensure_ascii=False), encoding='utf-8')
+    submitted, generated, captured = [], [], {}
+
+    class QueuedBatcher:
+        def __init__(self, run_batch, max_batch, max_wait_ms):
+            captured['run_batch'] = run_batch
+
+        def submit(self, item):
+            submitted.append(item)  # 배치는 나중에 직접 실행
+            return item[1][0]['label']
+
+    def record_batch(messages, templates, dataset, loaded_model):
+        generated.append((messages, dataset))
+        return [f'{message}:{len(dataset)}' for message in messages]
+
+    monkeypatch.setattr(predict_cascade, 'MicroBatcher', QueuedBatcher)
+    monkeypatch.setattr(predict_cascade, 'generate_batch', record_batch)
+    monkeypatch.setattr(predict_cascade, 'load_generator', lambda model_path=None: None)
+    monkeypatch.setattr(predict_cascade, 'run_worker', lambda handle_request, argv, min_threads: captured.update(
+        handle_request=handle_request))
+    predict_cascade.run_worker_mode(['--worker'], dataset_path=str(path))
+
+    captured['handle_request']({'message': '전혀 다른 메시지', 'threshold': 1.0})
+    path.write_text(json.dumps(DATASET + [{'input': '고마워', 'label': '천만에!'}], ensure_ascii=False), encoding='utf-8')
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    captured['handle_request']({'message': '또 다른 메시지', 'threshold': 1.0})
+
+    old_dataset, new_dataset = submitted[0][2], submitted[1][2]
+    assert (len(old_dataset), len(new_dataset)) == (3, 4)
+    responses = captured['run_batch'](submitted)
+    assert responses == ['전혀 다른 메시지:3', '또 다른 메시지:4']
+    assert [messages for messages, _ in generated] == [['전혀 다른 메시지'], ['또 다른 메시지']]
+    assert generated[0][1] is old_dataset and generated[1][1] is new_dataset
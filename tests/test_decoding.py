@@ -0,0 +1,131 @@
+import pytest
+
+torch = pytest.importorskip('torch')
+
+from conftest import MAX_SEQ_LEN
+
+PAD, EOS = 0, 1
+
+
+def _greedy_rows(model, message, prefixes, max_new_tokens):
+    memory = model.encode(torch.tensor([message]))
+    cache, logits = model.prefill(model.init_cache(memory), prefixes, PAD)
+    return model.generate_batch(cache, logits, EOS, max_new_tokens=max_new_tokens)
+
+
+def test_mixed_length_batch_decodes_to_max_response_chars(tiny_model, vocab):
+    """긴 prefix(템플릿 34자의 80%)와 짧은 prefix를 같이 생성해도 위치 인코딩을 넘지 않음"""
+    from predict_enhanced import MAX_RESPONSE_CHARS, generate_rows
+
+    char_to_idx, _ = vocab
+    long_prefix = [2 + i % 14 for i in range(40)]
+    prefixes = [[2], [3, 4], long_prefix, [5] * 27]
+    rows = generate_rows(tiny_model, [[2, 3, EOS], [4, EOS]], [prefixes[:2], prefixes[2:]], PAD, EOS, MAX_SEQ_LEN)
+
+    for message_rows, message_prefixes in zip(rows, [prefixes[:2], prefixes[2:]]):
+        for method_rows in message_rows:
+            for row, prefix in zip(method_rows, message_prefixes):
+                assert row[:len(prefix)] == prefix
+                assert len(row) <= max(len(prefix), MAX_RESPONSE_CHARS)
+
+
+def test_left_padded_batch_matches_single_rows(tiny_model):
+    """왼쪽 패딩 배치의 각 행 == 그 prefix만 따로 생성한 결과 (먼저 끝난 행이 계속 스텝을 돌아도)"""
+    message = [2, 3, 4, EOS]
+    prefixes = [[2], [3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, 13, 14, 15, 2, 3]]
+    batched = _greedy_rows(tiny_model, message, prefixes, [MAX_SEQ_LEN, 3])
+    singles = [_greedy_rows(tiny_model, message, [prefix], [limit])[0]
+               for prefix, limit in zip(prefixes, [MAX_SEQ_LEN, 3])]
+    assert batched == singles
+
+
+def test_generation_failure_is_counted(tiny_model, vocab, monkeypatch, capsys):
+    """후보 생성이 실패하면 템플릿으로 대체하되 traceback과 오류 수를 남김"""
+    import predict_enhanced
+    from instrumentation import metrics
+
+    def broken(*args, **kwargs):
+        raise IndexError("boom")
+
+    monkeypatch.setattr(predict_enhanced, 'generate_rows', broken)
+    char_to_idx, idx_to_char = vocab
+    dataset = [{'input': '가나', 'label': '다라마'}]
+    before = metrics.errors.get('enhanced_generate', 0)
+    response = predict_enhanced.predict_with_new_model('가나', tiny_model, char_to_idx, idx_to_char, MAX_SEQ_LEN,
+                                                       dataset, decoding='sample')
+    assert response == '다라마'
+    assert metrics.errors['enhanced_generate'] == before + 1
+    assert 'Traceback' in capsys.readouterr().err
+
+
+def test_speculative_matches_greedy_generate_batch(tiny_model):
+    """greedy choose면 speculate_batch == generate_batch (초안이 맞든, 일부만 맞든, 틀리든, 한도보다 길든)"""
+    message = [2, 3, 4, EOS]
+    prefixes = [[2], [3, 4], [5, 6, 7], [8], [9, 10], [11]]
+    limits = [19, 5, 19, 3, MAX_SEQ_LEN, 10]
+    reference = _greedy_rows(tiny_model, message, prefixes, limits)
+    drafts = [
+        reference[0] + [EOS],                 # 전부 맞음 (<EOS>까지)
+        [7, 7, 7],                            # 첫 토큰부터 어긋남
+        reference[2][:3] + [17, 17, 17],      # 중간에 어긋남
+        reference[3] + [7, 7],                # 한도까지 전부 맞고 초안이 더 김
+        reference[4],                         # <EOS> 없이 전부 맞음
+        [],                                   # 초안 없음
+    ]
+    memory = tiny_model.encode(torch.tensor([message]))
+    generated, accepted = tiny_model.speculate_batch(tiny_model.init_cache(memory), prefixes, drafts, PAD, EOS,
+                                                     max_new_tokens=limits)
+    assert generated == reference
+    assert accepted[0] == len(reference[0]) + 1
+
+
+def test_speculative_full_accept_stops_at_limit(tiny_model):
+    """초안이 한도까지 전부 맞으면 correction 토큰을 더 붙이지 않음"""
+    message = [2, 3, EOS]
+    reference = _greedy_rows(tiny_model, message, [[2]], [4])
+    memory = tiny_model.encode(torch.tensor([message]))
+    generated, _ = tiny_model.speculate_batch(tiny_model.init_cache(memory), [[2]], [reference[0]], PAD, EOS,
+                                              max_new_tokens=[len(reference[0])])
+    assert generated == reference
+
+
+def test_beam_width_one_matches_greedy(tiny_model):
+    """빔 1개, n-gram 금지 없이는 greedy generate_batch와 같은 토큰열 (같은 길이 한도)"""
+    message = [2, 3, 4, EOS]
+    prefixes = [[2], [3, 4], [5, 6, 7], [8], [9, 10]]
+    limits = [19, 5, 19, 3, MAX_SEQ_LEN]
+    reference = _greedy_rows(tiny_model, message, prefixes, limits)
+    memory = tiny_model.encode(torch.tensor([message]))
+    beams = tiny_model.beam_search(tiny_model.init_cache(memory), prefixes, PAD, EOS, beam_width=1,
+                                   max_new_tokens=limits, no_repeat_ngram=0)
+    assert [prefix_beams[0][0] for prefix_beams in beams] == reference
+
+
+def test_beam_search_blocks_repeated_ngrams(tiny_model):
+    """no_repeat_ngram=3이면 prefix를 포함한 어떤 3-gram도 두 번 나오지 않음"""
+    message = [2, 3, 4, EOS]
+    prefixes = [[2], [5, 6, 7]]
+    memory = tiny_model.encode(torch.tensor([message]))
+    beams = tiny_model.beam_search(tiny_model.init_cache(memory), prefixes, PAD, EOS, beam_width=3,
+                                   max_new_tokens=30, no_repeat_ngram=3)
+    for prefix, prefix_beams in zip(prefixes, beams):
+        assert len(prefix_beams) == 3
+        for tokens, _ in prefix_beams:
+            sequence = prefix + tokens
+            trigrams = [tuple(sequence[i:i + 3]) for i in range(len(sequence) - 2)]
+            assert len(trigrams) == len(set(trigrams))
+
+
+def test_parallel_training_uses_the_inference_prefix_convention(tiny_model):
+    """train_model의 parallel 출력 t번째 == predict_enhanced가 labels[:t+1]을 prefill했을 때의 다음 토큰 로짓"""
+    from train_model import parallel_outputs
+
+    inputs = torch.tensor([[2, 3, 4, EOS]])
+    labels = torch.tensor([[5, 6, 7, 8, EOS, PAD]])
+    with torch.no_grad():
+        outputs, targets = parallel_outputs(tiny_model, inputs, labels, 1.0, PAD)
+        assert torch.equal(targets, labels[:, 1:])
+        memory = tiny_model.encode(inputs)
+        for t in range(4):
+            _, logits = tiny_model.prefill(tiny_model.init_cache(memory), [labels[0, :t + 1].tolist()], PAD)
+            torch.testing.assert_close(outputs[0, t], logits[0], rtol=1e-4, atol=1e-5)
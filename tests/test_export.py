@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+import export_model  # noqa: E402
+from conftest import MAX_SEQ_LEN
+
+PAD, EOS = 0, 1
+DATASET = [
+    {'input': '안녕', 'label': '안녕 반가워!'},
+    {'input': '뭐 하니?', 'label': '그냥 있어.'},
+    {'input': '배고파', 'label': '밥 먹자!'},
+    {'input': '잘 자', 'label': '응 잘 자.'},
+]
+
+
+@pytest.fixture
+def checkpoint(tmp_path, tiny_model, vocab):
+    char_to_idx, idx_to_char = vocab
+    path = tmp_path / 'tiny.pth'
+    torch.save({
+        'vocab_size': len(char_to_idx), 'embed_dim': 16, 'num_heads': 2, 'num_layers': 2,
+        'max_seq_len': MAX_SEQ_LEN, 'char_to_idx': char_to_idx, 'idx_to_char': idx_to_char,
+        'causal': True, 'padding_mask': True, 'model_state_dict': tiny_model.state_dict(), 'loss': 0.0,
+    }, path)
+    return str(path)
+
+
+def _generate(model, messages, prefixes, max_new_tokens=20):
+    """길이가 다른 메시지 여러 개를 마스크로 한 배치 인코딩하고, prefix마다 greedy 생성"""
+    width = max(len(message) for message in messages)
+    src = torch.tensor([message + [PAD] * (width - len(message)) for message in messages])
+    src_mask = torch.zeros(src.shape).masked_fill(src == PAD, float('-inf'))
+    with torch.no_grad():
+        memory = model.encode(src, src_key_padding_mask=src_mask)
+        cache, logits = model.prefill(model.init_cache(memory, src_mask), prefixes, PAD)
+        return model.generate_batch(cache, logits, EOS, max_new_tokens=max_new_tokens)
+
+
+def test_fp32_export_matches_eager_model(checkpoint, tmp_path, tiny_model):
+    """양자화 없이 내보내면 증분 디코딩까지 eager 모델과 같은 토큰을 생성"""
+    out = str(tmp_path / 'tiny.pt')
+    config = export_model.export_model(checkpoint, out, quantize=False, dataset=DATASET)
+    assert config['parity'] == {'samples': 4, 'argmax_agreement': 1.0, 'greedy_match': 1.0, 'passed': True}
+
+    exported, _ = export_model.load_exported(out)
+    assert exported.causal
+    messages = [[2, 3, EOS], [4, 5, 6, 7, 8, EOS]]
+    prefixes = [[2], [9, 10, 11]]
+    assert _generate(exported, messages, prefixes) == _generate(tiny_model, messages, prefixes)
+
+
+def test_quantized_export_is_written_and_checked(checkpoint, tmp_path):
+    """INT8 양자화 내보내기도 파일이 만들어지고 동등성 결과가 설정에 남음"""
+    out = str(tmp_path / 'tiny_int8.pt')
+    config = export_model.export_model(checkpoint, out, quantize=True, dataset=DATASET)
+
+    assert os.path.exists(out)
+    assert export_model.read_export_config(out)['parity'] == config['parity']
+    assert config['quantized'] and 0.0 <= config['parity']['argmax_agreement'] <= 1.0
+    exported, _ = export_model.load_exported(out)
+    generated = _generate(exported, [[2, 3, EOS]], [[2]])
+    assert all(0 <= token < 19 for token in generated[0])
+
+
+def test_default_model_path_requires_parity(checkpoint, tmp_path, monkeypatch):
+    """내보낸 파일이 새것이어도 동등성 검사를 통과한 경우에만 체크포인트 대신 고름"""
+    from predict_enhanced import default_model_path
+
+    monkeypatch.chdir(tmp_path)
+    os.replace(checkpoint, export_model.DEFAULT_CHECKPOINT)
+
+    monkeypatch.setattr(export_model, 'PARITY_MIN_AGREEMENT', 1.1)
+    export_model.export_model(export_model.DEFAULT_CHECKPOINT, export_model.DEFAULT_EXPORT, quantize=False,
+                              dataset=DATASET)
+    assert default_model_path() == export_model.DEFAULT_CHECKPOINT
+
+    monkeypatch.setattr(export_model, 'PARITY_MIN_AGREEMENT', 0.95)
+    export_model.export_model(export_model.DEFAULT_CHECKPOINT, export_model.DEFAULT_EXPORT, quantize=False,
+                              dataset=DATASET)
+    assert default_model_path() == export_model.DEFAULT_EXPORT
@@ -0,0 +1,157 @@
+# 워커 요청 처리 테스트 (백프레셔)
+
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import instrumentation
+from prediction_worker import AdmissionLimit, _serve_stream, serve_unix_socket
+
+
+def test_requests_over_max_pending_are_rejected_as_retryable():
+    """스레드 1개, 대기 상한 2개: 막힌 요청 2개 뒤로 들어온 요청은 바로 retryable 오류"""
+    release = threading.Event()
+    lines = [json.dumps({'id': str(i), 'message': '안녕'}) for i in range(5)]
+    written = []
+
+    def read_lines():
+        yield from lines
+        release.set()  # 모든 줄을 읽은 뒤에야 처리 중인 요청이 끝남
+
+    def handle_request(request):
+        release.wait(timeout=5)
+        return request['message']
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        _serve_stream(read_lines, written.append, handle_request, pool, AdmissionLimit(2))
+
+    results = {item['id']: item for item in map(json.loads, written)}
+    assert [results[str(i)]['status'] for i in range(5)] == ['success', 'success', 'error', 'error', 'error']
+    assert all(results[str(i)]['retryable'] for i in range(2, 5))
+    # 거절 응답이 처리 중인 요청보다 먼저 나감 (스레드 풀에 쌓이지 않음)
+    assert [json.loads(line)['id'] for line in written[:3]] == ['2', '3', '4']
+
+
+def test_max_queue_is_shared_across_socket_connections():
+    """대기 상한 2개: 연결 두 개에 하나씩 처리 중이면 세 번째 요청은 어느 연결이든 QueueFull"""
+    max_queue = 2
+    release = threading.Event()
+    started = []
+
+    def handle_request(request):
+        started.append(request['id'])
+        release.wait(timeout=5)
+        return request['message']
+
+    path = os.path.join(tempfile.mkdtemp(), 'worker.sock')
+    pool = ThreadPoolExecutor(max_workers=max_queue)
+    threading.Thread(target=serve_unix_socket, args=(path, handle_request, pool, AdmissionLimit(max_queue)),
+                     daemon=True).start()
+    deadline = time.time() + 5
+    while not os.path.exists(path) and time.time() < deadline:
+        time.sleep(0.01)
+
+    connections = []
+    for _ in range(2):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(path)
+        connections.append((conn, conn.makefile('r', encoding='utf-8')))
+
+    try:
+        for i, (conn, _) in enumerate(connections):
+            conn.sendall((json.dumps({'id': str(i), 'message': '안녕'}) + '\n').encode('utf-8'))
+        while len(started) < max_queue and time.time() < deadline:
+            time.sleep(0.01)
+
+        conn, reader = connections[1]
+        conn.sendall((json.dumps({'id': str(max_queue), 'message': '안녕'}) + '\n').encode('utf-8'))
+        rejected = json.loads(reader.readline())
+        assert rejected['id'] == str(max_queue)
+        assert rejected['status'] == 'error' and rejected['retryable']
+
+        release.set()
+        assert [json.loads(reader.readline())['status'] for _, reader in connections] == ['success', 'success']
+    finally:
+        release.set()
+        for conn, reader in connections:
+            reader.close()
+            conn.close()
+        pool.shutdown(wait=False)
+
+
+def test_cancel_stops_a_stream_between_chunks():
+    """스트리밍 중 cancel 요청이 오면 다음 조각을 만들지 않고 cancelled로 끝남 (제너레이터도 닫힘)"""
+    first_written = threading.Event()
+    produced, closed = [], threading.Event()
+    written = []
+
+    def read_lines():
+        yield json.dumps({'id': 's', 'message': '안녕', 'stream': True})
+        first_written.wait(timeout=5)
+        yield json.dumps({'id': 'c', 'op': 'cancel', 'target': 's'})
+
+    def events():
+        try:
+            for i in range(100):
+                produced.append(i)
+                yield {'type': 'token', 'text': str(i)}
+                if i == 0:
+                    time.sleep(0.2)  # cancel이 첫 조각 뒤에 도착하도록
+        finally:
+            closed.set()
+
+    def write_line(payload):
+        written.append(json.loads(payload))
+        if written[-1].get('status') == 'chunk':
+            first_written.set()
+
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        _serve_stream(read_lines, write_line, lambda request: events(), pool, AdmissionLimit(2))
+
+    statuses = [(item['id'], item['status']) for item in written]
+    assert ('c', 'success') in statuses
+    assert statuses[-1] == ('s', 'cancelled')
+    assert len(produced) < 100 and closed.is_set()
+
+
+def test_cancelled_stream_is_not_counted_as_an_error():
+    """cancel로 스트림 제너레이터가 닫혀도 (GeneratorExit) 요청 오류로 세지 않음"""
+    first_written = threading.Event()
+    closed = threading.Event()
+
+    def read_lines():
+        yield json.dumps({'id': 's', 'message': '안녕', 'stream': True})
+        first_written.wait(timeout=5)
+        yield json.dumps({'id': 'c', 'op': 'cancel', 'target': 's'})
+
+    def events():
+        with instrumentation.request('test_stream'):
+            try:
+                for i in range(100):
+                    yield {'type': 'token', 'text': str(i)}
+                    if i == 0:
+                        time.sleep(0.2)
+            finally:
+                closed.set()
+
+    def write_line(payload):
+        if json.loads(payload).get('status') == 'chunk':
+            first_written.set()
+
+    sample_rate = instrumentation._config['sample_rate']
+    instrumentation.configure(sample_rate=1.0)
+    try:
+        requests_before = instrumentation.metrics.requests.get('test_stream', 0)
+        errors_before = instrumentation.metrics.errors.get('test_stream', 0)
+        with ThreadPoolExecutor(max_workers=1) as pool:
+            _serve_stream(read_lines, write_line, lambda request: events(), pool, AdmissionLimit(2))
+    finally:
+        instrumentation.configure(sample_rate=sample_rate)
+
+    assert closed.is_set()
+    assert instrumentation.metrics.requests.get('test_stream', 0) == requests_before + 1
+    assert instrumentation.metrics.errors.get('test_stream', 0) == errors_before
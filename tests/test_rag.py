@@ -0,0 +1,64 @@
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from rag_reze import SimpleRezeRAG  # noqa: E402
+
+KNOWLEDGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reze_knowledge.txt')
+
+
+@pytest.fixture(scope='module')
+def rag(tmp_path_factory):
+    return SimpleRezeRAG(KNOWLEDGE, mode='vector', index_dir=str(tmp_path_factory.mktemp('rag_index')))
+
+
+def test_vector_search_drops_weak_matches_by_default(rag):
+    """잡담 메시지는 글자 몇 개만 겹치는 passage를 붙이지 않고, 지식 질문은 그대로 찾음"""
+    assert rag.index.search('꿈 꿨어?', 3) == []
+    assert rag.enhance_prompt('꿈 꿨어?') == '꿈 꿨어?'
+    assert rag.index.search('꿈 꿨어?', 3, min_score=0.0)
+    assert '폭탄의 악마' in rag.search('폭탄 악마가 뭐야?')
+
+
+def test_min_score_is_passed_from_rag_config(rag):
+    """SimpleRezeRAG(min_score=...)가 색인 검색 하한으로 넘어감"""
+    strict = SimpleRezeRAG(KNOWLEDGE, mode='vector', index_dir=rag.index.index_dir, min_score=0.9)
+    assert strict.search('폭탄 악마가 뭐야?') == ''
+
+
+def test_reindexing_a_changed_file_keeps_document_frequencies(tmp_path):
+    """바뀐 파일을 다시 추가하면 빠진 passage의 문서 빈도를 빼서, 처음부터 만든 색인과 df/num_docs가 같음"""
+    from rag_vector import VectorIndex
+
+    extra = tmp_path / 'extra.txt'
+    extra.write_text('## 취미\n- 수영을 좋아함\n- 꽃을 좋아함\n', encoding='utf-8')
+    index = VectorIndex(str(tmp_path / 'incremental')).build([KNOWLEDGE, str(extra)])
+    for body in ('- 카페에서 일함\n', '- 폭탄 악마\n- 비 오는 날\n- 공중전화\n'):
+        extra.write_text('## 취미\n' + body, encoding='utf-8')
+        index.add_file(str(extra))
+
+    fresh = VectorIndex(str(tmp_path / 'fresh')).build([KNOWLEDGE, str(extra)])
+    assert index.embedder.num_docs == fresh.embedder.num_docs == len(fresh.passages)
+    assert (index.embedder.df == fresh.embedder.df).all()
+
+
+def test_shrinking_an_ivf_index_drops_stale_clusters(tmp_path):
+    """IVF 색인이 IVF_MIN_PASSAGES 아래로 줄면 ivf.npz를 지우고, 다시 로드해도 정확 검색"""
+    from rag_vector import IVF_MIN_PASSAGES, VectorIndex
+
+    knowledge = tmp_path / 'many.txt'
+    knowledge.write_text('## 항목\n' + ''.join(f'- 항목 {i} 설명 {i * 7}\n' for i in range(400)), encoding='utf-8')
+    index_dir = str(tmp_path / 'ivf_index')
+    index = VectorIndex(index_dir, 'ivf').build([str(knowledge)])
+    assert len(index.passages) >= IVF_MIN_PASSAGES and index.centroids is not None
+
+    knowledge.write_text('## 항목\n- 수영을 좋아함\n- 꽃을 좋아함\n', encoding='utf-8')
+    index.add_file(str(knowledge))
+    assert index.centroids is None
+    assert not os.path.exists(os.path.join(index_dir, 'ivf.npz'))
+
+    reloaded = VectorIndex(index_dir, 'exact').load()
+    assert reloaded.centroids is None and len(reloaded.passages) == 2
+    assert reloaded.search('수영', 1, min_score=0.0)[0][1]['text'] == '- 수영을 좋아함'
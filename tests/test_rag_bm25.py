@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+pytest.importorskip('numpy')
+
+from rag_bm25 import BM25Index, load_or_build_index  # noqa: E402
+from rag_reze import SimpleRezeRAG  # noqa: E402
+
+KNOWLEDGE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'reze_knowledge.txt')
+
+
+@pytest.fixture(scope='module')
+def rag(tmp_path_factory):
+    return SimpleRezeRAG(KNOWLEDGE, mode='bm25', index_dir=str(tmp_path_factory.mktemp('bm25_index')))
+
+
+def test_bm25_search_drops_weak_matches_by_default(rag):
+    """바이그램 한두 개만 겹치는 잡담 메시지는 passage를 붙이지 않고, 지식 질문은 그대로 찾음"""
+    assert rag.index.search('주말에 뭐 할 거야?', 3) == []
+    assert rag.enhance_prompt('주말에 뭐 할 거야?') == '주말에 뭐 할 거야?'
+    assert rag.index.search('주말에 뭐 할 거야?', 3, min_score=0.0)
+    assert '폭탄의 악마' in rag.search('폭탄 악마가 뭐야?')
+
+
+def test_min_score_is_passed_from_rag_config(rag):
+    """SimpleRezeRAG(min_score=...)가 색인 검색 하한으로 넘어감"""
+    loose = SimpleRezeRAG(KNOWLEDGE, mode='bm25', index_dir=rag.index.index_dir, min_score=0.0)
+    assert loose.search('주말에 뭐 할 거야?')
+    strict = SimpleRezeRAG(KNOWLEDGE, mode='bm25', index_dir=rag.index.index_dir, min_score=100.0)
+    assert strict.search('폭탄 악마가 뭐야?') == ''
+
+
+def test_persisted_index_loads_back(rag):
+    """저장된 색인을 다시 로드하면 같은 결과를 내고, 안 바뀐 지식 파일은 다시 색인하지 않음"""
+    query = '덴지가 준 꽃 뭐야?'
+    loaded = BM25Index(rag.index.index_dir).load()
+    assert loaded.terms == rag.index.terms
+    assert loaded.search(query, 3) == rag.index.search(query, 3)
+
+    mtime = os.path.getmtime(os.path.join(rag.index.index_dir, 'meta.json'))
+    reopened = load_or_build_index([KNOWLEDGE], rag.index.index_dir)
+    assert os.path.getmtime(os.path.join(rag.index.index_dir, 'meta.json')) == mtime
+    assert reopened.search(query, 3) == rag.index.search(query, 3)
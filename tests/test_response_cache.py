@@ -0,0 +1,76 @@
+import os
+import time
+
+from response_cache import ResponseCache, normalize_message
+
+
+def _set_mtime(path, offset_ns):
+    """mtime을 확실히 바꿈 (파일 시스템 시각 해상도와 무관하게)"""
+    st = os.stat(path)
+    os.utime(path, ns=(st.st_atime_ns, st.st_mtime_ns + offset_ns))
+
+
+def test_hit_and_miss_counters():
+    """정규화된 메시지 키로 적중, 없는 키는 실패로 셈"""
+    cache = ResponseCache(max_size=4, ttl=None)
+    key = normalize_message('  뭐 해?  ')
+    assert cache.get(key) is None
+    cache.put(key, ['후보'])
+    assert cache.get(normalize_message('뭐   해?')) == ['후보']
+    assert cache.get('다른 메시지') is None
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['hit_rate']) == (1, 2, round(1 / 3, 4))
+
+
+def test_entries_expire_after_ttl():
+    """ttl이 지난 항목은 실패로 처리하고 만료 수를 셈"""
+    cache = ResponseCache(max_size=4, ttl=0.05)
+    cache.put('안녕', 1)
+    assert cache.get('안녕') == 1
+    time.sleep(0.1)
+    assert cache.get('안녕') is None
+    assert cache.expirations == 1 and cache.misses == 1 and len(cache) == 0
+
+
+def test_least_recently_used_entry_is_evicted():
+    """크기를 넘으면 가장 오래 안 쓴 항목부터 밀어냄 (조회하면 최근 항목이 됨)"""
+    cache = ResponseCache(max_size=2, ttl=None)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.get('a')  # b가 가장 오래 안 쓴 항목이 됨
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    cache.put('d', 4)  # 이번에는 a가 밀려남
+    assert cache.get('a') is None
+    assert cache.evictions == 2 and len(cache) == 2
+
+
+def test_rewriting_watched_file_invalidates_but_touch_does_not(tmp_path):
+    """감시 파일 내용이 바뀌면 비우고 generation 증가, mtime만 바뀌면 그대로"""
+    path = tmp_path / 'dataset.json'
+    path.write_text('[{"input": "안녕", "label": "안녕!"}]', encoding='utf-8')
+    cache = ResponseCache(max_size=4, ttl=None, watch_path=str(path))
+    cache.put('안녕', 1)
+
+    _set_mtime(path, 1_000_000_000)  # 내용은 그대로
+    assert cache.get('안녕') == 1
+    assert cache.generation == 0 and cache.invalidations == 0
+
+    path.write_text('[{"input": "안녕", "label": "반가워!"}]', encoding='utf-8')
+    _set_mtime(path, 2_000_000_000)
+    assert cache.get('안녕') is None
+    assert cache.generation == 1 and cache.invalidations == 1 and len(cache) == 0
+
+
+def test_bind_clears_when_dataset_object_changes():
+    """bind한 데이터셋 객체가 바뀌면 비움"""
+    cache = ResponseCache(max_size=4, ttl=None)
+    dataset = [{'input': '안녕', 'label': '안녕!'}]
+    cache.bind(dataset)
+    cache.put('안녕', 1)
+    cache.bind(dataset)
+    assert cache.get('안녕') == 1
+
+    cache.bind(list(dataset))  # 내용이 같아도 다른 객체면 비움
+    assert cache.get('안녕') is None and len(cache) == 0
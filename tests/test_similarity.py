@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+from match_index import MatchIndex
+from similarity import BACKENDS, get_similarity, parity_report, pruned_ratio
+
+DATASET_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'dataset.json')
+
+
+@pytest.fixture(scope='module')
+def dataset():
+    with open(DATASET_PATH, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def test_parity_with_difflib(dataset):
+    """similarity.py --parity와 같은 기준: difflib은 완전히 같고 근사 백엔드도 1위가 대부분 같음"""
+    report = parity_report(dataset, list(BACKENDS), num_queries=20)
+    assert report['difflib']['top1'] == 1.0
+    assert all(backend['top1'] >= 0.8 for backend in report.values())
+
+
+@pytest.mark.parametrize('name', list(BACKENDS))
+def test_top_k_matches_full_scan(dataset, name):
+    """백엔드의 상한(upper_bound/length_bound)으로 가지치기해도 전체 스캔과 상위 k개가 같음"""
+    index = MatchIndex(dataset, similarity=name)
+    queries = [item['input'] for item in dataset[::len(dataset) // 30]]
+    queries += [query[1:] for query in queries if len(query) > 3] + ['완전히 새로운 문장이야', '?']
+    for query in queries:
+        expected = [(id(c['item']), c['score']) for c in index.rank_all(query)[:5]]
+        assert [(id(c['item']), c['score']) for c in index.top_k(query, 5)] == expected
+
+
+def test_ngram_bounds_are_upper_bounds(dataset):
+    """ngram 상한은 실제 코사인 이상 (1차 후보 밖 길이 상한은 공통 바이그램이 없는 쌍에만 적용)"""
+    similarity = get_similarity('ngram')
+    index = MatchIndex(dataset[:200], similarity='ngram')
+    for entry in index.entries[:40]:
+        shortlist = index.shortlist(entry)
+        for idx, other in enumerate(index.entries):
+            exact = similarity.ratio(entry, other)
+            assert similarity.upper_bound(entry, other) >= exact - 1e-12
+            if idx not in shortlist:
+                assert similarity.length_bound(len(entry.lower), len(other.lower)) >= exact - 1e-12
+
+
+def test_batch_top_k_matches_per_message_top_k(dataset, monkeypatch):
+    """BatchScorer의 행렬 상한으로 가지치기해도 메시지마다 find_best_match_response(top_k=5)와 같음 (여러 청크로 나눠도)"""
+    pytest.importorskip('numpy')
+    import batch_scorer
+    from predict_hybrid_smart import find_best_match_batch, find_best_match_response
+
+    messages = [item['input'] for item in dataset[::len(dataset) // 40]]
+    messages += [message[1:] for message in messages if len(message) > 3] + ['완전히 새로운 문장이야', '?', '']
+    # 청크 하나에 메시지 7개만 들어가도록 줄임
+    monkeypatch.setattr(batch_scorer, 'MAX_BATCH_CELLS', len(dataset) * 7)
+    assert len(messages) > 7
+
+    batch = find_best_match_batch(messages, dataset, top_k=5)
+    assert len(batch) == len(messages)
+    for message, candidates in zip(messages, batch):
+        expected = [(id(c['item']), c['score']) for c in find_best_match_response(message, dataset, top_k=5)]
+        assert [(id(c['item']), c['score']) for c in candidates] == expected
+
+
+@pytest.mark.parametrize('name', list(BACKENDS))
+def test_pruned_ratio_only_skips_rows_below_the_bound(dataset, name):
+    """pruned_ratio는 keep이 다 통과시키면 text_ratio와 같고, 건너뛴 행은 실제 점수도 기준 미만"""
+    similarity = get_similarity(name)
+    texts = [item['input'].lower() for item in dataset[:200]]
+    query = texts[7][1:]
+    for text in texts:
+        exact = similarity.text_ratio(query, text)
+        assert pruned_ratio(query, text, lambda bound: True, name) == exact
+        if pruned_ratio(query, text, lambda bound: bound >= 0.5, name) is None:
+            assert exact < 0.5
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# token_cache.py - 학습용 토큰 텐서 캐시
+# dataset.json을 한 번만 토큰화해서 (N, max_seq_len) 정수 텐서 두 개(input, label)로 저장하고,
+# 다음부터는 torch.from_file로 mmap해서 Dataset.__getitem__이 슬라이스만 하게 한다.
+#
+# 파일 (JSON 옆에 생성, 어휘 해시가 이름에 들어가서 어휘가 다르면 다른 파일):
+#   dataset.tokens-<해시>.bin  : int16/int32 원시 배열, input 전체 다음에 label 전체 (2 x N x max_seq_len)
+#   dataset.tokens-<해시>.json : 원본 JSON mtime/크기, 항목 수, 길이, 타입 (원본이 바뀌면 다시 만듦)
+#
+# 토큰화 방식
+#   vocab 목록을 주면  : reze_vocab 토크나이저(char/jamo/byte) 기호 -> 어휘 id, 끝에 <EOS>,
+#                        모르는 기호/빈 자리는 <PAD> (OptimizedDialogueDataset, SimpleDataset)
+#   vocab=None이면     : 문자 코드포인트(ord), 빈 자리는 0, <EOS> 없음 (예전 train_model 방식)
+#
+# 길이 버킷팅: BucketBatchSampler가 길이가 비슷한 항목끼리 배치를 만들고,
+# PaddedCollate가 배치 안 최대 길이까지만 남기고 잘라서 <PAD> 계산을 줄인다.
+#
+# 사용법: python3 token_cache.py [dataset.json]  (compiled_dataset 어휘로 캐시 생성)
+
+import hashlib
+import json
+import os
+import sys
+from array import array
+
+import torch
+
+from compiled_dataset import load_dataset_fast
+from reze_vocab import build_vocab, tokenize
+
+VERSION = 1
+
+
+def _vocab_hash(vocab, max_seq_len, tokenizer='char'):
+    key = json.dumps({'version': VERSION, 'vocab': vocab if vocab is not None else 'ord',
+                      'max_seq_len': max_seq_len, 'tokenizer': tokenizer}, ensure_ascii=False)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def token_cache_paths(json_path, vocab, max_seq_len, tokenizer='char'):
+    """(텐서 파일, 메타 파일) 경로"""
+    base, _ = os.path.splitext(json_path)
+    stem = f"{base}.tokens-{_vocab_hash(vocab, max_seq_len, tokenizer)}"
+    return stem + '.bin', stem + '.json'
+
+
+def _source_signature(json_path):
+    st = os.stat(json_path)
+    return {'mtime_ns': st.st_mtime_ns, 'size': st.st_size}
+
+
+def _fit(ids, max_seq_len, pad, eos):
+    """패딩 / 자르기 (eos가 있으면 잘린 자리의 마지막을 <EOS>로)"""
+    if eos is not None:
+        ids = ids + [eos]
+    if len(ids) < max_seq_len:
+        return ids + [pad] * (max_seq_len - len(ids))
+    if eos is not None:
+        return ids[:max_seq_len - 1] + [eos]
+    return ids[:max_seq_len]
+
+
+def tokenize_dataset(dataset, vocab, max_seq_len, tokenizer='char'):
+    """데이터셋 전체 -> (typecode, input id 배열, label id 배열), 배열은 항목마다 max_seq_len개씩 이어붙인 것"""
+    if vocab is None:
+        encode = lambda text: [ord(c) for c in text]
+        pad, eos, typecode = 0, None, 'i'
+    else:
+        char_to_idx = {char: idx for idx, char in enumerate(vocab)}
+        pad, eos = char_to_idx['<PAD>'], char_to_idx['<EOS>']
+        encode = lambda text: [char_to_idx.get(c, pad) for c in tokenize(text, tokenizer)]
+        typecode = 'h' if len(vocab) <= 32767 else 'i'
+
+    # 컴파일된 데이터셋이 같은 어휘라면 미리 만든 토큰 id를 그대로 사용
+    precomputed = (vocab is not None and tokenizer == 'char'
+                   and hasattr(dataset, 'vocab') and dataset.vocab()[0] == char_to_idx)
+
+    inputs, labels = array(typecode), array(typecode)
+    for idx in range(len(dataset)):
+        if precomputed:
+            input_ids, label_ids = list(dataset.input_ids(idx)), list(dataset.label_ids(idx))
+        else:
+            item = dataset[idx]
+            input_ids, label_ids = encode(item['input']), encode(item['label'])
+        inputs.extend(_fit(input_ids, max_seq_len, pad, eos))
+        labels.extend(_fit(label_ids, max_seq_len, pad, eos))
+    return typecode, inputs, labels
+
+
+def _write_atomic(path, payload):
+    tmp_path = f"{path}.tmp{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(payload)
+    os.replace(tmp_path, path)
+
+
+def build_token_cache(json_path, vocab, max_seq_len, dataset=None, tokenizer='char'):
+    """토큰화 결과를 파일로 저장하고 메타 dict 반환 (텐서 파일을 먼저, 메타를 나중에 교체)"""
+    tensor_path, meta_path = token_cache_paths(json_path, vocab, max_seq_len, tokenizer)
+    dataset = dataset if dataset is not None else load_dataset_fast(json_path)
+    typecode, inputs, labels = tokenize_dataset(dataset, vocab, max_seq_len, tokenizer)
+
+    meta = dict(_source_signature(json_path), version=VERSION, count=len(dataset),
+                max_seq_len=max_seq_len, dtype='int16' if typecode == 'h' else 'int32')
+    _write_atomic(tensor_path, inputs.tobytes() + labels.tobytes())
+    _write_atomic(meta_path, json.dumps(meta).encode('utf-8'))
+
+    print(f"토큰 캐시 생성: {tensor_path} ({meta['count']}개 x {max_seq_len}, {meta['dtype']})", file=sys.stderr)
+    return meta
+
+
+def _fresh_meta(json_path, vocab, max_seq_len, tokenizer):
+    tensor_path, meta_path = token_cache_paths(json_path, vocab, max_seq_len, tokenizer)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        signature = _source_signature(json_path)
+        tensor_exists = os.path.exists(tensor_path)
+    except (OSError, ValueError):
+        return None
+    fresh = (tensor_exists and meta.get('version') == VERSION and meta.get('max_seq_len') == max_seq_len
+             and (meta.get('mtime_ns'), meta.get('size')) == (signature['mtime_ns'], signature['size']))
+    return meta if fresh else None
+
+
+def load_token_tensors(json_path, vocab=None, max_seq_len=50, dataset=None, tokenizer='char'):
+    """
+    (inputs, labels) 텐서 (각각 (N, max_seq_len), int16/int32) 로드
+    캐시가 없거나 JSON이 바뀌었으면 다시 만들고, 파일을 쓸 수 없으면 메모리에서 토큰화
+    dataset: 이미 로드한 데이터셋 (다시 만들 때만 사용)
+    tokenizer: vocab 기호를 만든 reze_vocab 토크나이저
+    """
+    try:
+        meta = (_fresh_meta(json_path, vocab, max_seq_len, tokenizer)
+                or build_token_cache(json_path, vocab, max_seq_len, dataset, tokenizer))
+        tensor_path, _ = token_cache_paths(json_path, vocab, max_seq_len, tokenizer)
+        dtype = torch.int16 if meta['dtype'] == 'int16' else torch.int32
+        count = meta['count']
+        tokens = torch.from_file(tensor_path, shared=False, size=2 * count * max_seq_len, dtype=dtype)
+    except (OSError, RuntimeError) as e:
+        print(f"토큰 캐시 사용 불가, 메모리에서 토큰화: {e}", file=sys.stderr)
+        dataset = dataset if dataset is not None else load_dataset_fast(json_path)
+        typecode, inputs, labels = tokenize_dataset(dataset, vocab, max_seq_len, tokenizer)
+        dtype = torch.int16 if typecode == 'h' else torch.int32
+        count = len(dataset)
+        tokens = torch.tensor(list(inputs) + list(labels), dtype=dtype)
+    tokens = tokens.view(2, count, max_seq_len)
+    return tokens[0], tokens[1]
+
+
+def sequence_lengths(tokens, pad_idx):
+    """행마다 마지막 <PAD> 아닌 토큰까지의 길이 (N,) (중간의 <PAD>는 길이에 포함)"""
+    positions = torch.arange(1, tokens.size(1) + 1)
+    return ((tokens != pad_idx).long() * positions).max(dim=1).values
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    """
+    길이가 비슷한 항목끼리 묶는 배치 샘플러
+    섞은 순서를 batch_size x bucket_batches개씩 잘라 그 안에서 길이순 정렬 후 배치로 나누고,
+    배치 순서를 다시 섞는다 (에포크마다 set_epoch로 다른 순서)
+    num_replicas/rank를 주면 DistributedSampler처럼 배치를 워커마다 나눠 줌 (워커별 배치 수 동일)
+    """
+
+    def __init__(self, lengths, batch_size, bucket_batches=50, shuffle=True, num_replicas=1, rank=0, seed=0):
+        self.lengths = lengths
+        self.batch_size = batch_size
+        self.bucket_batches = bucket_batches
+        self.shuffle = shuffle
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.seed = seed
+        self.epoch = 0
+
+        count = len(lengths)
+        bucket = batch_size * bucket_batches
+        total = (count // bucket) * bucket_batches + -(-(count % bucket) // batch_size)
+        self.num_batches = total // num_replicas
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def __len__(self):
+        return self.num_batches
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        count = len(self.lengths)
+        order = torch.randperm(count, generator=generator) if self.shuffle else torch.arange(count)
+
+        batches = []
+        for chunk in order.split(self.batch_size * self.bucket_batches):
+            chunk = chunk[torch.argsort(self.lengths[chunk], stable=True)]
+            batches.extend(chunk.split(self.batch_size))
+        if self.shuffle:
+            batches = [batches[i] for i in torch.randperm(len(batches), generator=generator).tolist()]
+
+        end = self.num_batches * self.num_replicas
+        for batch in batches[self.rank:end:self.num_replicas]:
+            yield batch.tolist()
+
+
+class PaddedCollate:
+    """(input, target) 항목들을 쌓고 배치 안 최대 길이까지만 남김 (워커 프로세스로 보낼 수 있게 클래스)"""
+
+    def __init__(self, pad_idx, min_length=2):
+        self.pad_idx = pad_idx
+        self.min_length = min_length
+
+    def _trim(self, tokens):
+        width = max(int(sequence_lengths(tokens, self.pad_idx).max()), self.min_length)
+        return tokens[:, :width]
+
+    def __call__(self, items):
+        inputs = torch.stack([inputs for inputs, _ in items])
+        targets = torch.stack([targets for _, targets in items])
+        return self._trim(inputs), self._trim(targets)
+
+
+def make_dataloader(dataset, batch_size, shuffle=True, sampler=None, num_workers=0, batch_sampler=None,
+                    collate_fn=None):
+    """
+    토큰 캐시 Dataset용 DataLoader
+    워커를 쓰면 에포크마다 다시 띄우지 않고 (persistent_workers), CUDA가 있으면 pin_memory
+    batch_sampler를 주면 batch_size/shuffle/sampler는 무시 (BucketBatchSampler + PaddedCollate)
+    """
+    if batch_sampler is not None:
+        batching = {'batch_sampler': batch_sampler}
+    else:
+        batching = {'batch_size': batch_size, 'shuffle': shuffle if sampler is None else False, 'sampler': sampler}
+    return torch.utils.data.DataLoader(
+        dataset,
+        collate_fn=collate_fn,
+        num_workers=num_workers,
+        pin_memory=torch.cuda.is_available(),
+        persistent_workers=num_workers > 0,
+        **batching,
+    )
+
+
+if __name__ == "__main__":
+    path = sys.argv[1] if len(sys.argv) > 1 else './dataset.json'
+    data = load_dataset_fast(path)
+    vocab = build_vocab(data)
+    meta = build_token_cache(path, vocab, 50, data)
+    print(json.dumps(dict(meta, status="success", path=token_cache_paths(path, vocab, 50)[0])))
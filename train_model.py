@@ -1,60 +1,147 @@
 import torch
 import torch.nn as nn
 import torch.optim as optim
-from torch.utils.data import DataLoader, Dataset
+from torch.utils.data import Dataset
 import json
 import sys
+import time
 import torch.nn.functional as F
 
+from acceleration import autocast, compile_model, enable_fastpaths, resolve_precision
+from checkpoint_manager import CheckpointManager
+from compiled_dataset import load_dataset_fast
+from reze_model import TransformerModel, causal_mask
+from reze_vocab import TOKENIZERS, create_proper_vocab
+from token_cache import load_token_tensors, make_dataloader
+
+# 학습 방식
+#   parallel: 인과 마스크로 배치당 한 번의 forward (scheduled sampling은 2-pass)
+#   stepwise: 타임스텝마다 전체 forward를 다시 하는 예전 방식 (비교용)
+TRAINING_MODES = ('parallel', 'stepwise')
+
 # DataSet
 class SimpleDataset(Dataset):
-    def __init__(self, data_path):
-        with open(data_path, 'r') as f:
-            self.data = json.load(f)
+    """
+    데이터에 나오는 기호만으로 만든 어휘(reze_vocab) 토큰, 토큰 캐시(token_cache.py)를 mmap한 텐서에서 슬라이스
+    tokenizer: 'char'(기본), 'jamo'(한글 자모 분해), 'byte'(UTF-8 바이트)
+    """
+    def __init__(self, data_path, max_length=50, tokenizer='char'):
+        # 컴파일된 데이터셋을 mmap (JSON 파싱 없음, 바뀌었으면 다시 컴파일, 안 되면 UTF-8 JSON)
+        self.data = load_dataset_fast(data_path)
+        self.tokenizer = tokenizer
+        if tokenizer == 'char' and hasattr(self.data, 'vocab'):
+            # 컴파일 단계에서 create_proper_vocab와 같은 순서로 만들어 둔 어휘
+            self.char_to_idx, self.idx_to_char, self.vocab_size = self.data.vocab()
+        else:
+            self.char_to_idx, self.idx_to_char, self.vocab_size = create_proper_vocab(self.data, tokenizer)
+        self.pad_idx = self.char_to_idx['<PAD>']
+        # (N, max_length) int16/int32, 끝에 <EOS>, 빈 자리는 <PAD>
+        vocab = [self.idx_to_char[idx] for idx in range(self.vocab_size)]
+        self.inputs, self.labels = load_token_tensors(data_path, vocab, max_length, self.data, tokenizer)
 
     def __len__(self):
         return len(self.data)
 
     def __getitem__(self, idx):
-        max_length = 50 
-        # Convert 'input' and 'label' from strings to tensors
-        x = torch.tensor([ord(c) for c in self.data[idx]['input']], dtype=torch.float32)
-        y = torch.tensor([ord(c) for c in self.data[idx]['label']], dtype=torch.float32)
-
-        #Pad or truncate to max_length
-        x = torch.nn.functional.pad(x, (0,max_length - len(x)))[:max_length]
-        y = torch.nn.functional.pad(y, (0,max_length - len(y)))[:max_length]
-        return x, y
-
-# Transformer 모델 정의
-class TransformerModel(nn.Module):
-    def __init__(self, vocab_size, embed_dim, num_heads, num_layers, max_seq_len):
-        super(TransformerModel, self).__init__()
-        self.embedding = nn.Embedding(vocab_size, embed_dim)
-        self.positional_encoding = nn.Parameter(torch.zeros(1, max_seq_len, embed_dim))
-        self.transformer = nn.Transformer(
-            d_model=embed_dim,
-            nhead=num_heads,
-            num_encoder_layers=num_layers,
-            num_decoder_layers=num_layers
-        )
-        self.fc_out = nn.Linear(embed_dim, vocab_size)
-
-    def forward(self, src, tgt):
-        src = self.embedding(src) + self.positional_encoding[:, :src.size(1), :]
-        tgt = self.embedding(tgt) + self.positional_encoding[:, :tgt.size(1), :]
-        output = self.transformer(src, tgt)
-        return self.fc_out(output)
+        return self.inputs[idx], self.labels[idx]
+
+def parallel_outputs(model, inputs, labels, teacher_forcing_ratio, start_token):
+    """
+    인과 마스크 forward 한 번으로 모든 타임스텝의 출력 계산
+    시작 토큰 없이 labels[:, :-1]로 labels[:, 1:]를 예측 (train_optimized_model, predict_enhanced의 prefill/decode_step과 같은 규칙)
+    teacher_forcing_ratio < 1이면 2-pass scheduled sampling:
+    1차(기울기 없음)로 모델 예측을 얻고, 타임스텝마다 정답/예측 중 하나를 골라 섞은 입력으로 2차 forward
+    반환: (출력, 정답)
+    """
+    tgt_input = labels[:, :-1]
+    seq_len = tgt_input.size(1)
+    tgt_mask = causal_mask(seq_len, labels.device)
+    
+    if teacher_forcing_ratio < 1.0:
+        with torch.no_grad():
+            predictions = model(inputs, tgt_input, tgt_mask=tgt_mask).argmax(dim=-1)  # t번째 = labels[:, t+1] 예측
+        
+        # 타임스텝마다 teacher forcing 사용 여부 결정 (stepwise와 같이 배치 전체가 같은 선택, 첫 토큰은 항상 정답)
+        use_prediction = torch.rand(seq_len - 1, device=labels.device) >= teacher_forcing_ratio
+        mixed = torch.where(use_prediction[None, :], predictions[:, :-1], tgt_input[:, 1:])
+        tgt_input = torch.cat([tgt_input[:, :1], mixed], dim=1)
+    
+    return model(inputs, tgt_input, tgt_mask=tgt_mask), labels[:, 1:]
+
+def stepwise_outputs(model, inputs, labels, teacher_forcing_ratio, start_token):
+    """
+    타임스텝마다 지금까지의 입력을 패딩해 전체 forward (배치당 seq_len번, 비교용)
+    start_token으로 시작해 labels 전체를 예측, 반환: (출력, 정답)
+    """
+    batch_size, seq_len = labels.size()
+    
+    # 디코더 입력 초기화 (시작 토큰)
+    tgt_input = torch.full((batch_size, 1), start_token, dtype=torch.long).to(labels.device)
+    
+    # 자동회귀 방식으로 학습
+    outputs = []
+    for t in range(seq_len):
+        # 현재까지의 입력으로 예측
+        # 패딩 추가
+        tgt_padded = F.pad(tgt_input, (0, seq_len - tgt_input.size(1)), value=start_token)
+        output = model(inputs, tgt_padded)
+        
+        # 현재 타임스텝의 출력
+        current_output = output[:, t:t+1, :]  # (batch_size, 1, vocab_size)
+        outputs.append(current_output)
+        
+        # 다음 입력 결정 (Scheduled Sampling)
+        if t < seq_len - 1:
+            # teacher forcing 사용 여부 결정
+            use_teacher_forcing = torch.rand(1).item() < teacher_forcing_ratio
+            
+            if use_teacher_forcing:
+                # 정답 사용
+                next_token = labels[:, t:t+1]
+            else:
+                # 모델의 예측 사용
+                next_token = output[:, t, :].argmax(dim=-1, keepdim=True)
+            
+            tgt_input = torch.cat([tgt_input, next_token], dim=1)
+    
+    # 출력을 하나로 합치기
+    return torch.cat(outputs, dim=1), labels  # (batch_size, seq_len, vocab_size)
 
 # 학습 함수 (Scheduled Sampling 적용)
-def train_transformer_model(model, dataloader, criterion, optimizer, epochs, vocab_size, device, model_name):
+def train_transformer_model(model, dataloader, criterion, optimizer, epochs, vocab_size, device, model_name,
+                            mode='parallel', vocab=None, checkpoints=None, start_epoch=0, precision='fp32'):
     """
     Scheduled Sampling을 적용한 학습 함수
     초기에는 teacher forcing을 많이 사용하고, 점차 모델 자신의 예측을 사용
+    mode: 'parallel'(기본) 또는 'stepwise' (TRAINING_MODES)
+    vocab: 체크포인트에 같이 저장할 어휘 정보 (char_to_idx, idx_to_char, tokenizer, tie_embeddings)
+           stepwise는 있으면 <PAD>를 시작 토큰으로 쓰고, 없으면 예전처럼 vocab_size - 1 (parallel은 시작 토큰 없음)
+    checkpoints: CheckpointManager (없으면 {model_name}_checkpoint_epoch_N.pth 최근 3개 + _best.pth)
+    start_epoch: 재개할 때 이미 끝난 epoch 수 (CheckpointManager.resume의 반환값)
+    precision: 'fp32' 또는 'bf16' (forward/손실을 bf16 autocast로, acceleration.resolve_precision으로 확인한 값)
     """
-    for epoch in range(epochs):
+    if mode not in TRAINING_MODES:
+        raise ValueError(f"알 수 없는 학습 방식: {mode} (가능: {', '.join(TRAINING_MODES)})")
+    compute_outputs = parallel_outputs if mode == 'parallel' else stepwise_outputs
+    vocab = vocab or {}
+    start_token = vocab['char_to_idx']['<PAD>'] if 'char_to_idx' in vocab else vocab_size - 1
+    own_checkpoints = checkpoints is None
+    if own_checkpoints:
+        checkpoints = CheckpointManager(f"{model_name}_checkpoint")
+    meta = {
+        'vocab_size': vocab_size,
+        'embed_dim': 128,
+        'num_heads': 8,
+        'num_layers': 4,
+        'max_seq_len': 50,
+        'causal': mode == 'parallel',
+        **vocab
+    }
+    
+    for epoch in range(start_epoch, epochs):
         model.train()
         total_loss = 0.0
+        epoch_start = time.perf_counter()
         
         # Scheduled Sampling 비율 계산 (epoch이 증가할수록 감소)
         teacher_forcing_ratio = max(0.5, 1.0 - (epoch / epochs) * 0.5)
@@ -69,42 +156,12 @@ def train_transformer_model(model, dataloader, criterion, optimizer, epochs, voc
             optimizer.zero_grad()
             # 데이터를 GPU로 이동
             inputs, labels = inputs.long().to(device), labels.long().to(device)
-            batch_size, seq_len = labels.size()
             
-            # 디코더 입력 초기화 (시작 토큰)
-            tgt_input = torch.full((batch_size, 1), vocab_size - 1, dtype=torch.long).to(device)
-            
-            # 자동회귀 방식으로 학습
-            outputs = []
-            for t in range(seq_len):
-                # 현재까지의 입력으로 예측
-                # 패딩 추가
-                tgt_padded = F.pad(tgt_input, (0, seq_len - tgt_input.size(1)), value=vocab_size - 1)
-                output = model(inputs, tgt_padded)
-                
-                # 현재 타임스텝의 출력
-                current_output = output[:, t:t+1, :]  # (batch_size, 1, vocab_size)
-                outputs.append(current_output)
+            with autocast(device, precision):
+                outputs, targets = compute_outputs(model, inputs, labels, teacher_forcing_ratio, start_token)
                 
-                # 다음 입력 결정 (Scheduled Sampling)
-                if t < seq_len - 1:
-                    # teacher forcing 사용 여부 결정
-                    use_teacher_forcing = torch.rand(1).item() < teacher_forcing_ratio
-                    
-                    if use_teacher_forcing:
-                        # 정답 사용
-                        next_token = labels[:, t:t+1]
-                    else:
-                        # 모델의 예측 사용
-                        next_token = output[:, t, :].argmax(dim=-1, keepdim=True)
-                    
-                    tgt_input = torch.cat([tgt_input, next_token], dim=1)
-            
-            # 출력을 하나로 합치기
-            outputs = torch.cat(outputs, dim=1)  # (batch_size, seq_len, vocab_size)
-            
-            # 손실 계산 (패딩 토큰 무시)
-            loss = criterion(outputs.reshape(-1, vocab_size), labels.reshape(-1))
+                # 손실 계산 (패딩 토큰 무시)
+                loss = criterion(outputs.reshape(-1, vocab_size), targets.reshape(-1))
             loss.backward()
             
             # Gradient clipping (기울기 폭발 방지)
@@ -114,37 +171,35 @@ def train_transformer_model(model, dataloader, criterion, optimizer, epochs, voc
             total_loss += loss.item()
         
         avg_loss = total_loss / len(dataloader)
-        print(f"Epoch {epoch+1}/{epochs}, Loss: {avg_loss:.4f}, Teacher Forcing: {teacher_forcing_ratio:.2f}")
+        elapsed = time.perf_counter() - epoch_start
+        print(f"Epoch {epoch+1}/{epochs}, Loss: {avg_loss:.4f}, Teacher Forcing: {teacher_forcing_ratio:.2f}, "
+              f"{mode}/{precision}: {elapsed:.1f}s")
         
-        # 중간 저장: 각 에포크마다 모델 저장
-        model_cpu = model.to('cpu')  # CPU로 이동하여 저장
-        checkpoint = {
-            'epoch': epoch + 1,
-            'model_state_dict': model_cpu.state_dict(),
-            'optimizer_state_dict': optimizer.state_dict(),
-            'loss': avg_loss,
-            'vocab_size': vocab_size,
-            'embed_dim': 128,
-            'num_heads': 8,
-            'num_layers': 4,
-            'max_seq_len': 50
-        }
-        torch.save(checkpoint, f"{model_name}_checkpoint_epoch_{epoch+1}.pth")
-        print(f"Epoch {epoch+1} 체크포인트 저장 완료!")
-        model = model_cpu.to(device)  # 다시 원래 디바이스로 이동
+        # 중간 저장: 디바이스의 텐서를 CPU 복사본으로 떠서 백그라운드에서 저장 (모델은 그대로 학습 디바이스에)
+        checkpoints.save(epoch + 1, avg_loss, model, optimizer, meta)
+    
+    if own_checkpoints:
+        checkpoints.close()
 
 # 모델 테스트 함수
-def test_transformer_model(model, dataloader, vocab_size, device):
+def test_transformer_model(model, dataloader, vocab_size, device, mode='parallel', pad_idx=None):
     model.eval()
     total_loss = 0.0
-    criterion = nn.CrossEntropyLoss()
+    start_token = vocab_size - 1 if pad_idx is None else pad_idx
+    criterion = nn.CrossEntropyLoss() if pad_idx is None else nn.CrossEntropyLoss(ignore_index=pad_idx)
 
     with torch.no_grad():
         for inputs, labels in dataloader:
             inputs, labels = inputs.long().to(device), labels.long().to(device)
-            tgt_input = F.pad(labels[:, :-1], (1, 0), value=vocab_size - 1)  # Shifted target input
-            outputs = model(inputs, tgt_input)
-            loss = criterion(outputs.view(-1, vocab_size), labels.view(-1))
+            if mode == 'parallel':
+                # 학습과 같은 규칙: 시작 토큰 없이 다음 토큰 예측
+                tgt_input, targets = labels[:, :-1], labels[:, 1:]
+                tgt_mask = causal_mask(tgt_input.size(1), device)
+            else:
+                tgt_input, targets = F.pad(labels[:, :-1], (1, 0), value=start_token), labels  # Shifted target input
+                tgt_mask = None
+            outputs = model(inputs, tgt_input, tgt_mask=tgt_mask)
+            loss = criterion(outputs.reshape(-1, vocab_size), targets.reshape(-1))
             total_loss += loss.item()
 
     avg_loss = total_loss / len(dataloader)
@@ -157,6 +212,13 @@ if __name__ == "__main__":
     dataset_path = args['dataset']
     epochs = args['epochs']
     learning_rate = args['learning_rate']
+    training_mode = args.get('training_mode', 'parallel')
+    loader_workers = args.get('loader_workers', 0)
+    tokenizer = args.get('tokenizer', 'char')  # TOKENIZERS
+    tie_embeddings = bool(args.get('tie_embeddings', False))
+    precision = args.get('precision', 'fp32')  # acceleration.PRECISIONS
+    compile_enabled = bool(args.get('compile', False))
+    resume = args.get('resume')  # true면 최신 {model}_checkpoint_epoch_N.pth, 문자열이면 그 파일에서 재개
 
     # GPU 설정 (CUDA)
     if torch.cuda.is_available():
@@ -169,49 +231,68 @@ if __name__ == "__main__":
     # 데이터셋 및 데이터로더 준비
     # GPU 메모리 고려하여 배치 크기 조정 (MPS는 메모리 제한이 있음)
     batch_size = 4 if device.type == "mps" else 32
-    dataset = SimpleDataset(dataset_path)
-    dataloader = DataLoader(dataset, batch_size=batch_size, shuffle=True)
+    if tokenizer not in TOKENIZERS:
+        raise ValueError(f"알 수 없는 토크나이저: {tokenizer} (가능: {', '.join(TOKENIZERS)})")
+    dataset = SimpleDataset(dataset_path, tokenizer=tokenizer)
+    dataloader = make_dataloader(dataset, batch_size, shuffle=True, num_workers=loader_workers)
     print(f"배치 크기: {batch_size}")
 
-    # 입력 데이터의 최대값 확인
-    max_input_value = max(max(ord(c) for c in sample['input']) for sample in dataset.data)
-    print(f"Max input value in dataset: {max_input_value}")
-
-    # vocab_size를 유니코드 범위에 맞게 확장
-    vocab_size = max(11172, max_input_value + 1)  
-    print(f"Using vocab_size: {vocab_size}")
+    # 데이터에 나오는 기호만으로 만든 어휘 (유니코드 전체 범위 대신)
+    vocab_size = dataset.vocab_size
+    print(f"Using vocab_size: {vocab_size} (토크나이저: {tokenizer}, 가중치 공유: {tie_embeddings})")
+    vocab = {
+        'char_to_idx': dataset.char_to_idx,
+        'idx_to_char': dataset.idx_to_char,
+        'tokenizer': tokenizer,
+        'tie_embeddings': tie_embeddings,
+    }
 
     # 모델 초기화 및 GPU로 이동
     embed_dim = 128
     num_heads = 8
     num_layers = 4
     max_seq_len = 50
-    model = TransformerModel(vocab_size, embed_dim, num_heads, num_layers, max_seq_len)
+    model = TransformerModel(vocab_size, embed_dim, num_heads, num_layers, max_seq_len, tie_embeddings=tie_embeddings)
     model = model.to(device)  # 모델을 GPU로 이동
     print(f"모델이 {device}로 이동되었습니다")
+    enable_fastpaths(device)
+    precision = resolve_precision(precision, device)
 
     # 손실 함수 및 옵티마이저 설정
-    criterion = nn.CrossEntropyLoss()
+    criterion = nn.CrossEntropyLoss(ignore_index=dataset.pad_idx)
     optimizer = optim.Adam(model.parameters(), lr=learning_rate)
 
+    # 체크포인트 관리 (최근 학습 상태 3개 + 최저 손실 추론 스냅샷), 재개
+    checkpoints = CheckpointManager(f"{model_name}_checkpoint")
+    start_epoch = checkpoints.resume(model, optimizer, resume if isinstance(resume, str) else None) if resume else 0
+
+    # torch.compile (실패하면 eager), 저장은 checkpoint_manager가 원래 모델로 풀어서 함
+    train_model = model
+    if compile_enabled:
+        example = torch.randint(vocab_size, (2, 8), device=device)
+        train_model = compile_model(model, (example, example), {'tgt_mask': causal_mask(8, device)}, precision, device)
+
     # 모델 학습 (device와 model_name 파라미터 추가)
-    train_transformer_model(model, dataloader, criterion, optimizer, epochs, vocab_size, device, model_name)
+    print(f"학습 방식: {training_mode}, {precision}{', torch.compile' if train_model is not model else ''}")
+    train_transformer_model(train_model, dataloader, criterion, optimizer, epochs, vocab_size, device, model_name,
+                            training_mode, vocab, checkpoints, start_epoch, precision)
 
-    # 학습된 모델 저장 (vocab_size 정보도 함께 저장) - CPU로 이동 후 저장
-    model = model.to('cpu')
-    checkpoint = {
-        'model_state_dict': model.state_dict(),
+    # 학습된 모델 저장: 가중치 + 설정/어휘만 (옵티마이저 상태 없는 추론 스냅샷)
+    checkpoints.save_inference(f"{model_name}_trained.pth", model, {
         'vocab_size': vocab_size,
         'embed_dim': embed_dim,
         'num_heads': num_heads,
         'num_layers': num_layers,
-        'max_seq_len': max_seq_len
-    }
-    torch.save(checkpoint, f"{model_name}_trained.pth")
+        'max_seq_len': max_seq_len,
+        'causal': training_mode == 'parallel',
+        **vocab
+    }, epochs)
+    checkpoints.close()
 
     # 결과 반환
     print(json.dumps({"status": "success", "message": "Training complete", "vocab_size": vocab_size}))
 
     # 모델 테스트 (CPU에서 테스트)
     print("Testing the trained model...")
-    test_transformer_model(model, dataloader, vocab_size, torch.device('cpu'))
\ No newline at end of file
+    model = model.to('cpu')
+    test_transformer_model(model, dataloader, vocab_size, torch.device('cpu'), training_mode, dataset.pad_idx)
\ No newline at end of file
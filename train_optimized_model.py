@@ -1,115 +1,104 @@
 import torch
 import torch.nn as nn
 import json
+import os
+import socket
+import sys
+import time
+import torch.distributed as dist
+import torch.multiprocessing as mp
 import torch.utils.data as data
 import torch.nn.functional as F
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data.distributed import DistributedSampler
 
-#Transformer 모델
-class TransformerModel(nn.Module):
-    def __init__(self, vocab_size, embed_dim, num_heads, num_layers, max_seq_len):
-        super(TransformerModel, self).__init__()
-        self.embedding = nn.Embedding(vocab_size, embed_dim)
-        self.positional_encoding = nn.Parameter(torch.zeros(1, max_seq_len, embed_dim))
-        self.transformer = nn.Transformer(
-            d_model=embed_dim,
-            nhead=num_heads,
-            num_encoder_layers=num_layers,
-            num_decoder_layers=num_layers,
-            batch_first=True
-        )
-        self.fc_out = nn.Linear(embed_dim, vocab_size)
-        
-    def forward(self, src, tgt):
-        src = self.embedding(src) + self.positional_encoding[:, :src.size(1), :]
-        tgt = self.embedding(tgt) + self.positional_encoding[:, :tgt.size(1), :]
-        output = self.transformer(src, tgt)
-        return self.fc_out(output)
-
-# 올바른 어휘 사전 생성
-def create_proper_vocab(dataset):
-    """실제 데이터에서 사용되는 문자들만으로 어휘 사전 생성"""
-    chars = set()
-    for item in dataset:
-        chars.update(item['input'])
-        chars.update(item['label'])
-    
-    # 특수 토큰 추가
-    chars.add('<PAD>')  # 패딩
-    chars.add('<EOS>')  # 문장 끝
-    
-    # 문자를 정렬하여 일관된 인덱싱
-    char_list = sorted(list(chars))
-    
-    # 문자 -> 인덱스, 인덱스 -> 문자 매핑
-    char_to_idx = {char: idx for idx, char in enumerate(char_list)}
-    idx_to_char = {idx: char for idx, char in enumerate(char_list)}
-    
-    return char_to_idx, idx_to_char, len(char_list)
+from acceleration import PRECISIONS, autocast, compile_model, enable_fastpaths, resolve_precision
+from checkpoint_manager import CheckpointManager
+from compiled_dataset import load_dataset_fast
+from reze_model import TransformerModel, causal_mask, padding_mask
+from reze_vocab import create_proper_vocab
+from token_cache import BucketBatchSampler, PaddedCollate, load_token_tensors, make_dataloader, sequence_lengths
 
 # 올바른 데이터셋 클래스
 class OptimizedDialogueDataset(data.Dataset):
+    """
+    토큰 캐시(token_cache.py)를 mmap한 (N, max_seq_len) 텐서에서 슬라이스
+    토큰화(어휘 id + <EOS>, <PAD> 패딩)는 어휘/JSON이 바뀔 때 한 번만 한다
+    """
     def __init__(self, data_path, char_to_idx, max_seq_len=50):
-        with open(data_path, 'r', encoding='utf-8') as f:
-            self.data = json.load(f)
-        
         self.char_to_idx = char_to_idx
         self.max_seq_len = max_seq_len
         self.pad_idx = char_to_idx['<PAD>']
         self.eos_idx = char_to_idx['<EOS>']
         
-    def __len__(self):
-        return len(self.data)
-    
-    def text_to_indices(self, text):
-        """텍스트를 인덱스로 변환"""
-        indices = []
-        for char in text:
-            if char in self.char_to_idx:
-                indices.append(self.char_to_idx[char])
-            else:
-                # 알 수 없는 문자는 패딩으로 처리
-                indices.append(self.pad_idx)
+        vocab = sorted(char_to_idx, key=char_to_idx.get)
+        self.inputs, self.targets = load_token_tensors(data_path, vocab, max_seq_len)
         
-        # EOS 토큰 추가
-        indices.append(self.eos_idx)
-        return indices
+    def __len__(self):
+        return len(self.inputs)
+    
+    def lengths(self):
+        """항목마다 input/target 중 긴 쪽의 길이 (<EOS> 포함, 버킷팅용)"""
+        return torch.maximum(sequence_lengths(self.inputs, self.pad_idx), sequence_lengths(self.targets, self.pad_idx))
     
     def __getitem__(self, idx):
-        item = self.data[idx]
-        
-        # 입력과 출력을 인덱스로 변환
-        input_indices = self.text_to_indices(item['input'])
-        target_indices = self.text_to_indices(item['label'])
-        
-        # 패딩 처리
-        if len(input_indices) < self.max_seq_len:
-            input_indices.extend([self.pad_idx] * (self.max_seq_len - len(input_indices)))
-        else:
-            input_indices = input_indices[:self.max_seq_len-1] + [self.eos_idx]
-            
-        if len(target_indices) < self.max_seq_len:
-            target_indices.extend([self.pad_idx] * (self.max_seq_len - len(target_indices)))
-        else:
-            target_indices = target_indices[:self.max_seq_len-1] + [self.eos_idx]
-        
-        return torch.tensor(input_indices, dtype=torch.long), torch.tensor(target_indices, dtype=torch.long)
+        return self.inputs[idx].long(), self.targets[idx].long()
 
-def train_optimized_model():
-    print("최적화된 모델 학습 시작!")
+def threads_per_worker(world_size):
+    """코어를 워커 수로 나눈 intra-op 스레드 수 (워커끼리 코어를 두고 다투지 않게)"""
+    return max(1, (os.cpu_count() or 1) // world_size)
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def _train_worker(rank, world_size, port, epochs, batch_size, max_batches, save, results, loader_workers=0,
+                  dynamic_padding=True, resume=None, precision='fp32', compiled=False):
+    """
+    학습 프로세스 하나 (world_size > 1이면 gloo 프로세스 그룹의 rank번 워커)
+    loader_workers: DataLoader 워커 프로세스 수 (에포크 사이에도 유지)
+    max_batches: 에포크마다 처리할 배치 수 상한 (스케일링 측정용)
+    results: rank 0이 처리량 {'samples', 'tokens', 'seconds', 'epoch_seconds'}를 넣는 큐 (없으면 무시)
+    dynamic_padding: 길이 버킷 배치 + 배치별 최대 길이까지만 패딩 + key padding 마스크
+                     (False면 예전처럼 max_seq_len 고정 패딩, 마스크 없음)
+    resume: True면 최신 학습 상태 파일에서, 경로면 그 파일에서 이어서 학습
+    precision: 'fp32' 또는 'bf16' (CPU bf16 autocast, 지원 안 되면 fp32), compiled: torch.compile 사용 (acceleration.py)
+    """
+    distributed = world_size > 1
+    if distributed:
+        os.environ['MASTER_ADDR'] = '127.0.0.1'
+        os.environ['MASTER_PORT'] = str(port)
+        dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(threads_per_worker(world_size))
+    log = print if rank == 0 else (lambda *args, **kwargs: None)
+    
+    log("최적화된 모델 학습 시작!")
     
     # 1. 데이터 로드 및 어휘 사전 생성
-    with open('./dataset.json', 'r', encoding='utf-8') as f:
-        raw_data = json.load(f)
+    raw_data = load_dataset_fast('./dataset.json')
     
-    char_to_idx, idx_to_char, vocab_size = create_proper_vocab(raw_data)
+    if hasattr(raw_data, 'vocab'):
+        # 컴파일 단계에서 create_proper_vocab와 같은 순서로 만들어 둔 어휘
+        char_to_idx, idx_to_char, vocab_size = raw_data.vocab()
+    else:
+        char_to_idx, idx_to_char, vocab_size = create_proper_vocab(raw_data)
     
-    print(f"최적화된 Vocab Size: {vocab_size}")
-    print(f"어휘 사전 예시: {list(char_to_idx.items())[:10]}")
+    log(f"최적화된 Vocab Size: {vocab_size}")
+    log(f"어휘 사전 예시: {list(char_to_idx.items())[:10]}")
     
-    # 2. 데이터셋 및 데이터로더 생성
+    # 2. 데이터셋 및 데이터로더 생성 (분산이면 워커마다 겹치지 않는 부분만)
     max_seq_len = 50
     dataset = OptimizedDialogueDataset('./dataset.json', char_to_idx, max_seq_len)
-    dataloader = data.DataLoader(dataset, batch_size=16, shuffle=True)
+    pad_idx = char_to_idx['<PAD>']
+    if dynamic_padding:
+        # 길이가 비슷한 항목끼리 배치 (분산이면 배치 단위로 워커에 나눔)
+        sampler = BucketBatchSampler(dataset.lengths(), batch_size, num_replicas=world_size, rank=rank)
+        dataloader = make_dataloader(dataset, batch_size, num_workers=loader_workers, batch_sampler=sampler,
+                                     collate_fn=PaddedCollate(pad_idx))
+    else:
+        sampler = DistributedSampler(dataset, num_replicas=world_size, rank=rank, shuffle=True) if distributed else None
+        dataloader = make_dataloader(dataset, batch_size, shuffle=True, sampler=sampler, num_workers=loader_workers)
     
     # 3. 모델 초기화
     embed_dim = 128
@@ -120,21 +109,62 @@ def train_optimized_model():
     
     # 4. 학습 설정
     device = torch.device('cpu')  # 안정성을 위해 CPU 사용
+    enable_fastpaths(device)
+    precision = resolve_precision(precision, device)
     model = model.to(device)
-    
-    criterion = nn.CrossEntropyLoss(ignore_index=char_to_idx['<PAD>'])
+    criterion = nn.CrossEntropyLoss(ignore_index=pad_idx)
     optimizer = torch.optim.Adam(model.parameters(), lr=0.001)
     
-    epochs = 15
+    # 체크포인트: 최근 학습 상태 3개 + 최저 손실 추론 스냅샷, 쓰기는 rank 0의 백그라운드 스레드
+    writer = save and rank == 0
+    checkpoints = CheckpointManager('reze_optimized', keep_last=3, async_save=writer)
+    start_epoch = checkpoints.resume(model, optimizer, None if resume is True else resume) if resume else 0
+    checkpoint_meta = {
+        'vocab_size': vocab_size,
+        'embed_dim': embed_dim,
+        'num_heads': num_heads,
+        'num_layers': num_layers,
+        'max_seq_len': max_seq_len,
+        'char_to_idx': char_to_idx,
+        'idx_to_char': idx_to_char,
+        'causal': True,
+        'padding_mask': dynamic_padding
+    }
+    
+    # DDP는 생성할 때 rank 0의 가중치를 모든 워커에 복사하고, backward 중에 기울기를 평균냄
+    train_model = DistributedDataParallel(model) if distributed else model
+    if compiled:
+        # 저장/재개는 계속 원래 model로 (컴파일된 래퍼와 파라미터 공유)
+        example = torch.randint(vocab_size, (2, 8), device=device)
+        example_masks = {}
+        if dynamic_padding:
+            example_masks = {'src_key_padding_mask': padding_mask(example, pad_idx),
+                             'tgt_key_padding_mask': padding_mask(example, pad_idx)}
+        eager_model = train_model
+        train_model = compile_model(eager_model, (example, example),
+                                    dict(tgt_mask=causal_mask(8, device), **example_masks), precision, device)
+        compiled = train_model is not eager_model
     
-    print(f"학습 시작: {epochs} epochs, vocab_size={vocab_size}")
+    log(f"학습 시작: {epochs} epochs, vocab_size={vocab_size}, 워커 {world_size}개 x 스레드 {torch.get_num_threads()}개, "
+        f"{'동적' if dynamic_padding else '고정'} 패딩, {precision}{', torch.compile' if compiled else ''}")
     
     # 5. 학습 루프
-    for epoch in range(epochs):
-        model.train()
+    num_batches = len(dataloader) if max_batches is None else min(max_batches, len(dataloader))
+    samples = 0
+    tokens = 0
+    avg_loss = checkpoints.best_loss
+    epoch_seconds = []
+    start = time.perf_counter()
+    for epoch in range(start_epoch, epochs):
+        epoch_start = time.perf_counter()
+        train_model.train()
+        if sampler is not None:
+            sampler.set_epoch(epoch)
         total_loss = 0.0
         
         for batch_idx, (inputs, targets) in enumerate(dataloader):
+            if batch_idx >= num_batches:
+                break
             inputs, targets = inputs.to(device), targets.to(device)
             
             optimizer.zero_grad()
@@ -143,47 +173,185 @@ def train_optimized_model():
             tgt_input = targets[:, :-1]  # 마지막 제외
             tgt_output = targets[:, 1:]  # 첫 번째 제외
             
-            # Forward pass
-            output = model(inputs, tgt_input)
-            
-            # Loss 계산
-            loss = criterion(output.reshape(-1, vocab_size), tgt_output.reshape(-1))
+            # Forward pass (인과 마스크: 추론 때 한 토큰씩 생성하는 것과 같은 조건)
+            masks = {}
+            if dynamic_padding:
+                masks = {'src_key_padding_mask': padding_mask(inputs, pad_idx),
+                         'tgt_key_padding_mask': padding_mask(tgt_input, pad_idx)}
+            with autocast(device, precision):
+                output = train_model(inputs, tgt_input, tgt_mask=causal_mask(tgt_input.size(1), device), **masks)
+                
+                # Loss 계산 (autocast 안에서도 cross_entropy는 fp32)
+                loss = criterion(output.reshape(-1, vocab_size), tgt_output.reshape(-1))
             loss.backward()
             
             # Gradient clipping
-            torch.nn.utils.clip_grad_norm_(model.parameters(), max_norm=1.0)
+            torch.nn.utils.clip_grad_norm_(train_model.parameters(), max_norm=1.0)
             
             optimizer.step()
             total_loss += loss.item()
+            samples += inputs.size(0)
+            tokens += int((inputs != pad_idx).sum()) + int((targets != pad_idx).sum())
             
             if batch_idx % 10 == 0:
-                print(f"  Batch {batch_idx}/{len(dataloader)}, Loss: {loss.item():.4f}")
+                log(f"  Batch {batch_idx}/{num_batches}, Loss: {loss.item():.4f}")
         
-        avg_loss = total_loss / len(dataloader)
-        print(f"Epoch {epoch+1}/{epochs} 완료! Average Loss: {avg_loss:.4f}")
+        avg_loss = total_loss / num_batches
+        if distributed:
+            # 워커별 평균 손실의 평균
+            loss_tensor = torch.tensor([avg_loss])
+            dist.all_reduce(loss_tensor)
+            avg_loss = loss_tensor.item() / world_size
+        epoch_seconds.append(time.perf_counter() - epoch_start)
+        log(f"Epoch {epoch+1}/{epochs} 완료! Average Loss: {avg_loss:.4f} ({epoch_seconds[-1]:.1f}s)")
         
-        # 에포크마다 체크포인트 저장
-        checkpoint = {
-            'epoch': epoch + 1,
-            'model_state_dict': model.state_dict(),
-            'optimizer_state_dict': optimizer.state_dict(),
-            'loss': avg_loss,
-            'vocab_size': vocab_size,
-            'embed_dim': embed_dim,
-            'num_heads': num_heads,
-            'num_layers': num_layers,
-            'max_seq_len': max_seq_len,
-            'char_to_idx': char_to_idx,
-            'idx_to_char': idx_to_char
-        }
-        torch.save(checkpoint, f"reze_optimized_epoch_{epoch+1}.pth")
-        print(f"체크포인트 저장: reze_optimized_epoch_{epoch+1}.pth")
-    
-    # 최종 모델 저장
-    torch.save(checkpoint, "reze_optimized_final.pth")
-    print(f"최적화된 모델 학습 완료! 최종 Loss: {avg_loss:.4f}")
+        # 에포크마다 체크포인트 저장 (rank 0만, DDP 래퍼가 아닌 원래 모델의 state_dict)
+        if writer:
+            checkpoints.save(epoch + 1, avg_loss, model, optimizer, checkpoint_meta)
+    
+    elapsed = time.perf_counter() - start
+    if distributed:
+        counts = torch.tensor([float(samples), float(tokens)])
+        dist.all_reduce(counts)
+        samples, tokens = int(counts[0]), int(counts[1])
     
+    # 최종 모델 저장 (추론 스냅샷: 옵티마이저 상태 없음)
+    if writer:
+        checkpoints.save_inference("reze_optimized_final.pth", model, checkpoint_meta, epochs, avg_loss)
+        checkpoints.close()
+        print(f"최적화된 모델 학습 완료! 최종 Loss: {avg_loss:.4f}")
+    if results is not None and rank == 0:
+        results.put({'samples': samples, 'tokens': tokens, 'seconds': elapsed, 'epoch_seconds': epoch_seconds})
+    
+    if distributed:
+        dist.destroy_process_group()
     return model, char_to_idx, idx_to_char
 
+def train_optimized_model(workers=1, epochs=15, batch_size=16, max_batches=None, save=True, results=None,
+                          loader_workers=0, dynamic_padding=True, resume=None, precision='fp32', compiled=False):
+    """
+    workers > 1이면 CPU 프로세스 workers개로 DistributedDataParallel 학습 (gloo 백엔드)
+    batch_size는 워커당 크기 (전체 배치 = batch_size x workers)
+    loader_workers: 학습 프로세스마다 DataLoader 워커 수
+    dynamic_padding: 길이 버킷팅 + 배치별 패딩 + key padding 마스크 (False면 max_seq_len 고정 패딩)
+    resume: True면 최신 reze_optimized_epoch_N.pth에서, 경로면 그 파일에서 이어서 학습
+    precision: 'fp32'(기본) 또는 'bf16' autocast, compiled: torch.compile (둘 다 지원 안 되면 fp32 eager)
+    단일 프로세스일 때만 (model, char_to_idx, idx_to_char) 반환
+    """
+    if workers <= 1:
+        return _train_worker(0, 1, None, epochs, batch_size, max_batches, save, results, loader_workers,
+                             dynamic_padding, resume, precision, compiled)
+    mp.spawn(_train_worker, args=(workers, _free_port(), epochs, batch_size, max_batches, save, results,
+                                  loader_workers, dynamic_padding, resume, precision, compiled),
+             nprocs=workers, join=True)
+
+def scaling_report(worker_counts=None, batches=20, batch_size=16):
+    """
+    워커 수별 처리량(samples/sec) 측정 (에포크 1번, 워커당 batches개 배치, 체크포인트 저장 없음)
+    반환: [{'workers', 'samples_per_sec', 'speedup', 'efficiency'}, ...]
+    """
+    if worker_counts is None:
+        cores = os.cpu_count() or 1
+        worker_counts = [1]
+        while worker_counts[-1] * 2 <= cores:
+            worker_counts.append(worker_counts[-1] * 2)
+    
+    results = mp.get_context('spawn').SimpleQueue()
+    report = []
+    for workers in worker_counts:
+        train_optimized_model(workers, epochs=1, batch_size=batch_size, max_batches=batches, save=False,
+                              results=results)
+        measured = results.get()
+        rate = measured['samples'] / measured['seconds']
+        base = report[0]['samples_per_sec'] if report else rate
+        report.append({
+            'workers': workers,
+            'samples_per_sec': round(rate, 1),
+            'speedup': round(rate / base, 2),
+            'efficiency': round(rate / base / (workers / worker_counts[0]), 2),
+        })
+    
+    print(f"{'workers':>8} {'threads':>8} {'samples/sec':>12} {'speedup':>8} {'efficiency':>10}")
+    for row in report:
+        print(f"{row['workers']:>8} {threads_per_worker(row['workers']):>8} {row['samples_per_sec']:>12.1f} "
+              f"{row['speedup']:>8.2f} {row['efficiency']:>10.2f}")
+    return report
+
+def padding_report(batches=50, batch_size=16):
+    """
+    고정 패딩(max_seq_len) vs 동적 패딩(길이 버킷 + 배치별 길이)의 처리량 비교
+    tokens/sec는 <PAD>를 뺀 실제 토큰 기준 (단일 프로세스, 에포크 1번, 체크포인트 저장 없음)
+    """
+    results = mp.get_context('spawn').SimpleQueue()
+    report = []
+    for dynamic_padding in (False, True):
+        train_optimized_model(1, epochs=1, batch_size=batch_size, max_batches=batches, save=False,
+                              results=results, dynamic_padding=dynamic_padding)
+        measured = results.get()
+        report.append({
+            'padding': 'dynamic' if dynamic_padding else 'fixed',
+            'tokens_per_sec': round(measured['tokens'] / measured['seconds'], 1),
+            'samples_per_sec': round(measured['samples'] / measured['seconds'], 1),
+        })
+    
+    print(f"{'padding':>8} {'tokens/sec':>12} {'samples/sec':>12}")
+    for row in report:
+        print(f"{row['padding']:>8} {row['tokens_per_sec']:>12.1f} {row['samples_per_sec']:>12.1f}")
+    print(f"speedup: {report[1]['tokens_per_sec'] / report[0]['tokens_per_sec']:.2f}x")
+    return report
+
+def acceleration_report(epochs=2, batch_size=16, max_batches=None):
+    """
+    fp32/bf16 x eager/torch.compile 조합별 에포크 wall time (dataset.json 전체, 단일 프로세스, 체크포인트 저장 없음)
+    첫 에포크는 컴파일 시간이 들어가므로 steady_epoch_s(두 번째 에포크부터 평균)를 같이 보고, tokens_per_sec도 그 기준
+    지원하지 않는 조합은 fp32 eager로 돌아가므로 숫자가 fp32 eager와 비슷하게 나옴
+    """
+    results = mp.get_context('spawn').SimpleQueue()
+    report = []
+    for compiled in (False, True):
+        for precision in PRECISIONS:
+            train_optimized_model(1, epochs=epochs, batch_size=batch_size, max_batches=max_batches, save=False,
+                                  results=results, precision=precision, compiled=compiled)
+            measured = results.get()
+            times = measured['epoch_seconds']
+            steady = times[1:] or times
+            steady_epoch_s = sum(steady) / len(steady)
+            report.append({
+                'precision': precision,
+                'compile': compiled,
+                'epoch_s': [round(t, 2) for t in times],
+                'steady_epoch_s': round(steady_epoch_s, 2),
+                # 속도 비율과 같은 기준 (에포크마다 토큰 수가 같으므로 에포크당 토큰 / steady 에포크 시간)
+                'tokens_per_sec': round(measured['tokens'] / len(times) / steady_epoch_s, 1),
+            })
+    
+    base = report[0]['steady_epoch_s']
+    print(f"{'precision':>9} {'compile':>8} {'epoch 1 s':>10} {'steady s':>9} {'tokens/sec':>11} {'speedup':>8}")
+    for row in report:
+        print(f"{row['precision']:>9} {str(row['compile']):>8} {row['epoch_s'][0]:>10.2f} {row['steady_epoch_s']:>9.2f} "
+              f"{row['tokens_per_sec']:>11.1f} {base / row['steady_epoch_s']:>8.2f}")
+    return report
+
 if __name__ == "__main__":
-    train_optimized_model()
\ No newline at end of file
+    # 사용법: python3 train_optimized_model.py [--workers N] [--loader-workers N] [--resume [체크포인트.pth]]
+    #         python3 train_optimized_model.py --scaling-report [워커 수 ...]
+    #         python3 train_optimized_model.py [--bf16] [--compile]
+    #         python3 train_optimized_model.py --padding-report
+    #         python3 train_optimized_model.py --acceleration-report [에포크 수]
+    if '--padding-report' in sys.argv:
+        print(json.dumps(padding_report()))
+    elif '--acceleration-report' in sys.argv:
+        rest = sys.argv[sys.argv.index('--acceleration-report') + 1:]
+        print(json.dumps(acceleration_report(int(rest[0]) if rest else 2)))
+    elif '--scaling-report' in sys.argv:
+        counts = [int(a) for a in sys.argv[sys.argv.index('--scaling-report') + 1:]]
+        print(json.dumps(scaling_report(counts or None)))
+    else:
+        workers = int(sys.argv[sys.argv.index('--workers') + 1]) if '--workers' in sys.argv else 1
+        loader_workers = int(sys.argv[sys.argv.index('--loader-workers') + 1]) if '--loader-workers' in sys.argv else 0
+        resume = None
+        if '--resume' in sys.argv:
+            rest = sys.argv[sys.argv.index('--resume') + 1:]
+            resume = rest[0] if rest and not rest[0].startswith('--') else True
+        train_optimized_model(workers, loader_workers=loader_workers, resume=resume,
+                              precision='bf16' if '--bf16' in sys.argv else 'fp32', compiled='--compile' in sys.argv)